@@ -0,0 +1,143 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+Benchmark the confidence cascade of score.py against the full model, for a sweep of thresholds.
+
+Every data file is scored by the full model, then by the cascade at every threshold. A run reports
+the share of inputs escalated to the full model, the throughput and the agreement with the full
+model. Accuracy and its delta to the full model are only reported for files with labels:
+`datasets/test.jsonl` has none (every label is -1), so its quality is measured as agreement with
+the full model, and accuracy is measured on `datasets/validation.jsonl`.
+
+    python benchmark_cascade.py --model_dir model --draft_layers 4 --thresholds 0.7 0.8 0.9
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create_deployment"))
+
+from cascade import ConfidenceCascade, TruncatedDraft, check_labels  # noqa: E402
+from torch_engine import TorchDeployment  # noqa: E402
+
+DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "datasets")
+UNLABELED = -1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the confidence cascade against the full model")
+    parser.add_argument("--model_dir", type=str, help="Directory of the fine-tuned Hugging Face model", required=True)
+    parser.add_argument("--draft_layers", type=int, help="Transformer layers run by the draft classifier", default=None)
+    parser.add_argument("--draft_model_dir", type=str, help="Directory of a distilled draft classifier", default=None)
+    parser.add_argument(
+        "--thresholds", type=float, nargs="+", help="Confidence thresholds to measure", default=[0.6, 0.7, 0.8, 0.9]
+    )
+    parser.add_argument(
+        "--data_files",
+        type=str,
+        nargs="+",
+        help="JSONL files with sentence and label columns",
+        default=[os.path.join(DATASETS_DIR, "validation.jsonl"), os.path.join(DATASETS_DIR, "test.jsonl")],
+    )
+    parser.add_argument("--batch_size", type=int, help="Number of sentences per prediction", default=32)
+    parser.add_argument("--num_threads", type=int, help="torch intra-op threads, all cores if not set", default=None)
+    parser.add_argument("--max_length", type=int, help="Maximum sequence length", default=128)
+    parser.add_argument("--output_json", type=str, help="Path to save the benchmark results", default=None)
+    return parser.parse_args()
+
+
+def load_dataset(data_file):
+    sentences, labels = [], []
+    with open(data_file, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                sentences.append(record["sentence"])
+                labels.append(int(record.get("label", UNLABELED)))
+    return sentences, labels
+
+
+def measure(predict_fn, sentences, batch_size):
+    """Predict the sentences in batches and return the predictions and the throughput."""
+    predictions = []
+    start = time.perf_counter()
+    for i in range(0, len(sentences), batch_size):
+        predictions.extend(predict_fn(sentences[i:i + batch_size]))
+    duration_s = time.perf_counter() - start
+    return predictions, round(len(sentences) / duration_s, 2)
+
+
+def accuracy(predictions, labels, label2id):
+    """Return the accuracy over the labeled rows, None when no row is labeled."""
+    labeled = [(prediction, label) for prediction, label in zip(predictions, labels) if label != UNLABELED]
+    if not labeled:
+        return None
+    return round(sum(label2id.get(prediction, prediction) == label for prediction, label in labeled) / len(labeled), 4)
+
+
+def main():
+    args = parse_args()
+    print(args)
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    if (args.draft_layers is None) == (args.draft_model_dir is None):
+        raise ValueError("Set exactly one of --draft_layers and --draft_model_dir")
+
+    full = TorchDeployment(args.model_dir, max_length=args.max_length)
+    full.prepare_prediction_service()
+    if args.draft_model_dir:
+        draft = TorchDeployment(args.draft_model_dir, max_length=args.max_length)
+        draft.prepare_prediction_service()
+    else:
+        draft = TruncatedDraft(full, args.draft_layers)
+    check_labels(draft, full)
+    label2id = {label: class_id for class_id, label in full.id2label.items()}
+    # untimed pass so lazy allocations do not count against the first run
+    full.predict(["warm up"] * 8)
+    draft.logits(["warm up"] * 8)
+
+    results = {"model_dir": args.model_dir, "draft": args.draft_model_dir or f"{args.draft_layers} layers", "files": []}
+    for data_file in args.data_files:
+        sentences, labels = load_dataset(data_file)
+        full_predictions, full_throughput = measure(full.predict, sentences, args.batch_size)
+        full_accuracy = accuracy(full_predictions, labels, label2id)
+        file_results = {
+            "data_file": data_file,
+            "sentences": len(sentences),
+            "labeled": sum(label != UNLABELED for label in labels),
+            "full": {"throughput_sentences_per_s": full_throughput, "accuracy": full_accuracy},
+            "runs": [],
+        }
+        for threshold in args.thresholds:
+            cascade = ConfidenceCascade(draft, full.predict, threshold)
+            predictions, throughput = measure(cascade.predict, sentences, args.batch_size)
+            run_accuracy = accuracy(predictions, labels, label2id)
+            run = {
+                "threshold": threshold,
+                "escalation_rate": cascade.stats()["escalation_rate"],
+                "throughput_sentences_per_s": throughput,
+                "speedup": round(throughput / full_throughput, 3),
+                "agreement_with_full": round(
+                    sum(a == b for a, b in zip(predictions, full_predictions)) / len(sentences), 4
+                ),
+                "accuracy": run_accuracy,
+                "accuracy_delta": round(run_accuracy - full_accuracy, 4) if run_accuracy is not None else None,
+            }
+            file_results["runs"].append(run)
+            print(f"{os.path.basename(data_file)} {json.dumps(run)}")
+        results["files"].append(file_results)
+        print(f"{os.path.basename(data_file)} full model {json.dumps(file_results['full'])}")
+
+    if args.output_json:
+        with open(args.output_json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
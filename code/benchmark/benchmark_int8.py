@@ -0,0 +1,122 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Benchmark latency, throughput and accuracy of the int8 dynamically quantized model against fp32."""
+
+import io
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+
+import torch
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create_deployment"))
+
+from quantization import quantize_dynamic_int8  # noqa: E402
+from load_generator import percentile  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark int8 against fp32 inference")
+    parser.add_argument("--model_dir", type=str, help="Directory of the fine-tuned Hugging Face model", required=True)
+    parser.add_argument(
+        "--data_file",
+        type=str,
+        help="JSONL file with sentence and label columns",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "datasets", "validation.jsonl"),
+    )
+    parser.add_argument("--batch_sizes", type=int, nargs="+", help="Batch sizes to measure", default=[1, 8, 32])
+    parser.add_argument("--num_threads", type=int, help="torch intra-op threads, all cores if not set", default=None)
+    parser.add_argument("--max_length", type=int, help="Maximum sequence length", default=128)
+    parser.add_argument("--output_json", type=str, help="Path to save the benchmark results", default=None)
+    return parser.parse_args()
+
+
+def load_dataset(data_file):
+    sentences, labels = [], []
+    with open(data_file, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                sentences.append(record["sentence"])
+                labels.append(record["label"])
+    return sentences, labels
+
+
+def model_size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return round(buffer.tell() / 1e6, 1)
+
+
+def measure(model, tokenizer, sentences, labels, batch_size, max_length):
+    """Predict the dataset in batches and return latency, throughput, accuracy and the predicted classes."""
+    latencies = []
+    predictions = []
+    start = time.perf_counter()
+    with torch.no_grad():
+        for i in range(0, len(sentences), batch_size):
+            batch_start = time.perf_counter()
+            encoded = tokenizer(
+                sentences[i:i + batch_size], padding=True, truncation=True, max_length=max_length, return_tensors="pt"
+            )
+            logits = model(**encoded).logits
+            predictions.extend(logits.argmax(dim=-1).tolist())
+            latencies.append(time.perf_counter() - batch_start)
+    duration_s = time.perf_counter() - start
+    latencies.sort()
+    correct = sum(int(prediction == label) for prediction, label in zip(predictions, labels))
+    return {
+        "batch_size": batch_size,
+        "latency_ms_p50": round(percentile(latencies, 50) * 1000, 3),
+        "latency_ms_p95": round(percentile(latencies, 95) * 1000, 3),
+        "throughput_sentences_per_s": round(len(sentences) / duration_s, 2),
+        "accuracy": round(correct / len(labels), 4),
+    }, predictions
+
+
+def main():
+    args = parse_args()
+    print(args)
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+
+    sentences, labels = load_dataset(args.data_file)
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir)
+    fp32_model = AutoModelForSequenceClassification.from_pretrained(args.model_dir).eval()
+    int8_model = quantize_dynamic_int8(copy.deepcopy(fp32_model))
+    models = {"fp32": fp32_model, "int8": int8_model}
+
+    results = {"data_file": args.data_file, "sentences": len(sentences), "torch_threads": torch.get_num_threads()}
+    predicted = {}
+    for name, model in models.items():
+        results[name] = {"model_size_mb": model_size_mb(model), "runs": []}
+        # untimed pass so lazy allocations do not count against the first batch size
+        measure(model, tokenizer, sentences[:8], labels[:8], 8, args.max_length)
+        for batch_size in args.batch_sizes:
+            run, predicted[name] = measure(model, tokenizer, sentences, labels, batch_size, args.max_length)
+            results[name]["runs"].append(run)
+            print(f"{name} {json.dumps(run)}")
+
+    agreement = sum(int(a == b) for a, b in zip(predicted["fp32"], predicted["int8"])) / len(sentences)
+    results["int8_fp32_agreement"] = round(agreement, 4)
+    results["accuracy_delta"] = round(results["int8"]["runs"][-1]["accuracy"] - results["fp32"]["runs"][-1]["accuracy"], 4)
+    for fp32_run, int8_run in zip(results["fp32"]["runs"], results["int8"]["runs"]):
+        speedup = int8_run["throughput_sentences_per_s"] / fp32_run["throughput_sentences_per_s"]
+        print(f"batch {fp32_run['batch_size']}: int8 throughput x{speedup:.2f}")
+    print(
+        f"model size {results['fp32']['model_size_mb']}MB -> {results['int8']['model_size_mb']}MB, "
+        f"accuracy delta {results['accuracy_delta']}, prediction agreement {results['int8_fp32_agreement']}"
+    )
+
+    if args.output_json:
+        with open(args.output_json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Microbenchmark comparing the json codecs of score on batch payloads built from the datasets."""
+
+import os
+import sys
+import json
+import timeit
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create_deployment"))
+
+from json_codec import CODECS, orjson  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark score json codecs")
+    parser.add_argument(
+        "--data_file",
+        type=str,
+        help="JSONL file with a sentence column",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "datasets", "test.jsonl"),
+    )
+    parser.add_argument("--batch_size", type=int, help="Number of sentences per request", default=32)
+    parser.add_argument("--num_classes", type=int, help="Number of classes in the probability arrays", default=2)
+    parser.add_argument("--iterations", type=int, help="Timed iterations per measurement", default=2000)
+    return parser.parse_args()
+
+
+def load_sentences(data_file, batch_size):
+    with open(data_file, encoding="utf-8") as f:
+        sentences = [json.loads(line)["sentence"] for line in f if line.strip()]
+    return sentences[:batch_size]
+
+
+def build_payloads(sentences, num_classes):
+    """Build a request body and the matching classification response carrying probability arrays."""
+    rng = np.random.default_rng(0)
+    logits = rng.standard_normal((len(sentences), num_classes)).astype(np.float32)
+    probabilities = np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+    request_body = json.dumps({"inputs": sentences})
+    response = [
+        {
+            "label": int(np.argmax(row)),
+            "score": row.max(),
+            "probabilities": row,
+        }
+        for row in probabilities
+    ]
+    return request_body, response
+
+
+def main():
+    args = parse_args()
+    sentences = load_sentences(args.data_file, args.batch_size)
+    request_body, response = build_payloads(sentences, args.num_classes)
+    print(f"batch of {len(sentences)} sentences, {args.num_classes} classes, {args.iterations} iterations")
+    if orjson is None:
+        print("orjson is not installed, only the stdlib codec is measured")
+
+    results = {}
+    for name, codec_cls in CODECS.items():
+        try:
+            codec = codec_cls()
+        except ImportError:
+            continue
+        decode_s = timeit.timeit(lambda: codec.decode(request_body), number=args.iterations)
+        encode_s = timeit.timeit(lambda: codec.encode(response), number=args.iterations)
+        results[name] = (decode_s, encode_s)
+        print(
+            f"{name:>8}: decode {decode_s / args.iterations * 1e6:8.1f} us/request, "
+            f"encode {encode_s / args.iterations * 1e6:8.1f} us/response"
+        )
+
+    if len(results) == len(CODECS):
+        baseline = results["json"]
+        fast = results["orjson"]
+        print(f"orjson speedup: decode x{baseline[0] / fast[0]:.1f}, encode x{baseline[1] / fast[1]:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+Benchmark the throughput scaling of local_score_server.py from 1 to N preforked workers.
+
+Every worker count starts its own server, replays the dataset through the load generator and stops
+the server. Run it with a real model, e.g. `--env_json` selecting the torch engine, on the instance
+type of the deployment (8 vCPUs for Standard_F8s_v2).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import urllib.request
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create_deployment"))
+
+from load_generator import LoadGenerator, load_payloads  # noqa: E402
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_deployment", "local_score_server.py")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark throughput scaling of preforked scoring workers")
+    parser.add_argument("--model_dir", type=str, help="Local model directory, used as AZUREML_MODEL_DIR", default="model")
+    parser.add_argument(
+        "--env_json",
+        type=str,
+        help="Path of a JSON file with the deployment environment variables built by deploy.py",
+        default=None,
+    )
+    parser.add_argument("--stub_model", action="store_true", help="Serve a stub Deployment instead of a real model")
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        nargs="+",
+        help="Worker counts to measure",
+        default=[1, 2, 4, 8],
+    )
+    parser.add_argument("--port", type=int, help="Port of the local server", default=5011)
+    parser.add_argument(
+        "--request_file",
+        type=str,
+        help="JSONL file of endpoint requests or dataset sentences",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "datasets", "test.jsonl"),
+    )
+    parser.add_argument("--batch_size", type=int, help="Sentences per request", default=8)
+    parser.add_argument("--clients_per_worker", type=int, help="Concurrent clients per worker", default=2)
+    parser.add_argument("--duration_s", type=float, help="Duration of every measurement in seconds", default=30)
+    parser.add_argument("--startup_timeout_s", type=float, help="Time allowed for a server to start", default=300)
+    parser.add_argument("--output_json", type=str, help="Path to save the benchmark results", default=None)
+    return parser.parse_args()
+
+
+def wait_until_healthy(url, process, timeout_s):
+    deadline = time.perf_counter() + timeout_s
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            time.sleep(0.5)
+    raise TimeoutError(f"Server not healthy after {timeout_s}s")
+
+
+def start_server(args, num_workers):
+    command = [
+        sys.executable, SERVER_SCRIPT,
+        "--port", str(args.port),
+        "--model_dir", args.model_dir,
+        "--num_workers", str(num_workers),
+        "--max_concurrent_requests_per_instance", str(args.clients_per_worker),
+        # let the clients queue instead of measuring 429s
+        "--max_queue_wait_ms", "60000",
+        "--request_timeout_ms", "60000",
+    ]
+    if args.env_json is not None:
+        command += ["--env_json", args.env_json]
+    if args.stub_model:
+        command.append("--stub_model")
+    return subprocess.Popen(command)
+
+
+def measure(args, num_workers, payloads):
+    """Serve with `num_workers` workers and return the load generator report."""
+    base_url = f"http://127.0.0.1:{args.port}"
+    process = start_server(args, num_workers)
+    try:
+        wait_until_healthy(f"{base_url}/", process, args.startup_timeout_s)
+        # untimed pass so every worker is warm before measuring
+        warmup = LoadGenerator(f"{base_url}/score", concurrency=num_workers * args.clients_per_worker, duration_s=2)
+        warmup.run(payloads)
+        generator = LoadGenerator(
+            f"{base_url}/score",
+            concurrency=num_workers * args.clients_per_worker,
+            duration_s=args.duration_s,
+        )
+        return generator.run(payloads)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    args = parse_args()
+    print(args)
+
+    payloads = load_payloads(args.request_file, args.batch_size)
+    results = {"cpu_count": os.cpu_count(), "batch_size": args.batch_size, "runs": []}
+    for num_workers in args.num_workers:
+        report = measure(args, num_workers, payloads)
+        run = {
+            "num_workers": num_workers,
+            "throughput_rps": report["throughput_rps"],
+            "throughput_sentences_per_s": round(report["throughput_rps"] * args.batch_size, 2),
+            "latency_ms_p50": report["latency_ms"]["p50"],
+            "latency_ms_p95": report["latency_ms"]["p95"],
+            "error_rate": report["error_rate"],
+        }
+        results["runs"].append(run)
+        print(json.dumps(run))
+
+    baseline = results["runs"][0]
+    for run in results["runs"]:
+        speedup = run["throughput_rps"] / baseline["throughput_rps"] if baseline["throughput_rps"] else 0.0
+        run["speedup"] = round(speedup, 2)
+        run["efficiency"] = round(speedup * baseline["num_workers"] / run["num_workers"], 2)
+        print(f"{run['num_workers']} workers: x{run['speedup']:.2f} throughput, efficiency {run['efficiency']:.2f}")
+
+    if args.output_json:
+        with open(args.output_json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
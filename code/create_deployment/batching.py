@@ -0,0 +1,143 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the micro-batching layer used by score."""
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+logger = get_logger_app()
+
+
+def is_text_batch(inputs):
+    """Check if the inputs are a non-empty list of sentences that can be batched."""
+    return isinstance(inputs, list) and len(inputs) > 0 and all(isinstance(item, str) for item in inputs)
+
+
+def split_predictions(predictions, sizes):
+    """Split batched `predictions` into consecutive chunks of `sizes` rows."""
+    if isinstance(predictions, dict):
+        parts = [{} for _ in sizes]
+        for key, value in predictions.items():
+            for part, chunk in zip(parts, split_predictions(value, sizes)):
+                part[key] = chunk
+        return parts
+    if len(predictions) != sum(sizes):
+        raise ValueError(
+            f"Batched prediction returned {len(predictions)} rows for {sum(sizes)} inputs"
+        )
+    parts = []
+    start = 0
+    for size in sizes:
+        parts.append(predictions[start:start + size])
+        start += size
+    return parts
+
+
+def concat_predictions(parts):
+    """Concatenate the predictions of consecutive chunks of inputs, the inverse of `split_predictions`."""
+    first = parts[0]
+    if isinstance(first, dict):
+        return {key: concat_predictions([part[key] for part in parts]) for key in first}
+    if isinstance(first, np.ndarray):
+        return np.concatenate(parts)
+    if hasattr(first, "iloc"):
+        import pandas as pd
+
+        return pd.concat(parts, ignore_index=True)
+    return [row for part in parts for row in part]
+
+
+def take_predictions(predictions, indices):
+    """Return the prediction rows at `indices`, in that order."""
+    if isinstance(predictions, dict):
+        return {key: take_predictions(value, indices) for key, value in predictions.items()}
+    if isinstance(predictions, np.ndarray):
+        return predictions[indices]
+    if hasattr(predictions, "iloc"):
+        return predictions.iloc[indices].reset_index(drop=True)
+    return [predictions[index] for index in indices]
+
+
+class _PendingRequest:
+    """Inputs of one `run()` call waiting for their slice of a batched prediction."""
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Gather inputs from concurrent callers and run them through a single batched `predict_fn`.
+
+    A batch is flushed once it holds `max_batch_size` inputs or `max_wait_ms` elapsed since
+    its first request arrived. Every caller gets back the slice of the predictions matching its inputs.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=10):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._carry = None
+        self._worker = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, inputs):
+        """Queue `inputs` for the next batch and block until its predictions are ready."""
+        pending = _PendingRequest(inputs)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _next_batch(self):
+        """Block for the first request, then collect more until the batch is full or the window closes."""
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        batch = [first]
+        batch_size = len(first.inputs)
+        deadline = time.monotonic() + self.max_wait_s
+        while batch_size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if batch_size + len(pending.inputs) > self.max_batch_size:
+                # keep the request for the next batch rather than overshooting this one
+                self._carry = pending
+                break
+            batch.append(pending)
+            batch_size += len(pending.inputs)
+        return batch
+
+    def _loop(self):
+        """Flush batches for as long as the process lives."""
+        while True:
+            batch = self._next_batch()
+            inputs = [item for pending in batch for item in pending.inputs]
+            logger.debug(f"Predicting micro-batch of {len(inputs)} inputs from {len(batch)} requests")
+            try:
+                predictions = self.predict_fn(inputs)
+                results = split_predictions(predictions, [len(pending.inputs) for pending in batch])
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+                    pending.done.set()
+                continue
+            for pending, result in zip(batch, results):
+                pending.result = result
+                pending.done.set()
@@ -0,0 +1,51 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the sequence length bucketing used by score."""
+
+import numpy as np
+
+from batching import concat_predictions, take_predictions
+
+
+def word_count(sentence):
+    """Approximate the token length of a sentence without running the tokenizer."""
+    return len(sentence.split())
+
+
+def bucket_indices(lengths, boundaries):
+    """
+    Group input indices into length buckets.
+
+    Bucket `i` holds the inputs whose length is at most `boundaries[i]` and above the previous
+    boundary, the last bucket everything longer. Indices are sorted by length inside every bucket.
+    """
+    order = sorted(range(len(lengths)), key=lambda index: lengths[index])
+    buckets = [[] for _ in range(len(boundaries) + 1)]
+    bucket = 0
+    for index in order:
+        while bucket < len(boundaries) and lengths[index] > boundaries[bucket]:
+            bucket += 1
+        buckets[bucket].append(index)
+    return [indices for indices in buckets if indices]
+
+
+class LengthBucketer:
+    """Predict inputs bucket by bucket so each forward only pads to the longest input of its bucket."""
+
+    def __init__(self, predict_fn, boundaries, length_fn=word_count):
+        self.predict_fn = predict_fn
+        self.boundaries = sorted(boundaries)
+        self.length_fn = length_fn
+
+    def predict(self, inputs):
+        """Predict `inputs` grouped by length and return the predictions in the original order."""
+        buckets = bucket_indices([self.length_fn(item) for item in inputs], self.boundaries)
+        if len(buckets) == 1 and buckets[0] == list(range(len(inputs))):
+            return self.predict_fn(inputs)
+        parts = [self.predict_fn([inputs[index] for index in indices]) for indices in buckets]
+        predictions = concat_predictions(parts)
+        sorted_order = [index for indices in buckets for index in indices]
+        # position of every original input in the bucketed predictions
+        return take_predictions(predictions, np.argsort(sorted_order).tolist())
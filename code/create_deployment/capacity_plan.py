@@ -0,0 +1,241 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+Plan the instance counts and autoscale settings of an online deployment from benchmark results.
+
+The benchmark gives the throughput one instance sustains within the target p95 latency at the
+deployment `max_concurrent_requests_per_instance`. Instances are only planned up to
+`target_utilization_percentage` of that throughput, which leaves room for bursts while the
+autoscaler adds instances:
+
+    python capacity_plan.py --benchmark_json benchmark.json --peak_rps 120 --baseline_rps 20 \
+        --target_p95_ms 200 --output_json capacity_plan.json
+
+The plan is pure computation, so it runs offline, and deploy.py applies it with `--capacity_plan`:
+the deployment starts with `instance_count` instances and an Azure Monitor autoscale setting keeps
+it between `min_instances` and `max_instances`.
+"""
+
+import json
+import math
+import argparse
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Plan online deployment capacity from benchmark results")
+    parser.add_argument(
+        "--benchmark_json",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Results of benchmark_online_endpoint.py or benchmark_workers.py, e.g. one per concurrency",
+    )
+    parser.add_argument("--peak_rps", type=float, help="Peak requests per second to serve", required=True)
+    parser.add_argument("--baseline_rps", type=float, help="Requests per second outside of peaks", default=0)
+    parser.add_argument("--target_p95_ms", type=float, help="p95 latency to stay within", required=True)
+    parser.add_argument("--max_error_rate", type=float, help="Highest acceptable benchmark error rate", default=0.01)
+    parser.add_argument(
+        "--benchmark_instance_count", type=int, help="Instances serving the benchmarked deployment", default=1
+    )
+    parser.add_argument(
+        "--max_concurrent_requests_per_instance",
+        type=int,
+        help="max_concurrent_requests_per_instance of the benchmarked deployment",
+        default=1,
+    )
+    parser.add_argument("--target_utilization_percentage", type=int, help="Planned utilization", default=70)
+    parser.add_argument("--min_instances", type=int, help="Lowest number of instances", default=1)
+    parser.add_argument("--max_instances_limit", type=int, help="Quota of instances, caps the plan", default=20)
+    parser.add_argument("--output_json", type=str, help="Path to save the capacity plan", default=None)
+    return parser.parse_args()
+
+
+def load_benchmark_runs(path):
+    """Read the runs of a benchmark result file as throughput, p95 and error rate records."""
+    with open(path) as f:
+        results = json.load(f)
+    if "summary" in results:
+        # benchmark_online_endpoint.py
+        summary = results["summary"]
+        return [{
+            "source": path,
+            "concurrency": results.get("concurrency"),
+            "throughput_rps": summary["throughput_rps"],
+            "p95_ms": summary["latency_ms"]["p95"],
+            "error_rate": summary["error_rate"],
+        }]
+    # benchmark_workers.py
+    return [
+        {
+            "source": path,
+            "concurrency": run.get("num_workers"),
+            "throughput_rps": run["throughput_rps"],
+            "p95_ms": run["latency_ms_p95"],
+            "error_rate": run["error_rate"],
+        }
+        for run in results["runs"]
+    ]
+
+
+def select_run(runs, target_p95_ms, max_error_rate=0.01):
+    """Return the run with the highest throughput within the target p95 and error rate."""
+    eligible = [run for run in runs if run["p95_ms"] <= target_p95_ms and run["error_rate"] <= max_error_rate]
+    if not eligible:
+        raise ValueError(
+            f"No benchmark run stays within p95 {target_p95_ms}ms and error rate {max_error_rate}, "
+            "benchmark a lower concurrency"
+        )
+    return max(eligible, key=lambda run: run["throughput_rps"])
+
+
+def plan_capacity(rps_per_instance, peak_rps, baseline_rps=0, target_utilization_percentage=70,
+                  min_instances=1, max_instances_limit=20):
+    """
+    Return the instance counts serving `baseline_rps` and `peak_rps` at the target utilization.
+
+    Every instance is planned for `rps_per_instance` x `target_utilization_percentage` requests per
+    second. `instance_count` is the number of instances to deploy with, sized for the baseline.
+    """
+    if rps_per_instance <= 0:
+        raise ValueError(f"rps_per_instance must be positive, got {rps_per_instance}")
+    if not 0 < target_utilization_percentage <= 100:
+        raise ValueError(f"target_utilization_percentage must be in ]0, 100], got {target_utilization_percentage}")
+    planned_rps = rps_per_instance * target_utilization_percentage / 100.0
+    needed_max = max(min_instances, math.ceil(peak_rps / planned_rps))
+    max_instances = min(needed_max, max_instances_limit)
+    min_count = min(max(min_instances, math.ceil(baseline_rps / planned_rps)), max_instances)
+    plan = {
+        "rps_per_instance": round(rps_per_instance, 3),
+        "planned_rps_per_instance": round(planned_rps, 3),
+        "peak_rps": peak_rps,
+        "baseline_rps": baseline_rps,
+        "target_utilization_percentage": target_utilization_percentage,
+        "min_instances": min_count,
+        "max_instances": max_instances,
+        "instance_count": min_count,
+        "peak_capacity_rps": round(max_instances * rps_per_instance, 3),
+    }
+    if needed_max > max_instances_limit:
+        plan["warning"] = (
+            f"{needed_max} instances are needed for {peak_rps} rps, capped at the limit of {max_instances_limit}"
+        )
+    return plan
+
+
+def plan_from_benchmarks(runs, peak_rps, target_p95_ms, baseline_rps=0, max_error_rate=0.01,
+                         benchmark_instance_count=1, max_concurrent_requests_per_instance=1, **kwargs):
+    """Plan the capacity from the best benchmark run within the latency target."""
+    run = select_run(runs, target_p95_ms, max_error_rate)
+    plan = plan_capacity(run["throughput_rps"] / benchmark_instance_count, peak_rps, baseline_rps, **kwargs)
+    plan["target_p95_ms"] = target_p95_ms
+    plan["benchmark"] = run
+    # the measured throughput only holds at the benchmarked concurrency
+    plan["max_concurrent_requests_per_instance"] = max_concurrent_requests_per_instance
+    return plan
+
+
+def load_capacity_plan(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def check_autoscale_available():
+    """Raise before anything is deployed when the autoscale settings of a capacity plan cannot be applied."""
+    try:
+        import azure.mgmt.monitor  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            "Applying a capacity plan needs azure-mgmt-monitor to create the autoscale setting, "
+            "pip install azure-mgmt-monitor or deploy without --capacity_plan"
+        ) from e
+
+
+def autoscale_profile(plan, deployment_id):
+    """
+    Build the Azure Monitor autoscale profile of the online deployment `deployment_id` from `plan`.
+
+    One instance is added while the average CPU of the deployment stays above the target utilization
+    and one is removed while it stays under half of it, between the plan min and max instances.
+    """
+    from datetime import timedelta
+
+    from azure.mgmt.monitor.models import AutoscaleProfile, MetricTrigger, ScaleAction, ScaleCapacity, ScaleRule
+
+    def rule(operator, threshold, direction):
+        return ScaleRule(
+            metric_trigger=MetricTrigger(
+                metric_name="CpuUtilizationPercentage",
+                metric_resource_uri=deployment_id,
+                time_grain=timedelta(minutes=1),
+                statistic="Average",
+                # Azure Monitor evaluates the rules every minute, over windows of 5 minutes at least
+                time_window=timedelta(minutes=5),
+                time_aggregation="Average",
+                operator=operator,
+                threshold=threshold,
+            ),
+            scale_action=ScaleAction(
+                direction=direction, type="ChangeCount", value="1", cooldown=timedelta(minutes=5)
+            ),
+        )
+
+    target = plan["target_utilization_percentage"]
+    return AutoscaleProfile(
+        name="capacity-plan",
+        capacity=ScaleCapacity(
+            minimum=str(plan["min_instances"]),
+            maximum=str(plan["max_instances"]),
+            default=str(plan["instance_count"]),
+        ),
+        rules=[rule("GreaterThan", target, "Increase"), rule("LessThan", target / 2, "Decrease")],
+    )
+
+
+def apply_autoscale(credential, subscription_id, resource_group, deployment, location, plan):
+    """
+    Create or update the autoscale setting of the online `deployment` from `plan`.
+
+    Managed online deployments only take default scale settings, so they are deployed with the plan
+    `instance_count` and Azure Monitor scales them afterwards. Needs azure-mgmt-monitor.
+    """
+    from azure.mgmt.monitor import MonitorManagementClient
+    from azure.mgmt.monitor.models import AutoscaleSettingResource
+
+    setting = AutoscaleSettingResource(
+        location=location,
+        target_resource_uri=deployment.id,
+        profiles=[autoscale_profile(plan, deployment.id)],
+        enabled=True,
+    )
+    client = MonitorManagementClient(credential, subscription_id)
+    return client.autoscale_settings.create_or_update(
+        resource_group, f"{deployment.endpoint_name}-{deployment.name}-autoscale", setting
+    )
+
+
+def main():
+    args = parse_args()
+    print(args)
+
+    runs = [run for path in args.benchmark_json for run in load_benchmark_runs(path)]
+    plan = plan_from_benchmarks(
+        runs,
+        args.peak_rps,
+        args.target_p95_ms,
+        baseline_rps=args.baseline_rps,
+        max_error_rate=args.max_error_rate,
+        benchmark_instance_count=args.benchmark_instance_count,
+        max_concurrent_requests_per_instance=args.max_concurrent_requests_per_instance,
+        target_utilization_percentage=args.target_utilization_percentage,
+        min_instances=args.min_instances,
+        max_instances_limit=args.max_instances_limit,
+    )
+    print(json.dumps(plan, indent=2))
+    if args.output_json:
+        with open(args.output_json, "w") as f:
+            json.dump(plan, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
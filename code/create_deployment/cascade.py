@@ -0,0 +1,136 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the confidence cascade of a cheap draft classifier and the full model used by score."""
+
+import copy
+import threading
+
+import numpy as np
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+logger = get_logger_app()
+
+LAYER_LIST_NAMES = ("layer", "layers")
+
+
+def softmax(logits):
+    shifted = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return shifted / shifted.sum(axis=-1, keepdims=True)
+
+
+def truncated_model(model, num_layers):
+    """
+    Return a view of `model` running only its first `num_layers` transformer layers.
+
+    The modules on the path to the layer list are shallow copies, so the view shares every weight
+    with `model`, which is left untouched.
+    """
+    path = next(
+        (name for name, module in model.named_modules()
+         if name.rpartition(".")[2] in LAYER_LIST_NAMES and type(module).__name__ == "ModuleList"),
+        None,
+    )
+    if path is None:
+        raise ValueError(f"No transformer layer list found in {type(model).__name__}")
+    view = copy.copy(model)
+    view._modules = dict(view._modules)
+    parent = view
+    names = path.split(".")
+    for name in names[:-1]:
+        child = copy.copy(parent._modules[name])
+        child._modules = dict(child._modules)
+        parent._modules[name] = child
+        parent = child
+    layers = parent._modules[names[-1]]
+    if not 0 < num_layers < len(layers):
+        raise ValueError(f"Draft layers must be in [1, {len(layers) - 1}], got {num_layers}")
+    parent._modules[names[-1]] = type(layers)(list(layers)[:num_layers])
+    return view
+
+
+class TruncatedDraft:
+    """Draft classifier running the first `num_layers` layers of the torch engine `deployment`, sharing its tokenizer."""
+
+    def __init__(self, deployment, num_layers):
+        self.deployment = deployment
+        self.model = truncated_model(deployment.model, num_layers)
+        self.id2label = deployment.id2label
+
+    def logits(self, inputs):
+        import torch
+
+        encoded = {name: torch.from_numpy(values) for name, values in self.deployment.encoder.encode(inputs).items()}
+        with torch.no_grad():
+            return self.model(**encoded).logits.numpy()
+
+
+class ConfidenceCascade:
+    """
+    Answer inputs with the `draft` classifier, escalating the uncertain ones to `predict_fn`.
+
+    An input is escalated when the softmax probability of the draft prediction is below `threshold`.
+    `predict_fn` is the full model and must return a list of labels, as the torch and onnx engines
+    do. Draft and escalation times are recorded as the `cascade_draft` and `cascade_full` stages of
+    `metrics` and the escalation counters are reported with its summary.
+    """
+
+    def __init__(self, draft, predict_fn, threshold, metrics=None):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"Cascade threshold must be in ]0, 1], got {threshold}")
+        self.draft = draft
+        self.predict_fn = predict_fn
+        self.threshold = threshold
+        self.metrics = metrics
+        self.inputs = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+        if metrics is not None:
+            metrics.add_gauge("cascade", self.stats)
+
+    def _timed(self, stage, fn, *args):
+        if self.metrics is None:
+            return fn(*args)
+        with self.metrics.time(stage):
+            return fn(*args)
+
+    def draft_predict(self, inputs):
+        """Return the draft label and confidence of every input."""
+        probabilities = softmax(self._timed("cascade_draft", self.draft.logits, inputs))
+        class_ids = probabilities.argmax(axis=-1)
+        labels = [self.draft.id2label.get(int(class_id), int(class_id)) for class_id in class_ids]
+        return labels, probabilities.max(axis=-1)
+
+    def predict(self, inputs):
+        """Return the label of every input, from the draft when it is confident enough and from the full model otherwise."""
+        predictions, confidences = self.draft_predict(inputs)
+        escalate = np.flatnonzero(confidences < self.threshold).tolist()
+        if escalate:
+            full_predictions = self._timed("cascade_full", self.predict_fn, [inputs[i] for i in escalate])
+            if len(full_predictions) != len(escalate):
+                raise ValueError(f"Full model returned {len(full_predictions)} rows for {len(escalate)} inputs")
+            for i, prediction in zip(escalate, full_predictions):
+                predictions[i] = prediction
+        with self._lock:
+            self.inputs += len(inputs)
+            self.escalated += len(escalate)
+        return predictions
+
+    def stats(self):
+        """Return the escalation counters."""
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "inputs": self.inputs,
+                "escalated": self.escalated,
+                "escalation_rate": round(self.escalated / self.inputs, 4) if self.inputs else 0.0,
+            }
+
+
+def check_labels(draft, deployment):
+    """Raise when the draft classifier does not predict the labels of the full model."""
+    full_labels = getattr(deployment, "id2label", None)
+    if full_labels is not None and draft.id2label != full_labels:
+        raise ValueError(f"Draft labels {draft.id2label} differ from the model labels {full_labels}")
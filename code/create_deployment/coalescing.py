@@ -0,0 +1,101 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the deduplication and single-flight coalescing of predictions used by score."""
+
+import threading
+
+from batching import take_predictions
+from prediction_cache import PredictionCache, normalize_inputs
+
+
+def dedupe_inputs(inputs):
+    """
+    Return the distinct normalized sentences of `inputs` and, for every input, the index of its sentence.
+
+    The first spelling of every sentence is kept, so the model sees an input the client sent.
+    """
+    positions = {}
+    unique = []
+    indices = []
+    for sentence in inputs:
+        key = normalize_inputs(sentence)
+        index = positions.get(key)
+        if index is None:
+            index = positions[key] = len(unique)
+            unique.append(sentence)
+        indices.append(index)
+    return unique, indices
+
+
+class _Flight:
+    """Prediction of one set of inputs, shared with the callers arriving while it runs."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class InputCoalescer:
+    """
+    Avoid computing the same prediction twice.
+
+    `predict` runs concurrent calls with the same normalized inputs once: the first caller computes
+    the prediction and the others wait for it. `dedupe` runs the duplicated sentences of a batch once
+    and fans the predictions back out to every position.
+    """
+
+    def __init__(self):
+        self.flights = 0
+        self.coalesced_requests = 0
+        self.deduplicated_inputs = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def predict(self, inputs, predict_fn):
+        """Return `predict_fn(inputs)`, sharing the call with concurrent callers of the same inputs."""
+        key = PredictionCache.make_key(inputs)
+        with self._lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _Flight()
+                self.flights += 1
+            else:
+                self.coalesced_requests += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = predict_fn(inputs)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight.done.set()
+
+    def dedupe(self, inputs, predict_fn):
+        """Return `predict_fn(inputs)`, predicting every distinct sentence of `inputs` once."""
+        unique, indices = dedupe_inputs(inputs)
+        if len(unique) == len(inputs):
+            return predict_fn(inputs)
+        with self._lock:
+            self.deduplicated_inputs += len(inputs) - len(unique)
+        return take_predictions(predict_fn(unique), indices)
+
+    def stats(self):
+        """Return the counters of coalesced work."""
+        with self._lock:
+            return {
+                "flights": self.flights,
+                "coalesced_requests": self.coalesced_requests,
+                "deduplicated_inputs": self.deduplicated_inputs,
+                "in_flight": len(self._in_flight),
+            }
@@ -5,6 +5,7 @@ import argparse
 
 from azure.ai.ml.entities import ManagedOnlineEndpoint
 from azure.ai.ml.entities import ManagedOnlineDeployment
+from azure.ai.ml.entities import OnlineRequestSettings
 from azure.identity import ManagedIdentityCredential
 
 from azure.identity import DefaultAzureCredential
@@ -14,6 +15,9 @@ import os
 
 import json
 
+from capacity_plan import apply_autoscale, check_autoscale_available, load_capacity_plan
+from traffic_shift import make_endpoint_probe, probe_payloads, progressive_traffic_shift
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Create online deployment")
     parser.add_argument("--deployment_name", type=str, help="Name of online deployment")
@@ -21,7 +25,20 @@ def parse_args():
     parser.add_argument("--model_path", type=str, help="Path to model or AML model")
     parser.add_argument("--instance_type", type=str, help="Instance type", default="Standard_DS2_v2")
     parser.add_argument("--instance_count", type=int, help="Instance count", default=1)
-    parser.add_argument("--traffic_allocation", type=str, help="Deployment traffic allocation percentage")
+    parser.add_argument("--capacity_plan", type=str, help="Capacity plan JSON built by capacity_plan.py", default=None)
+    parser.add_argument("--traffic_allocation", type=int, help="Deployment traffic allocation percentage", default=100)
+    parser.add_argument(
+        "--traffic_steps",
+        type=int,
+        nargs="*",
+        default=[],
+        help="Traffic percentages to move through up to traffic_allocation, with a load probe after every step",
+    )
+    parser.add_argument("--max_p95_ratio", type=float, help="Maximum p95 latency ratio to the incumbent", default=1.2)
+    parser.add_argument(
+        "--max_error_rate_increase", type=float, help="Maximum error rate increase over the incumbent", default=0.01
+    )
+    parser.add_argument("--probe_duration_s", type=float, help="Duration of every load probe in seconds", default=30)
 
     return parser.parse_args()
 
@@ -39,13 +56,18 @@ def main():
     args = parse_args()
     print(args)
 
+    if args.capacity_plan is not None:
+        # fail before the endpoint and deployment are created when the plan autoscale cannot be applied
+        check_autoscale_available()
+
     ws = generate_workspace()
     
     credential = DefaultAzureCredential()
     try:
         client_id = os.environ.get("DEFAULT_IDENTITY_CLIENT_ID")
+        identity = ManagedIdentityCredential(client_id=client_id)
         ml_client = MLClient.from_config(
-            ManagedIdentityCredential(client_id=client_id),
+            identity,
                 )
 
         print("ML client loaded")
@@ -72,12 +94,24 @@ def main():
     print("Finished Online endpoint creation -")
     print("Creating online deployment")
     # Create online deployment
+    plan = None
+    scaling = {}
+    if args.capacity_plan is not None:
+        plan = load_capacity_plan(args.capacity_plan)
+        print(f"Capacity plan - {json.dumps(plan)}")
+        args.instance_count = plan["instance_count"]
+        scaling = {
+            "request_settings": OnlineRequestSettings(
+                max_concurrent_requests_per_instance=plan["max_concurrent_requests_per_instance"]
+            ),
+        }
     online_deployment = ManagedOnlineDeployment(
         name=args.deployment_name,
         endpoint_name=args.endpoint_name,
         model=args.model_path,
         instance_type=args.instance_type,
         instance_count=args.instance_count,
+        **scaling,
     )
 
     deployment_job = ml_client.online_deployments.begin_create_or_update(
@@ -85,7 +119,42 @@ def main():
     )
     deployment_job.wait()
 
+    if plan is not None:
+        # managed deployments keep the default scale settings, Azure Monitor scales them within the plan
+        apply_autoscale(
+            identity,
+            ml_client.subscription_id,
+            ml_client.resource_group_name,
+            ml_client.online_deployments.get(args.deployment_name, args.endpoint_name),
+            ml_client.online_endpoints.get(args.endpoint_name).location,
+            plan,
+        )
+        print(f"Autoscale set between {plan['min_instances']} and {plan['max_instances']} instances")
+
     # allocate traffic
+    if args.traffic_steps:
+        steps = [step for step in args.traffic_steps if step < args.traffic_allocation] + [args.traffic_allocation]
+        endpoint = ml_client.online_endpoints.get(args.endpoint_name)
+        probe = make_endpoint_probe(
+            endpoint.scoring_uri,
+            ml_client.online_endpoints.get_keys(args.endpoint_name).primary_key,
+            probe_payloads(),
+            duration_s=args.probe_duration_s,
+        )
+        report = progressive_traffic_shift(
+            ml_client,
+            args.endpoint_name,
+            args.deployment_name,
+            steps,
+            probe,
+            max_p95_ratio=args.max_p95_ratio,
+            max_error_rate_increase=args.max_error_rate_increase,
+        )
+        print(json.dumps(report, indent=2))
+        if report["rolled_back"]:
+            raise RuntimeError(f"Traffic rolled back: {report['reason']}")
+        return
+
     online_endpoint = ManagedOnlineEndpoint(
         name=args.endpoint_name
     )
@@ -41,6 +41,11 @@ from azureml.train.finetune.core.utils.error_handling.error_definitions import (
 )
 from azureml._common._error_definition.azureml_error import AzureMLError  # type: ignore
 
+from model_resolver import resolve_latest_model
+from log_tailer import DeploymentLogTailer, wait_with_logs
+from traffic_shift import make_endpoint_probe, probe_payloads, progressive_traffic_shift
+from capacity_plan import apply_autoscale, check_autoscale_available, load_capacity_plan
+
 logger = get_logger_app()
 
 
@@ -95,6 +100,12 @@ def get_environment_variables():
             "This can reduce memory footprint by performing operations in half-precision."
         ),
     )
+    common_parser.add_argument(
+        "--use_int8",
+        type=str,
+        default="false",
+        help="If set to true, applies int8 dynamic quantization to the model for CPU inference",
+    )
     common_parser.add_argument(
         "--local_rank",
         type=int,
@@ -102,6 +113,174 @@ def get_environment_variables():
         help="Local rank passed by torch distributed launch",
     )
     common_parser.add_argument("--batch_size", default=4, type=int, help="Test batch size")
+    common_parser.add_argument(
+        "--inference_engine",
+        type=str,
+        default="deployment",
+        choices=["deployment", "torch", "onnx"],
+        help=(
+            "Engine serving predictions. torch serves the model with PyTorch, memory-mapping model.safetensors "
+            "weights when the checkpoint was converted. onnx exports the model to ONNX once, caches the graph "
+            "next to the model and serves it with ONNX Runtime."
+        ),
+    )
+    common_parser.add_argument(
+        "--onnx_intra_op_threads",
+        type=int,
+        default=0,
+        help="ONNX Runtime intra-op threads. 0 uses all physical cores.",
+    )
+    common_parser.add_argument(
+        "--onnx_inter_op_threads",
+        type=int,
+        default=1,
+        help="ONNX Runtime inter-op threads",
+    )
+    common_parser.add_argument(
+        "--onnx_cache_dir",
+        type=str,
+        default=None,
+        help=(
+            "Directory caching the exported ONNX graph when the model directory is read-only, as on managed "
+            "endpoints. Point it at storage kept across restarts and replicas so they reuse the graph instead of "
+            "exporting it and re-running the parity check, defaults to a temporary directory."
+        ),
+    )
+    common_parser.add_argument(
+        "--max_seq_length",
+        type=int,
+        default=128,
+        help="Maximum number of tokens of an input for the torch and onnx inference engines, longer inputs are truncated",
+    )
+    common_parser.add_argument(
+        "--tokenizer_cache_size",
+        type=int,
+        default=4096,
+        help=(
+            "Number of sentences whose token ids are cached by the torch and onnx inference engines. "
+            "The cache is disabled when set to 0."
+        ),
+    )
+    common_parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=1,
+        help=(
+            "Maximum number of inputs gathered from concurrent requests into one prediction. "
+            "Micro-batching is disabled when set to 1."
+        ),
+    )
+    common_parser.add_argument(
+        "--max_batch_wait_ms",
+        type=float,
+        default=10,
+        help="Maximum time in ms a micro-batch waits for more requests before it is predicted",
+    )
+    common_parser.add_argument(
+        "--length_buckets",
+        type=int,
+        nargs="*",
+        default=[],
+        help=(
+            "Word count boundaries of the length buckets sentence lists are split into before prediction, "
+            "so every bucket is only padded to its longest sentence. Bucketing is disabled when empty."
+        ),
+    )
+    common_parser.add_argument(
+        "--prediction_cache_size",
+        type=int,
+        default=0,
+        help="Number of request predictions kept in the LRU prediction cache. The cache is disabled when set to 0.",
+    )
+    common_parser.add_argument(
+        "--prediction_cache_ttl_s",
+        type=float,
+        default=300,
+        help="Time in seconds a cached prediction stays valid",
+    )
+    common_parser.add_argument(
+        "--cascade_threshold",
+        type=float,
+        default=0,
+        help=(
+            "Confidence below which inputs answered by the draft classifier are escalated to the full model. "
+            "The cascade is disabled when set to 0 and needs the torch or onnx inference engine."
+        ),
+    )
+    common_parser.add_argument(
+        "--cascade_draft_layers",
+        type=int,
+        default=0,
+        help="Number of transformer layers of the model run by the draft classifier, torch inference engine only",
+    )
+    common_parser.add_argument(
+        "--cascade_draft_model",
+        type=str,
+        default=None,
+        help="Directory of a distilled draft classifier, relative to the model directory, used instead of draft layers",
+    )
+    common_parser.add_argument(
+        "--coalesce_inputs",
+        type=str,
+        default="false",
+        help=(
+            "If set to true, concurrent requests with the same sentences share one prediction "
+            "and repeated sentences of a batch are predicted once"
+        ),
+    )
+    common_parser.add_argument(
+        "--json_codec",
+        type=str,
+        default="auto",
+        choices=["auto", "json", "orjson"],
+        help="Codec used to decode requests and encode predictions. auto uses orjson when it is installed.",
+    )
+    common_parser.add_argument(
+        "--request_files_in_memory",
+        type=str,
+        default="true",
+        help="If set to true, files sent via requests are stored on the memory backed /dev/shm when available",
+    )
+    common_parser.add_argument(
+        "--request_files_in_memory_max_mb",
+        type=float,
+        default=4,
+        help="Size in MB of the largest request whose files are stored in memory, larger ones are stored on disk",
+    )
+    common_parser.add_argument(
+        "--log_model_files",
+        type=str,
+        default="true",
+        help="If set to true, every file of the model directory is logged at startup",
+    )
+    common_parser.add_argument(
+        "--warmup_batch_sizes",
+        type=int,
+        nargs="*",
+        default=[],
+        help="Batch sizes of the synthetic predictions run at startup before serving requests",
+    )
+    common_parser.add_argument(
+        "--warmup_iterations",
+        type=int,
+        default=1,
+        help="Number of warm-up predictions per batch size",
+    )
+    common_parser.add_argument(
+        "--metrics_log_interval_s",
+        type=float,
+        default=60,
+        help="Interval in seconds between request latency summaries in the logs. Set to 0 to disable them.",
+    )
+    common_parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help=(
+            "Number of scoring worker processes per instance, each with its share of the cores as intra-op threads. "
+            "With the torch engine and model.safetensors weights the workers share the weights in the page cache."
+        ),
+    )
     common_parser.add_argument(
         "--output_dir",
         default="output",
@@ -123,10 +302,21 @@ def get_environment_variables():
     if isinstance(args.apply_deepspeed, str):
         args.apply_deepspeed = args.apply_deepspeed.lower() == "true"
 
+    if isinstance(args.request_files_in_memory, str):
+        args.request_files_in_memory = args.request_files_in_memory.lower() == "true"
+
+    if isinstance(args.coalesce_inputs, str):
+        args.coalesce_inputs = args.coalesce_inputs.lower() == "true"
+
+    if isinstance(args.log_model_files, str):
+        args.log_model_files = args.log_model_files.lower() == "true"
+
     if args.apply_deepspeed and args.deepspeed_config is None:
         args.deepspeed_config = "./ds_config_zero3.json"
 
     args.use_fp16 = (args.precision == 16)
+    if isinstance(args.use_int8, str):
+        args.use_int8 = args.use_int8.lower() == "true"
 
     # update the task info
     decode_dataset_columns = []
@@ -135,7 +325,11 @@ def get_environment_variables():
     # if True ==> data format happens => metrics will be computed on model predictions
     # if False ==> ONLY model prediction happens
 
-    return {SaveFileConstants.DeploymentSaveKey: json.dumps(vars(args))}
+    return {
+        SaveFileConstants.DeploymentSaveKey: json.dumps(vars(args)),
+        # number of processes the inference server starts, every one of them runs score.init
+        "WORKER_COUNT": str(args.num_workers),
+    }
 
 
 # TODO Need to upgrade v1 to v2 when available
@@ -200,6 +394,16 @@ def main():
         default=1,
         help="Number of vms for the deployment",
     )
+    parser.add_argument(
+        "--capacity_plan",
+        type=str,
+        default=None,
+        help=(
+            "Capacity plan JSON built by capacity_plan.py. Its instance count and "
+            "max_concurrent_requests_per_instance replace the static arguments, and its min and max instances "
+            "become an Azure Monitor autoscale setting."
+        ),
+    )
 
     # Online Request Settings
     parser.add_argument(
@@ -221,6 +425,64 @@ def main():
         help="Maximum queue wait time of a request in ms"
     )
 
+    # Deployment logs
+    parser.add_argument(
+        "--follow_deployment_logs",
+        type=str,
+        default="true",
+        help="If set to true, deployment logs are tailed while the deployment is created so errors show up early",
+    )
+    parser.add_argument(
+        "--deployment_log_file",
+        type=str,
+        default=os.path.join("outputs", "deployment_logs", "deployment.log"),
+        help="Rotating local file receiving the deployment logs",
+    )
+    parser.add_argument(
+        "--deployment_log_lines",
+        type=int,
+        default=500,
+        help="Number of log lines fetched per poll of the deployment logs",
+    )
+    parser.add_argument(
+        "--deployment_log_interval_s",
+        type=float,
+        default=15,
+        help="Interval in seconds between polls of the deployment logs",
+    )
+
+    # Progressive traffic shift
+    parser.add_argument(
+        "--traffic_steps",
+        type=int,
+        nargs="*",
+        default=[],
+        help=(
+            "Traffic percentages the deployment is moved through, e.g. 5 25 50 100, with a load probe against "
+            "the incumbent deployment after every step. Traffic is moved at once when empty."
+        ),
+    )
+    parser.add_argument(
+        "--max_p95_ratio",
+        type=float,
+        default=1.2,
+        help="Traffic is rolled back when the deployment p95 latency exceeds the incumbent one by this ratio",
+    )
+    parser.add_argument(
+        "--max_error_rate_increase",
+        type=float,
+        default=0.01,
+        help="Traffic is rolled back when the deployment error rate exceeds the incumbent one by this much",
+    )
+    parser.add_argument(
+        "--probe_request_file",
+        type=str,
+        default=None,
+        help="JSONL file of requests or dataset sentences replayed by the load probes",
+    )
+    parser.add_argument("--probe_concurrency", type=int, default=4, help="Concurrent clients of the load probes")
+    parser.add_argument("--probe_duration_s", type=float, default=30, help="Duration of every load probe in seconds")
+
     args, _ = parser.parse_known_args()
 
     # parse inference arguments to set as environment variables
@@ -243,6 +505,9 @@ def main():
     if isinstance(args.local_deployment, str):
         args.local_deployment = args.local_mode and args.local_deployment.lower() == "true"
     logger.info(f"local deployment - {args.local_deployment}")
+    if args.capacity_plan is not None and not args.local_deployment:
+        # fail before the endpoint and deployment are created when the plan autoscale cannot be applied
+        check_autoscale_available()
 
     # fields
     DATETIME_SUFFIX = datetime.datetime.now().strftime("%m%d%H%M%f")
@@ -264,8 +529,9 @@ def main():
             logger.info("Using default credential")
             from azure.identity import DefaultAzureCredential
 
+            credential = DefaultAzureCredential()
             ml_client = MLClient(
-                DefaultAzureCredential(),
+                credential,
                 ws._subscription_id,
                 ws._resource_group,
                 ws._workspace_name,
@@ -274,8 +540,9 @@ def main():
         else:
             client_id = os.environ.get("DEFAULT_IDENTITY_CLIENT_ID")
             logger.info(f"Using client id: {client_id}")
+            credential = ManagedIdentityCredential(client_id=client_id)
             ml_client = MLClient.from_config(
-                ManagedIdentityCredential(client_id=client_id),
+                credential,
                 registry_name=args.registry_name,
             )
     except HttpResponseError as e:
@@ -314,18 +581,6 @@ def main():
             logger.info("Local ML client model")
     else:
         # v2: register model to workspace
-        models_list = ml_client.models.list(name=args.name_for_registered_model)
-        try:
-            models_list = [m for m in models_list]
-        except Exception:
-            models_list = []
-        model_versions_list = [0]
-        for model in models_list:
-            try:
-                model_versions_list.append(int(model.version))
-            except Exception:
-                pass
-        model_version = str(max(model_versions_list))
         #model_version = 1
         #model = Model_v2(
         #    name=args.name_for_registered_model,
@@ -335,13 +590,10 @@ def main():
         #    type="custom_model",
         #)
         #ml_client.models.create_or_update(model)
-        model = ml_client.models.get(name=args.name_for_registered_model)
-        model_name, model_version = model.name, model.version
-        logger.info(f"Registered model info v2: {model_name}:{model_version}")
-
-        # load model using MLClient
-        model_v2 = ml_client.models.get(name=model_name, version=model_version)
-        logger.info(f"Loaded ML client model : {model_v2.name}:{model_v2.version}")
+        # the resolved object is the fetched model, no further get is needed
+        model_v2 = resolve_latest_model(ml_client, args.name_for_registered_model)
+        model_name, model_version = model_v2.name, model_v2.version
+        logger.info(f"Loaded ML client model : {model_name}:{model_version}")
 
     # get/create the endpoint
     endpoint_name = args.endpoint_name
@@ -358,6 +610,13 @@ def main():
         ml_client.begin_create_or_update(endpoint, local=args.local_deployment)
     logger.info(f"Using endpoint {endpoint_name}")
 
+    plan = None
+    if args.capacity_plan is not None:
+        plan = load_capacity_plan(args.capacity_plan)
+        args.instance_count = plan["instance_count"]
+        args.max_concurrent_requests_per_instance = plan["max_concurrent_requests_per_instance"]
+        logger.info(f"Capacity plan - {json.dumps(plan)}")
+
     # deployment to the endpoint
     deployment = ManagedOnlineDeployment(
         name=DEPLOYMENT_NAME,
@@ -368,7 +627,6 @@ def main():
         environment_variables=env_var,
         instance_type=args.instance_type,
         instance_count=args.instance_count,
-        # TODO add Scale settings to args
         request_settings=OnlineRequestSettings(
             max_concurrent_requests_per_instance=args.max_concurrent_requests_per_instance,
             request_timeout_ms=args.request_timeout_ms,
@@ -376,25 +634,76 @@ def main():
         ),
     )
 
+    if isinstance(args.follow_deployment_logs, str):
+        args.follow_deployment_logs = args.follow_deployment_logs.lower() == "true"
+    log_tailer = DeploymentLogTailer(
+        ml_client,
+        endpoint_name,
+        DEPLOYMENT_NAME,
+        lines=args.deployment_log_lines,
+        log_file=args.deployment_log_file,
+        local=args.local_deployment,
+    )
     try:
-        ml_client.online_deployments.begin_create_or_update(deployment, local=args.local_deployment)
+        poller = ml_client.online_deployments.begin_create_or_update(deployment, local=args.local_deployment)
+        wait_with_logs(
+            poller, log_tailer if args.follow_deployment_logs else None, args.deployment_log_interval_s
+        )
     except Exception as e:
         try:
             # logger.info(e)
             logger.info("fetching logs")
-            logger.info(
-                ml_client.online_deployments.get_logs(name=DEPLOYMENT_NAME, endpoint_name=endpoint_name, lines=100000)
-            )
+            log_tailer.poll()
+            logger.info(f"Deployment errors:\n{log_tailer.error_summary()}")
+            logger.info(f"Deployment logs saved to {args.deployment_log_file}")
         except Exception as e2:
             logger.info(f"No logs found for current deployment. Error - {e2}")
         raise ResourceException._with_error(
             AzureMLError.create(DeploymentFailed, error=e)
         )
+    finally:
+        # release the log file handler whether the deployment succeeded or not
+        log_tailer.close()
     logger.info("Deployment object created")
 
-    # set this deployment as the default for the endpoint (100% traffic)
-    endpoint.traffic = {DEPLOYMENT_NAME: 100}
-    ml_client.begin_create_or_update(endpoint)
+    if plan is not None and not args.local_deployment:
+        # managed deployments keep the default scale settings, Azure Monitor scales them within the plan
+        apply_autoscale(
+            credential,
+            ml_client.subscription_id,
+            ml_client.resource_group_name,
+            ml_client.online_deployments.get(DEPLOYMENT_NAME, endpoint_name),
+            ml_client.online_endpoints.get(endpoint_name).location,
+            plan,
+        )
+        logger.info(f"Autoscale set between {plan['min_instances']} and {plan['max_instances']} instances")
+
+    if args.traffic_steps and not args.local_deployment:
+        endpoint = ml_client.online_endpoints.get(endpoint_name)
+        probe = make_endpoint_probe(
+            endpoint.scoring_uri,
+            ml_client.online_endpoints.get_keys(endpoint_name).primary_key,
+            probe_payloads(args.probe_request_file),
+            concurrency=args.probe_concurrency,
+            duration_s=args.probe_duration_s,
+        )
+        report = progressive_traffic_shift(
+            ml_client,
+            endpoint_name,
+            DEPLOYMENT_NAME,
+            args.traffic_steps,
+            probe,
+            max_p95_ratio=args.max_p95_ratio,
+            max_error_rate_increase=args.max_error_rate_increase,
+        )
+        if report["rolled_back"]:
+            raise ResourceException._with_error(
+                AzureMLError.create(DeploymentFailed, error=f"Traffic rolled back: {report['reason']}")
+            )
+    else:
+        # set this deployment as the default for the endpoint (100% traffic)
+        endpoint.traffic = {DEPLOYMENT_NAME: 100}
+        ml_client.begin_create_or_update(endpoint)
     logger.info("Deployment done")
     logger.info(f"{datetime.datetime.now().isoformat()} Scoring URI is : {endpoint.scoring_uri}")
 
@@ -0,0 +1,104 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the JSON codecs used by score to decode requests and encode predictions."""
+
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class _JSONEncoder(json.JSONEncoder):
+    """custom `JSONEncoder` to make sure float and int64 ar converted."""
+
+    def default(self, obj):
+        if isinstance(obj, np.integer):
+            return int(obj)
+        elif isinstance(obj, np.floating):
+            return float(obj)
+        elif isinstance(obj, np.ndarray):
+            return obj.tolist()
+        else:
+            return super(_JSONEncoder, self).default(obj)
+
+
+class StdlibJSONCodec:
+    """Codec built on the standard library `json` module."""
+
+    name = "json"
+
+    def encode(self, content):
+        """Encode json with custom `JSONEncoder`."""
+        return json.dumps(
+            content,
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            cls=_JSONEncoder,
+            separators=(",", ":"),
+        )
+
+    def decode(self, content):
+        """Decode the json content."""
+        return json.loads(content)
+
+
+def _orjson_default(obj):
+    """Convert the NumPy objects orjson does not serialize natively, e.g. non contiguous arrays."""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    elif isinstance(obj, np.floating):
+        return float(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonCodec:
+    """
+    Codec built on `orjson`, which serializes NumPy arrays and scalars natively.
+
+    orjson encodes NaN and infinity as null, so outputs containing null are encoded again by the stdlib
+    codec, which raises for them: both codecs answer the same to the same prediction.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+        self.options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        self.fallback = StdlibJSONCodec()
+
+    def encode(self, content):
+        """Encode json, returning `str` like the stdlib codec."""
+        encoded = orjson.dumps(content, default=_orjson_default, option=self.options)
+        if b"null" in encoded:
+            # null may stand for a non-finite float, which the stdlib codec refuses
+            return self.fallback.encode(content)
+        return encoded.decode("utf-8")
+
+    def decode(self, content):
+        """Decode the json content."""
+        return orjson.loads(content)
+
+
+CODECS = {
+    StdlibJSONCodec.name: StdlibJSONCodec,
+    OrjsonCodec.name: OrjsonCodec,
+}
+
+
+def get_codec(name="auto"):
+    """Return the codec called `name`; `auto` picks orjson when it is installed and the stdlib otherwise."""
+    if name == "auto":
+        name = OrjsonCodec.name if orjson is not None else StdlibJSONCodec.name
+    if name not in CODECS:
+        raise ValueError(f"Unknown json codec {name}, expected one of {['auto'] + list(CODECS)}")
+    return CODECS[name]()
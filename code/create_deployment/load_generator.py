@@ -0,0 +1,171 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the load generator used to benchmark and probe scoring endpoints."""
+
+import json
+import math
+import time
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+HISTOGRAM_BOUNDS_MS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 90000)
+
+
+def load_payloads(request_file, batch_size=1):
+    """
+    Read request bodies from a JSONL file.
+
+    Lines holding an `inputs` key are replayed as they are, e.g. the endpoint request files;
+    lines holding a `sentence` key, e.g. `datasets/test.jsonl`, are grouped by `batch_size`.
+    """
+    payloads = []
+    sentences = []
+    with open(request_file, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "inputs" in record:
+                payloads.append(json.dumps(record).encode("utf-8"))
+            elif "sentence" in record:
+                sentences.append(record["sentence"])
+                if len(sentences) == batch_size:
+                    payloads.append(json.dumps({"inputs": sentences}).encode("utf-8"))
+                    sentences = []
+    if sentences:
+        payloads.append(json.dumps({"inputs": sentences}).encode("utf-8"))
+    if not payloads:
+        raise ValueError(f"No requests found in {request_file}")
+    return payloads
+
+
+def percentile(sorted_values, q):
+    """Return the `q` percentile of already sorted values using the nearest rank."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def is_success(status):
+    """Return True for 2xx statuses, client errors are recorded as exception names."""
+    return isinstance(status, int) and 200 <= status < 300
+
+
+def summarize(latencies_s, statuses, duration_s):
+    """
+    Build the benchmark report from the latencies of successful requests and the status of every request.
+
+    Throughput only counts successful requests, an endpoint rejecting requests quickly is not faster.
+    """
+    latencies_ms = sorted(latency * 1000 for latency in latencies_s)
+    status_counts = {}
+    for status in statuses:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    successes = sum(1 for status in statuses if is_success(status))
+    errors = len(statuses) - successes
+    histogram = {}
+    lower = 0
+    for bound in HISTOGRAM_BOUNDS_MS + (float("inf"),):
+        label = f"<={bound}" if bound != float("inf") else f">{HISTOGRAM_BOUNDS_MS[-1]}"
+        histogram[label] = sum(1 for latency in latencies_ms if lower < latency <= bound)
+        lower = bound
+    return {
+        "requests": len(statuses),
+        "errors": errors,
+        "error_rate": errors / len(statuses) if statuses else 0.0,
+        "status_counts": status_counts,
+        "duration_s": round(duration_s, 3),
+        "throughput_rps": round(successes / duration_s, 3) if duration_s else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies_ms) / len(latencies_ms), 3) if latencies_ms else 0.0,
+            "p50": round(percentile(latencies_ms, 50), 3),
+            "p90": round(percentile(latencies_ms, 90), 3),
+            "p95": round(percentile(latencies_ms, 95), 3),
+            "p99": round(percentile(latencies_ms, 99), 3),
+            "max": round(latencies_ms[-1], 3) if latencies_ms else 0.0,
+        },
+        "histogram_ms": histogram,
+    }
+
+
+class LoadGenerator:
+    """
+    Replay payloads against a scoring URL from `concurrency` workers for `duration_s` seconds.
+
+    Each worker keeps one persistent connection. With `target_rps` requests are sent on a fixed schedule
+    and latency is measured from the scheduled send time, so client side queueing is not hidden.
+    """
+
+    def __init__(self, url, headers=None, concurrency=1, target_rps=None, duration_s=30, timeout_s=90, max_requests=None):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path += f"?{parts.query}"
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+        self.concurrency = concurrency
+        self.target_rps = target_rps
+        self.duration_s = duration_s
+        self.timeout_s = timeout_s
+        self.max_requests = max_requests
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection_cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return connection_cls(self.netloc, timeout=self.timeout_s)
+
+    def _send(self, connection, payload):
+        """Send one request and return its status; failed score.run calls come back as 200 with a failed msg."""
+        connection.request("POST", self.path, body=payload, headers=self.headers)
+        response = connection.getresponse()
+        body = response.read()
+        if response.status == 200 and b'"msg":"failed"' in body:
+            return "failed"
+        return response.status
+
+    def _worker(self, payloads, start, deadline, counter, latencies, statuses):
+        connection = self._connect()
+        while True:
+            with self._lock:
+                index = counter[0]
+                counter[0] += 1
+            if self.max_requests is not None and index >= self.max_requests:
+                break
+            scheduled = start + index / self.target_rps if self.target_rps else time.monotonic()
+            if scheduled >= deadline:
+                break
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                status = self._send(connection, payloads[index % len(payloads)])
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                connection.close()
+                connection = self._connect()
+            latency = time.monotonic() - scheduled
+            with self._lock:
+                statuses.append(status)
+                if is_success(status):
+                    latencies.append(latency)
+        connection.close()
+
+    def run(self, payloads):
+        """Run the load and return the benchmark report."""
+        latencies, statuses, counter = [], [], [0]
+        start = time.monotonic()
+        deadline = start + self.duration_s
+        workers = [
+            threading.Thread(target=self._worker, args=(payloads, start, deadline, counter, latencies, statuses))
+            for _ in range(self.concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return summarize(latencies, statuses, time.monotonic() - start)
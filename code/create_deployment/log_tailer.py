@@ -0,0 +1,135 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the incremental tailer of online deployment logs used by deploy."""
+
+import os
+import re
+import time
+import logging
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+logger = get_logger_app()
+
+ERROR_PATTERN = r"Traceback|Exception|\bERROR\b|\bError\b|CRITICAL|[Ff]ailed|OOMKilled|[Kk]illed|exit code"
+
+
+def new_lines(previous, current):
+    """
+    Return the lines of `current` following its overlap with the end of `previous`.
+
+    Both are tails of the same log, so the longest suffix of `previous` that starts `current` was
+    already seen. Without overlap every line of `current` is new.
+    """
+    if not previous or not current:
+        return current
+    last = previous[-1]
+    for k in range(min(len(previous), len(current)), 0, -1):
+        if current[k - 1] == last and current[:k] == previous[-k:]:
+            return current[k:]
+    return current
+
+
+class DeploymentLogTailer:
+    """
+    Fetch the logs of an online deployment by bounded tails and keep only the lines not seen yet.
+
+    Every fetch asks for the last `lines` lines, doubled up to `max_lines` when the previous tail was
+    overrun in between. New lines go to a rotating `log_file` and the ones matching `error_pattern`
+    are logged right away and kept in `errors`.
+    """
+
+    def __init__(self, ml_client, endpoint_name, deployment_name, lines=500, max_lines=5000, log_file=None,
+                 max_bytes=10 * 1024 * 1024, backup_count=3, error_pattern=ERROR_PATTERN, max_errors=100,
+                 container_type=None, local=False):
+        self.ml_client = ml_client
+        self.endpoint_name = endpoint_name
+        self.deployment_name = deployment_name
+        self.lines = lines
+        self.max_lines = max_lines
+        self.error_regex = re.compile(error_pattern)
+        self.errors = deque(maxlen=max_errors)
+        self.container_type = container_type
+        self.local = local
+        self.seen = 0
+        self._previous = []
+        self._file_logger = None
+        if log_file is not None:
+            os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+            handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._file_logger = logging.getLogger(f"deployment_logs.{endpoint_name}.{deployment_name}")
+            self._file_logger.setLevel(logging.INFO)
+            self._file_logger.propagate = False
+            self._file_logger.handlers = [handler]
+
+    def fetch(self):
+        """Return the lines logged since the previous fetch."""
+        kwargs = {"container_type": self.container_type} if self.container_type else {}
+        logs = self.ml_client.online_deployments.get_logs(
+            name=self.deployment_name, endpoint_name=self.endpoint_name, lines=self.lines, local=self.local, **kwargs
+        )
+        current = (logs or "").splitlines()
+        lines = new_lines(self._previous, current)
+        if self._previous and lines is current and len(current) >= self.lines:
+            # no overlap, lines were missed between the fetches
+            logger.warning(f"Deployment logs overran the last {self.lines} lines between two fetches")
+            self.lines = min(self.lines * 2, self.max_lines)
+        self._previous = current
+        return lines
+
+    def poll(self):
+        """Fetch the new lines, write them to the log file and log the errors among them."""
+        lines = self.fetch()
+        for line in lines:
+            if self._file_logger is not None:
+                self._file_logger.info(line)
+            if self.error_regex.search(line):
+                self.errors.append(line)
+                logger.warning(f"[{self.deployment_name}] {line}")
+        self.seen += len(lines)
+        return lines
+
+    def follow(self, poller, interval_s=15):
+        """Tail the logs until the `begin_create_or_update` operation `poller` is done, then return its result."""
+        while not poller.done():
+            try:
+                self.poll()
+            except Exception as e:
+                # the containers may not exist yet
+                logger.debug(f"Deployment logs not available yet - {e}")
+            poller.wait(timeout=interval_s)
+        try:
+            self.poll()
+        except Exception as e:
+            logger.info(f"No logs found for current deployment. Error - {e}")
+        logger.info(f"Read {self.seen} deployment log lines, {len(self.errors)} matched errors")
+        return poller.result()
+
+    def close(self):
+        """Close the handler of the log file, the tailer is done."""
+        if self._file_logger is not None:
+            for handler in self._file_logger.handlers:
+                handler.close()
+            self._file_logger.handlers = []
+
+    def error_summary(self, last=20):
+        """Return the last `last` error lines."""
+        return "\n".join(list(self.errors)[-last:])
+
+
+def wait_with_logs(poller, tailer, interval_s=15):
+    """Wait for `poller`, following the deployment logs with `tailer` when the operation is long running."""
+    if not hasattr(poller, "done"):
+        # local deployments are created synchronously
+        return poller
+    if tailer is None:
+        return poller.result()
+    start = time.perf_counter()
+    result = tailer.follow(poller, interval_s)
+    logger.info(f"Deployment operation finished after {time.perf_counter() - start:.1f}s")
+    return result
@@ -0,0 +1,130 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the request latency metrics used by score."""
+
+import json
+import math
+import time
+import threading
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+logger = get_logger_app()
+
+
+class LatencyHistogram:
+    """
+    Fixed size histogram of latencies with geometrically growing buckets.
+
+    Recording is O(1) and memory does not grow with the number of requests; percentiles are
+    reported as the upper bound of their bucket, i.e. within `growth` of the exact value.
+    """
+
+    def __init__(self, min_s=1e-5, max_s=100.0, growth=1.1):
+        self.min_s = min_s
+        self.log_growth = math.log(growth)
+        self.bounds = []
+        bound = min_s
+        while bound < max_s:
+            bound *= growth
+            self.bounds.append(bound)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total_s = 0.0
+
+    def record(self, seconds):
+        """Add one latency in seconds."""
+        if seconds <= self.min_s:
+            index = 0
+        else:
+            index = min(int(math.log(seconds / self.min_s) / self.log_growth), len(self.bounds))
+        self.counts[index] += 1
+        self.count += 1
+        self.total_s += seconds
+
+    def percentile(self, q):
+        """Return the latency in seconds below which `q` percent of the recorded latencies fall."""
+        if self.count == 0:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[min(index, len(self.bounds) - 1)]
+        return self.bounds[-1]
+
+    def summary(self):
+        """Return count, mean, p50, p95 and p99 in milliseconds."""
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_s / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p95_ms": round(self.percentile(95) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+        }
+
+
+class _StageTimer:
+    """Context manager recording the time spent in its block for one stage."""
+
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class StageMetrics:
+    """
+    Per stage latency histograms of the request path, summarized to the log every `log_interval_s`.
+
+    Gauges added with `add_gauge` are reported next to the stages, e.g. cache counters.
+    """
+
+    def __init__(self, log_interval_s=60):
+        self.log_interval_s = log_interval_s
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+        self._last_log = time.monotonic()
+
+    def time(self, stage):
+        """Return a context manager timing its block as `stage`."""
+        return _StageTimer(self, stage)
+
+    def add_gauge(self, name, value_fn):
+        """Report the value returned by `value_fn` as `name` in every summary."""
+        self.gauges[name] = value_fn
+
+    def record(self, stage, seconds):
+        """Add the latency of one `stage` execution."""
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram()
+            histogram.record(seconds)
+            now = time.monotonic()
+            log_due = bool(self.log_interval_s) and now - self._last_log >= self.log_interval_s
+            if log_due:
+                self._last_log = now
+        if log_due:
+            logger.info(f"Request latency summary - {json.dumps(self.summary())}")
+
+    def summary(self):
+        """Return the latency summary of every stage and the value of every gauge."""
+        with self._lock:
+            summary = {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+        for name, value_fn in list(self.gauges.items()):
+            summary[name] = value_fn()
+        return summary
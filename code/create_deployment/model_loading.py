@@ -0,0 +1,102 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the model loading helpers shared by the local inference engines."""
+
+import os
+import re
+from contextlib import nullcontext
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+logger = get_logger_app()
+
+SAFETENSORS_WEIGHTS_NAME = "model.safetensors"
+
+
+def find_file_dir(root, file_name):
+    """Return the shallowest directory under `root` containing `file_name`."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if file_name in filenames:
+            return dirpath
+    raise FileNotFoundError(f"No {file_name} found under {root}")
+
+
+def _no_init_weights():
+    """Return a context skipping the random init of weights that are overwritten right after."""
+    try:
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:
+        try:
+            from transformers.initialization import no_init_weights
+        except ImportError:
+            return nullcontext()
+    return no_init_weights()
+
+
+def assign_weights(model, tensors):
+    """Point the parameters and buffers of `model` at `tensors` without copying them."""
+    import torch
+
+    unexpected = []
+    for name, tensor in tensors.items():
+        module_name, _, attr = name.rpartition(".")
+        try:
+            module = model.get_submodule(module_name)
+        except AttributeError:
+            unexpected.append(name)
+            continue
+        if attr in module._parameters:
+            module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+        elif attr in module._buffers:
+            module._buffers[attr] = tensor
+        else:
+            unexpected.append(name)
+    if unexpected:
+        raise ValueError(f"Weights do not match the model architecture: {unexpected[:10]}")
+
+
+def check_missing_weights(model, tensors):
+    """Raise when weights of `model` are neither in `tensors` nor tied to one of them, they were never initialized."""
+    loaded = {tensor.data_ptr() for tensor in tensors.values()}
+    # buffers like position_ids are built by the model itself and are not always saved
+    ignored = getattr(model, "_keys_to_ignore_on_load_missing", None) or []
+    missing = [
+        name
+        for name, tensor in model.state_dict().items()
+        if name not in tensors
+        and tensor.data_ptr() not in loaded
+        and not any(re.search(pattern, name) for pattern in ignored)
+    ]
+    if missing:
+        raise ValueError(f"Weights missing from the checkpoint would stay uninitialized: {missing[:10]}")
+
+
+def load_model(model_dir):
+    """
+    Load the sequence classification model of `model_dir`.
+
+    When a safetensors checkpoint exists its file is memory-mapped and the model weights point into
+    the mapping: pages are only read when first used and are shared through the page cache by every
+    process serving the same model. Other checkpoints are fully deserialized by `from_pretrained`.
+    """
+    from transformers import AutoConfig, AutoModelForSequenceClassification
+    from safetensors import safe_open
+
+    weights_path = os.path.join(model_dir, SAFETENSORS_WEIGHTS_NAME)
+    if not os.path.exists(weights_path):
+        logger.info(f"No {SAFETENSORS_WEIGHTS_NAME} in {model_dir}, deserializing the checkpoint")
+        return AutoModelForSequenceClassification.from_pretrained(model_dir).eval()
+
+    config = AutoConfig.from_pretrained(model_dir)
+    with _no_init_weights():
+        model = AutoModelForSequenceClassification.from_config(config)
+    with safe_open(weights_path, framework="pt", device="cpu") as f:
+        tensors = {name: f.get_tensor(name) for name in f.keys()}
+    assign_weights(model, tensors)
+    model.tie_weights()
+    check_missing_weights(model, tensors)
+    logger.info(f"Memory-mapped {len(tensors)} tensors from {weights_path}")
+    return model.eval()
@@ -0,0 +1,77 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the resolution of the latest version of a registered model."""
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+logger = get_logger_app()
+
+LATEST = "latest"
+
+_RESOLVED_MODELS = {}
+
+
+def is_tagged_latest(model):
+    """Return True when the `latest` tag of `model` is set to a true value."""
+    value = (getattr(model, "tags", None) or {}).get(LATEST)
+    return value is not None and str(value).lower() in ("", "true", "1", "yes")
+
+
+def iter_model_pages(ml_client, name):
+    """Yield the pages of the versions of `name`, fetching the next page only when it is needed."""
+    listing = ml_client.models.list(name=name)
+    if hasattr(listing, "by_page"):
+        yield from listing.by_page()
+    else:
+        yield listing
+
+
+def scan_latest_model(ml_client, name):
+    """
+    Stream the versions of `name` and return the version tagged `latest`, or else the highest version.
+
+    Listing stops at the first page holding a version tagged `latest`.
+    """
+    latest = None
+    pages = 0
+    for page in iter_model_pages(ml_client, name):
+        pages += 1
+        for model in page:
+            if is_tagged_latest(model):
+                logger.info(f"Version {model.version} of {name} is tagged {LATEST}, read {pages} pages")
+                return model
+            try:
+                version = int(model.version)
+            except (TypeError, ValueError):
+                continue
+            if latest is None or version > int(latest.version):
+                latest = model
+    logger.info(f"Scanned {pages} pages of {name} versions")
+    return latest
+
+
+def resolve_latest_model(ml_client, name, use_label=True):
+    """
+    Return the latest version of the registered model `name`, fetching it at most once per run.
+
+    The `latest` label is resolved by the service in one call. When the label is not supported, the
+    versions are streamed by `scan_latest_model`. The returned object is the fetched model itself.
+    """
+    key = (id(ml_client), name)
+    if key in _RESOLVED_MODELS:
+        return _RESOLVED_MODELS[key]
+    model = None
+    if use_label:
+        try:
+            model = ml_client.models.get(name=name, label=LATEST)
+        except Exception as e:
+            logger.info(f"Could not resolve the {LATEST} label of {name}, listing its versions: {e}")
+    if model is None:
+        model = scan_latest_model(ml_client, name)
+    if model is None:
+        raise ValueError(f"No registered version of model {name}")
+    logger.info(f"Resolved {name} to version {model.version}")
+    _RESOLVED_MODELS[key] = model
+    return model
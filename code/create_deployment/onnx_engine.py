@@ -0,0 +1,197 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the ONNX Runtime inference engine used by score."""
+
+import os
+import fcntl
+import hashlib
+import inspect
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import onnxruntime as ort
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+from model_loading import find_file_dir, load_model
+from tokenization import CachedTokenizer
+
+logger = get_logger_app()
+
+ONNX_OPSET = 14
+PARITY_SENTENCES = [
+    "The quick brown fox jumps over the lazy dog.",
+    "Rich we have impeccable taste.",
+    "Mary wants to wear nice blue German dress.",
+    "The more you would want, the less you would eat.",
+]
+
+
+def model_fingerprint(model_dir):
+    """Fingerprint the model files so a cached graph is re-exported when the model changes."""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if os.path.isfile(path) and not name.endswith((".onnx", ".onnx.tmp", ".onnx.lock")):
+            stat = os.stat(path)
+            digest.update(f"{name}:{stat.st_size}:{int(stat.st_mtime)}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+@contextmanager
+def export_lock(graph_path):
+    """Hold an exclusive lock on `graph_path`, so concurrent workers export the graph once."""
+    with open(f"{graph_path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class OnnxRuntimeDeployment:
+    """
+    Serve the fine-tuned model from an ONNX Runtime session.
+
+    The model is exported to ONNX on the first start and the graph is cached next to the model,
+    or in `cache_dir` when the model directory is read-only, so restarts skip both the export and
+    loading the torch model. Freshly exported graphs are checked against the torch outputs.
+    Inputs are tokenized by batch with the token ids of `tokenizer_cache_size` sentences cached.
+    `predict` returns the label of every input.
+    """
+
+    def __init__(self, model_path, intra_op_threads=0, inter_op_threads=1, max_length=128,
+                 cache_dir=None, parity_atol=1e-3, tokenizer_cache_size=0, metrics=None):
+        self.model_dir = find_file_dir(model_path, "config.json")
+        self.tokenizer_dir = find_file_dir(model_path, "tokenizer_config.json")
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.max_length = max_length
+        self.cache_dir = cache_dir
+        self.parity_atol = parity_atol
+        self.tokenizer_cache_size = tokenizer_cache_size
+        self.metrics = metrics
+        self.tokenizer = None
+        self.encoder = None
+        self.session = None
+        self.session_graph_path = None
+        self.input_names = None
+        self.id2label = None
+
+    def graph_path(self):
+        """Return where the exported graph is cached, next to the model when the directory is writable."""
+        file_name = f"model-{model_fingerprint(self.model_dir)}.onnx"
+        if os.access(self.model_dir, os.W_OK):
+            return os.path.join(self.model_dir, file_name)
+        cache_dir = self.cache_dir or os.path.join(tempfile.gettempdir(), "onnx_cache")
+        os.makedirs(cache_dir, exist_ok=True)
+        return os.path.join(cache_dir, file_name)
+
+    def export(self, model, graph_path):
+        """Export `model` with dynamic batch and sequence axes."""
+        import torch
+
+        encoded = self.tokenizer(PARITY_SENTENCES[:2], padding=True, return_tensors="pt")
+        # graph inputs follow the order of the forward signature, not the tokenizer output
+        input_names = [name for name in inspect.signature(model.forward).parameters if name in encoded]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["logits"] = {0: "batch"}
+        export_kwargs = {}
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+            # keep the TorchScript exporter on torch versions defaulting to dynamo
+            export_kwargs["dynamo"] = False
+        # export to a temporary file of its own so a crash never leaves a truncated graph in the cache
+        graph_dir, graph_name = os.path.split(graph_path)
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{graph_name[:-len('.onnx')]}.", suffix=".onnx.tmp", dir=graph_dir)
+        os.close(fd)
+        try:
+            with torch.no_grad():
+                torch.onnx.export(
+                    model,
+                    ({name: encoded[name] for name in input_names},),
+                    tmp_path,
+                    input_names=input_names,
+                    output_names=["logits"],
+                    dynamic_axes=dynamic_axes,
+                    opset_version=ONNX_OPSET,
+                    **export_kwargs,
+                )
+            os.replace(tmp_path, graph_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        logger.info(f"Exported ONNX graph to {graph_path}")
+
+    def create_session(self, graph_path):
+        self.session_graph_path = graph_path
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        self.session = ort.InferenceSession(graph_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [session_input.name for session_input in self.session.get_inputs()]
+        logger.info(
+            f"ONNX Runtime session ready - inputs {self.input_names}, "
+            f"intra_op_threads {self.intra_op_threads}, inter_op_threads {self.inter_op_threads}"
+        )
+
+    def set_num_threads(self, num_threads):
+        """
+        Recreate the session with `num_threads` intra-op threads.
+
+        Also called in forked workers, since the thread pool of a session created before fork does not exist there.
+        """
+        self.intra_op_threads = num_threads
+        self.create_session(self.session_graph_path)
+
+    def logits(self, inputs):
+        """Tokenize `inputs` and return the logits computed by the session."""
+        encoded = self.encoder.encode(inputs)
+        feed = {name: encoded[name] for name in self.input_names}
+        return self.session.run(["logits"], feed)[0]
+
+    def parity_check(self, model):
+        """Compare the session logits with the torch model logits."""
+        import torch
+
+        encoded = self.tokenizer(PARITY_SENTENCES, padding=True, return_tensors="pt")
+        with torch.no_grad():
+            expected = model(**encoded).logits.numpy()
+        max_diff = float(np.abs(self.logits(PARITY_SENTENCES) - expected).max())
+        logger.info(f"ONNX parity check - max abs logit difference {max_diff}")
+        if max_diff > self.parity_atol:
+            raise RuntimeError(f"ONNX graph differs from the torch model by {max_diff} > {self.parity_atol}")
+
+    def prepare_prediction_service(self):
+        """Load the tokenizer and the ONNX Runtime session, exporting the graph when it is not cached yet."""
+        from transformers import AutoConfig, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_dir, use_fast=True)
+        self.encoder = CachedTokenizer(self.tokenizer, self.max_length, self.tokenizer_cache_size, self.metrics)
+        config = AutoConfig.from_pretrained(self.model_dir)
+        self.id2label = {int(key): value for key, value in config.id2label.items()}
+        graph_path = self.graph_path()
+        # concurrent workers wait for the first one to export and check the graph, then load it
+        with export_lock(graph_path):
+            if os.path.exists(graph_path):
+                logger.info(f"Using cached ONNX graph {graph_path}")
+                self.create_session(graph_path)
+                return
+            model = load_model(self.model_dir)
+            self.export(model, graph_path)
+            self.create_session(graph_path)
+            try:
+                self.parity_check(model)
+            except Exception:
+                os.remove(graph_path)
+                raise
+
+    def predict(self, inputs):
+        """Return the predicted label of every input."""
+        class_ids = self.logits(inputs).argmax(axis=-1)
+        return [self.id2label.get(int(class_id), int(class_id)) for class_id in class_ids]
+
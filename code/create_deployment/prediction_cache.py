@@ -0,0 +1,73 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the prediction cache used by score."""
+
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def normalize_inputs(inputs):
+    """Collapse surrounding and repeated whitespace in every sentence of `inputs`."""
+    if isinstance(inputs, str):
+        return " ".join(inputs.split())
+    if isinstance(inputs, list):
+        return [normalize_inputs(item) for item in inputs]
+    if isinstance(inputs, dict):
+        return {key: normalize_inputs(value) for key, value in inputs.items()}
+    return inputs
+
+
+class PredictionCache:
+    """Thread safe LRU cache of predictions with a time to live, keyed on the normalized inputs."""
+
+    def __init__(self, max_size=1024, ttl_s=300):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(inputs):
+        """Hash the normalized `inputs` payload."""
+        payload = json.dumps(normalize_inputs(inputs), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached predictions for `key`, or None when missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_s:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, predictions):
+        """Store `predictions` under `key`, evicting the least recently used entries past `max_size`."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), predictions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Return the hit/miss counters of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
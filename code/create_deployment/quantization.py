@@ -0,0 +1,52 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the int8 dynamic quantization applied by score for CPU inference."""
+
+import torch
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+logger = get_logger_app()
+
+
+def quantize_dynamic_int8(model):
+    """Quantize the weights of the `Linear` layers of `model` to int8, activations are quantized on the fly."""
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def find_torch_modules(obj, prefix="", depth=2):
+    """Return `(owner, attribute, path)` of the torch modules held by `obj` or its attributes up to `depth` levels."""
+    found = []
+    for name, value in vars(obj).items():
+        path = f"{prefix}{name}"
+        if isinstance(value, torch.nn.Module):
+            found.append((obj, name, path))
+        elif depth > 1 and hasattr(value, "__dict__") and not isinstance(value, type):
+            found.extend(find_torch_modules(value, prefix=f"{path}.", depth=depth - 1))
+    return found
+
+
+def quantize_deployment(deploy_obj):
+    """
+    Replace the models held by the prepared `Deployment` with their int8 dynamically quantized version.
+
+    Returns the attribute paths of the quantized models.
+    """
+    if not torch.backends.quantized.supported_engines or torch.backends.quantized.engine == "none":
+        raise RuntimeError("int8 quantization is not supported by this torch build")
+    quantized = []
+    seen = {}
+    for owner, name, path in find_torch_modules(deploy_obj):
+        module = getattr(owner, name)
+        # the same model is often shared, e.g. by the deployment and its pipeline
+        if id(module) not in seen:
+            seen[id(module)] = quantize_dynamic_int8(module)
+        setattr(owner, name, seen[id(module)])
+        quantized.append(path)
+    if not quantized:
+        raise RuntimeError("No torch model found on the deployment object to quantize")
+    logger.info(f"Quantized to int8 - {quantized}")
+    return quantized
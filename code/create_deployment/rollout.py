@@ -0,0 +1,351 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+Roll out several online and batch deployments at once.
+
+Every deployment spec goes through three steps: make sure its endpoint exists, create or update the
+deployment, then route the endpoint traffic (online) or default deployment (batch) to it. Online
+deployments with a capacity plan also get their Azure Monitor autoscale setting once created. The long
+running operations of all specs are started as soon as the step they depend on succeeded and are
+polled together, so the rollout takes as long as the slowest deployment instead of the sum of them.
+
+Spec files are JSON or YAML lists, e.g.
+
+    - kind: online
+      endpoint_name: cpu-online-sl-class
+      deployment_name: cpu-test
+      model: azureml:sample_model_single_label_classification:4
+      instance_type: Standard_F8s_v2
+      capacity_plan: capacity_plan.json
+      traffic: 100
+    - kind: batch
+      endpoint_name: cpu-batch-sl-class
+      deployment_name: cpu-test
+      model: azureml:sample_model_single_label_classification:4
+      compute: sample-score-cluster-cpu
+"""
+
+import os
+import json
+import time
+import argparse
+
+from azure.ai.ml.entities import (
+    BatchDeployment,
+    BatchEndpoint,
+    ManagedOnlineDeployment,
+    ManagedOnlineEndpoint,
+    OnlineRequestSettings,
+)
+from azure.ai.ml.constants import BatchDeploymentOutputAction
+
+from capacity_plan import apply_autoscale, check_autoscale_available, load_capacity_plan
+from traffic_shift import rebalance_traffic
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+ONLINE_DEPLOYMENT_FIELDS = ("instance_type", "instance_count", "environment_variables", "request_settings")
+BATCH_DEPLOYMENT_FIELDS = ("compute", "instance_count", "max_concurrency_per_instance", "mini_batch_size")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Roll out online and batch deployments concurrently")
+    parser.add_argument("--spec_file", type=str, help="JSON or YAML list of deployment specs", required=True)
+    parser.add_argument("--config_path", type=str, help="Workspace config file of the MLClient", default="config.json")
+    parser.add_argument("--poll_interval_s", type=float, help="Interval between polls of the operations", default=10)
+    parser.add_argument("--progress_interval_s", type=float, help="Interval between progress reports", default=60)
+    parser.add_argument("--output_json", type=str, help="Path to save the rollout report", default=None)
+    return parser.parse_args()
+
+
+def load_specs(spec_file):
+    """Read the deployment specs of `spec_file` and check the fields every spec needs."""
+    with open(spec_file) as f:
+        if spec_file.endswith((".yml", ".yaml")):
+            import yaml
+
+            specs = yaml.safe_load(f)
+        else:
+            specs = json.load(f)
+    for spec in specs:
+        missing = [key for key in ("kind", "endpoint_name", "deployment_name", "model") if key not in spec]
+        if missing:
+            raise ValueError(f"Deployment spec {spec} misses {missing}")
+        if spec["kind"] not in ("online", "batch"):
+            raise ValueError(f"Deployment kind must be online or batch, got {spec['kind']}")
+    return specs
+
+
+def create_credential():
+    """Return the managed identity of the compute when there is one, otherwise the default credential."""
+    from azure.identity import DefaultAzureCredential, ManagedIdentityCredential
+
+    client_id = os.environ.get("DEFAULT_IDENTITY_CLIENT_ID")
+    return ManagedIdentityCredential(client_id=client_id) if client_id else DefaultAzureCredential()
+
+
+def create_ml_client(config_path, credential):
+    """Connect to the workspace of `config_path`, or to the one of the pipeline job running this script."""
+    from azure.ai.ml import MLClient
+
+    if os.path.exists(config_path):
+        return MLClient.from_config(credential, path=config_path)
+    # inside a pipeline job, write the config of the workspace running the job
+    from azureml.core import Run
+
+    Run.get_context(allow_offline=False).experiment.workspace.write_config()
+    return MLClient.from_config(credential)
+
+
+def endpoint_operations(ml_client, kind):
+    return ml_client.online_endpoints if kind == "online" else ml_client.batch_endpoints
+
+
+def deployment_operations(ml_client, kind):
+    return ml_client.online_deployments if kind == "online" else ml_client.batch_deployments
+
+
+def build_deployment(spec):
+    """Build the deployment entity of `spec`."""
+    if spec["kind"] == "online":
+        fields = {key: spec[key] for key in ONLINE_DEPLOYMENT_FIELDS if key in spec}
+        if "capacity_plan" in spec:
+            plan = load_capacity_plan(spec["capacity_plan"])
+            check_autoscale_available()
+            # managed deployments keep the default scale settings, the autoscale step scales them within the plan
+            fields["instance_count"] = plan["instance_count"]
+            fields["request_settings"] = OnlineRequestSettings(
+                max_concurrent_requests_per_instance=plan["max_concurrent_requests_per_instance"]
+            )
+        return ManagedOnlineDeployment(
+            name=spec["deployment_name"], endpoint_name=spec["endpoint_name"], model=spec["model"], **fields
+        )
+    fields = {key: spec[key] for key in BATCH_DEPLOYMENT_FIELDS if key in spec}
+    return BatchDeployment(
+        name=spec["deployment_name"],
+        endpoint_name=spec["endpoint_name"],
+        model=spec["model"],
+        output_action=BatchDeploymentOutputAction.APPEND_ROW,
+        output_file_name=spec.get("output_file_name", "predictions.csv"),
+        **fields,
+    )
+
+
+class RolloutStep:
+    """One long running operation of the rollout, started once all the steps it depends on succeeded."""
+
+    def __init__(self, name, start_fn, depends_on=()):
+        self.name = name
+        self.start_fn = start_fn
+        self.depends_on = list(depends_on)
+        self.status = PENDING
+        self.poller = None
+        self.started = None
+        self.duration_s = None
+        self.error = None
+
+    def start(self):
+        self.status = RUNNING
+        self.started = time.perf_counter()
+        try:
+            # start functions return None when there is nothing to wait for
+            self.poller = self.start_fn()
+        except Exception as e:
+            self.finish(FAILED, e)
+            return
+        if self.poller is None:
+            self.finish(SUCCEEDED)
+
+    def poll(self):
+        """Check the operation once, returning True when it finished."""
+        if not self.poller.done():
+            return False
+        try:
+            self.poller.result()
+        except Exception as e:
+            self.finish(FAILED, e)
+        else:
+            self.finish(SUCCEEDED)
+        return True
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = None if error is None else str(error)
+        if self.started is not None:
+            self.duration_s = round(time.perf_counter() - self.started, 3)
+
+    def report(self):
+        return {"status": self.status, "duration_s": self.duration_s, "error": self.error}
+
+
+def plan_rollout(ml_client, specs, credential=None):
+    """Return the steps rolling out `specs`, one endpoint and one routing step per endpoint."""
+    steps = {}
+    routes = {}
+    for spec in specs:
+        kind, endpoint_name = spec["kind"], spec["endpoint_name"]
+        endpoint_step = f"{kind} endpoint {endpoint_name}"
+        if endpoint_step not in steps:
+            steps[endpoint_step] = RolloutStep(endpoint_step, ensure_endpoint_fn(ml_client, kind, endpoint_name))
+        deployment_step = f"{kind} deployment {endpoint_name}/{spec['deployment_name']}"
+        deployment = build_deployment(spec)
+        operations = deployment_operations(ml_client, kind)
+        steps[deployment_step] = RolloutStep(
+            deployment_step,
+            lambda operations=operations, deployment=deployment: operations.begin_create_or_update(deployment),
+            depends_on=[endpoint_step],
+        )
+        if kind == "online" and "capacity_plan" in spec:
+            autoscale_step = f"{kind} autoscale {endpoint_name}/{spec['deployment_name']}"
+            steps[autoscale_step] = RolloutStep(
+                autoscale_step, autoscale_fn(ml_client, credential, spec), depends_on=[deployment_step]
+            )
+        routes.setdefault((kind, endpoint_name), []).append((deployment_step, spec))
+    for (kind, endpoint_name), deployments in routes.items():
+        route_step = f"{kind} routing {endpoint_name}"
+        steps[route_step] = RolloutStep(
+            route_step,
+            route_fn(ml_client, kind, endpoint_name, [spec for _, spec in deployments]),
+            depends_on=[name for name, _ in deployments],
+        )
+    return list(steps.values())
+
+
+def ensure_endpoint_fn(ml_client, kind, endpoint_name):
+    def ensure_endpoint():
+        operations = endpoint_operations(ml_client, kind)
+        try:
+            operations.get(endpoint_name)
+            return None
+        except Exception:
+            endpoint_class = ManagedOnlineEndpoint if kind == "online" else BatchEndpoint
+            return operations.begin_create_or_update(endpoint_class(name=endpoint_name))
+
+    return ensure_endpoint
+
+
+def autoscale_fn(ml_client, credential, spec):
+    def autoscale():
+        if credential is None:
+            raise ValueError(f"Autoscaling {spec['deployment_name']} needs the credential of the MLClient")
+        endpoint_name = spec["endpoint_name"]
+        apply_autoscale(
+            credential,
+            ml_client.subscription_id,
+            ml_client.resource_group_name,
+            ml_client.online_deployments.get(spec["deployment_name"], endpoint_name),
+            ml_client.online_endpoints.get(endpoint_name).location,
+            load_capacity_plan(spec["capacity_plan"]),
+        )
+        return None
+
+    return autoscale
+
+
+def route_fn(ml_client, kind, endpoint_name, specs):
+    """Return the step updating the endpoint once for all its deployments, so updates never overwrite each other."""
+    def route():
+        operations = endpoint_operations(ml_client, kind)
+        endpoint = operations.get(endpoint_name)
+        if kind == "online":
+            shares = {spec["deployment_name"]: int(spec["traffic"]) for spec in specs if "traffic" in spec}
+            if not shares:
+                return None
+            if any(share < 0 for share in shares.values()) or sum(shares.values()) > 100:
+                raise ValueError(
+                    f"Traffic shares {shares} of {endpoint_name} must be percentages summing to 100 at most"
+                )
+            # the deployments already serving the endpoint share what is left
+            traffic = rebalance_traffic(endpoint.traffic or {}, shares)
+            if sum(traffic.values()) not in (0, 100):
+                raise ValueError(
+                    f"Traffic of {endpoint_name} would be {traffic}, the shares of its deployments must sum to 100"
+                )
+            endpoint.traffic = traffic
+        else:
+            defaults = [spec for spec in specs if spec.get("set_default", True)]
+            if not defaults:
+                return None
+            deployment_name = defaults[-1]["deployment_name"]
+            if endpoint.defaults is None or isinstance(endpoint.defaults, dict):
+                endpoint.defaults = {**(endpoint.defaults or {}), "deployment_name": deployment_name}
+            else:
+                endpoint.defaults.deployment_name = deployment_name
+        return operations.begin_create_or_update(endpoint)
+
+    return route
+
+
+def run_rollout(ml_client, specs, poll_interval_s=10, progress_interval_s=60, credential=None):
+    """
+    Roll out `specs`, polling all the running operations together, and return the report of every step.
+
+    `credential` is the one of `ml_client`, needed by the autoscale steps of specs with a capacity plan.
+    """
+    steps = plan_rollout(ml_client, specs, credential)
+    by_name = {step.name: step for step in steps}
+    start = time.perf_counter()
+    last_progress = start
+    while True:
+        progressed = False
+        for step in steps:
+            if step.status != PENDING:
+                continue
+            dependencies = [by_name[name].status for name in step.depends_on]
+            if any(status in (FAILED, SKIPPED) for status in dependencies):
+                step.finish(SKIPPED, f"skipped after the failure of {step.depends_on}")
+                progressed = True
+                print(f"[{time.perf_counter() - start:7.1f}s] {step.name} skipped")
+            elif all(status == SUCCEEDED for status in dependencies):
+                print(f"[{time.perf_counter() - start:7.1f}s] starting {step.name}")
+                step.start()
+                progressed = True
+                if step.status != RUNNING:
+                    print(f"[{time.perf_counter() - start:7.1f}s] {step.name} {step.status} {step.error or ''}")
+        for step in steps:
+            if step.status == RUNNING and step.poll():
+                progressed = True
+                print(
+                    f"[{time.perf_counter() - start:7.1f}s] {step.name} {step.status} "
+                    f"after {step.duration_s}s {step.error or ''}"
+                )
+        if all(step.status in (SUCCEEDED, FAILED, SKIPPED) for step in steps):
+            break
+        if time.perf_counter() - last_progress >= progress_interval_s:
+            last_progress = time.perf_counter()
+            running = [step.name for step in steps if step.status == RUNNING]
+            done = sum(step.status == SUCCEEDED for step in steps)
+            print(f"[{last_progress - start:7.1f}s] {done}/{len(steps)} steps done, running {running}")
+        # steps unblocked by a finished one are started right away, otherwise wait for the operations
+        if not progressed:
+            time.sleep(poll_interval_s)
+    return {
+        "duration_s": round(time.perf_counter() - start, 3),
+        "succeeded": all(step.status == SUCCEEDED for step in steps),
+        "steps": {step.name: step.report() for step in steps},
+    }
+
+
+def main():
+    args = parse_args()
+    print(args)
+
+    specs = load_specs(args.spec_file)
+    credential = create_credential()
+    ml_client = create_ml_client(args.config_path, credential)
+    report = run_rollout(ml_client, specs, args.poll_interval_s, args.progress_interval_s, credential)
+    print(json.dumps(report, indent=2))
+    if args.output_json:
+        with open(args.output_json, "w") as f:
+            json.dump(report, f, indent=2)
+    if not report["succeeded"]:
+        raise RuntimeError("Rollout failed, see the report above")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,10 @@
 
 import os
 import json
+import time
+import shutil
 import argparse
-
-import numpy as np
+import tempfile
 
 from flask import request
 
@@ -20,81 +21,316 @@ from azureml.train.finetune.core.utils.error_handling.exceptions import Resource
 from azureml.train.finetune.core.utils.error_handling.error_definitions import DeploymentFailed
 from azureml._common._error_definition.azureml_error import AzureMLError  # type: ignore
 
+from batching import MicroBatcher, is_text_batch
+from bucketing import LengthBucketer
+from cascade import ConfidenceCascade, TruncatedDraft, check_labels
+from coalescing import InputCoalescer
+from prediction_cache import PredictionCache
+from json_codec import get_codec
+from startup import StartupProfiler, run_warmup
+from metrics import StageMetrics
+from workers import available_cores, set_num_threads
+
 logger = get_logger_app()
 
 DEPLOY_OBJ = None
+ENV_VAR = None
+BATCHER = None
+BUCKETER = None
+CASCADE = None
+PREDICTION_CACHE = None
+COALESCER = None
 REQUEST_FILES_PATH = None
+IN_MEMORY_FILES_PATH = None
+IN_MEMORY_MAX_BYTES = 0
 REQUEST_FILES_DIR = "request_files"
+SHARED_MEMORY_DIR = "/dev/shm"
+CODEC = get_codec()
+STAGE_METRICS = StageMetrics()
 
 
-class _JSONEncoder(json.JSONEncoder):
-    """custom `JSONEncoder` to make sure float and int64 ar converted."""
+def encode_json(content):
+    """Encode json with the configured codec."""
+    return CODEC.encode(content)
 
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.floating):
-            return float(obj)
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        else:
-            return super(_JSONEncoder, self).default(obj)
 
+def decode_json(content):
+    """Decode the json content with the configured codec."""
+    return CODEC.decode(content)
 
-def encode_json(content):
-    """Encode json with custom `JSONEncoder`."""
-    return json.dumps(
-        content,
-        ensure_ascii=False,
-        allow_nan=False,
-        indent=None,
-        cls=_JSONEncoder,
-        separators=(",", ":"),
-    )
 
+def prepare_codec(env_var):
+    """Select the json codec used for requests and predictions."""
+    global CODEC
+    CODEC = get_codec(env_var.get("json_codec", "auto"))
+    logger.info(f"Using {CODEC.name} json codec")
 
-def decode_json(content):
-    """Decode the json content."""
-    return json.loads(content)
 
+def prepare_request_files_dir(env_var):
+    """
+    Create directories to store files sent via requests.
 
-def prepare_request_files_dir():
-    """Create directory to store files sent via requests."""
-    cwd = os.getcwd()
-    global REQUEST_FILES_PATH
-    REQUEST_FILES_PATH = os.path.join(cwd, REQUEST_FILES_DIR)
+    Requests of at most `request_files_in_memory_max_mb` are stored on the memory backed `/dev/shm` when
+    available, so small uploads never touch the disk. Larger ones go to the disk, as `/dev/shm` of a
+    container is often limited to 64MB.
+    """
+    global REQUEST_FILES_PATH, IN_MEMORY_FILES_PATH, IN_MEMORY_MAX_BYTES
+    REQUEST_FILES_PATH = os.path.join(os.getcwd(), REQUEST_FILES_DIR)
     os.makedirs(REQUEST_FILES_PATH, exist_ok=True)
     logger.info(f"Request files will be saved at {REQUEST_FILES_PATH}")
+    in_memory = str(env_var.get("request_files_in_memory", True)).lower() == "true"
+    if in_memory and os.path.isdir(SHARED_MEMORY_DIR):
+        IN_MEMORY_FILES_PATH = os.path.join(SHARED_MEMORY_DIR, REQUEST_FILES_DIR)
+        IN_MEMORY_MAX_BYTES = int(float(env_var.get("request_files_in_memory_max_mb", 4)) * 1024 * 1024)
+        os.makedirs(IN_MEMORY_FILES_PATH, exist_ok=True)
+        logger.info(f"Requests up to {IN_MEMORY_MAX_BYTES} bytes will save their files at {IN_MEMORY_FILES_PATH}")
+
+
+def create_request_files_dir(content_length=None):
+    """
+    Create a directory private to the current request to store its files.
+
+    The directory is in memory when the request body is known to fit under the in-memory limit.
+    """
+    if IN_MEMORY_FILES_PATH is not None and content_length is not None and content_length <= IN_MEMORY_MAX_BYTES:
+        return tempfile.mkdtemp(dir=IN_MEMORY_FILES_PATH)
+    return tempfile.mkdtemp(dir=REQUEST_FILES_PATH)
 
 
-def post_process_files_dir():
-    """Clear files stored by requests."""
-    for path, _, files in os.walk(REQUEST_FILES_PATH):
-        for name in files:
-            file_name = (os.path.join(path, name))
-            os.remove(file_name)
-            logger.debug(f"removed {file_name}")
+def post_process_files_dir(files_dir):
+    """Clear files stored by a request, leaving files of concurrent requests untouched."""
+    if files_dir is None:
+        return
+    with STAGE_METRICS.time("cleanup"):
+        shutil.rmtree(files_dir, ignore_errors=True)
+    logger.debug(f"removed {files_dir}")
 
 
-def preprocess_request(raw_data):
-    """Preprocess request data."""
+def preprocess_request(raw_data, files_dir=None):
+    """Preprocess request data, saving request files in `files_dir`."""
     inputs = []
     if request.content_type == "application/json":
         logger.debug("Processing json data")
-        data = decode_json(raw_data)
+        with STAGE_METRICS.time("decode"):
+            data = decode_json(raw_data)
         # pop inputs for pipeline
         inputs = data.pop("inputs", data)
     else:
         logger.info("Processing request files")
-        for file in request.files:
-            file_name = request.files[file].filename
-            save_name = os.path.join(REQUEST_FILES_PATH, file_name)
-            request.files[file].save(save_name)
-            logger.debug(f"created {save_name}")
-            inputs.append({"file": save_name})
+        with STAGE_METRICS.time("file_save"):
+            for file in request.files:
+                # never trust client file names with directories
+                file_name = os.path.basename(request.files[file].filename or "") or file
+                save_name = os.path.join(files_dir, file_name)
+                request.files[file].save(save_name)
+                logger.debug(f"created {save_name}")
+                inputs.append({"file": save_name})
     return inputs
 
 
+def prepare_bucketer(env_var):
+    """Create the length bucketer when `length_buckets` boundaries are configured."""
+    global BUCKETER
+    boundaries = env_var.get("length_buckets") or []
+    if not boundaries:
+        return
+    BUCKETER = LengthBucketer(DEPLOY_OBJ.predict, boundaries)
+    logger.info(f"Length bucketing enabled - boundaries {BUCKETER.boundaries} words")
+
+
+def prepare_batcher(env_var):
+    """Create the micro-batcher gathering concurrent requests when `max_batch_size` > 1."""
+    global BATCHER
+    max_batch_size = int(env_var.get("max_batch_size", 1))
+    if max_batch_size <= 1:
+        return
+    max_batch_wait_ms = float(env_var.get("max_batch_wait_ms", 10))
+    BATCHER = MicroBatcher(forward, max_batch_size=max_batch_size, max_wait_ms=max_batch_wait_ms)
+    logger.info(f"Micro-batching enabled - max_batch_size {max_batch_size}, max_batch_wait_ms {max_batch_wait_ms}")
+
+
+def prepare_prediction_cache(env_var):
+    """Create the prediction cache when `prediction_cache_size` > 0."""
+    global PREDICTION_CACHE
+    cache_size = int(env_var.get("prediction_cache_size", 0))
+    if cache_size <= 0:
+        return
+    cache_ttl_s = float(env_var.get("prediction_cache_ttl_s", 300))
+    PREDICTION_CACHE = PredictionCache(max_size=cache_size, ttl_s=cache_ttl_s)
+    STAGE_METRICS.add_gauge("prediction_cache", PREDICTION_CACHE.stats)
+    logger.info(f"Prediction cache enabled - size {cache_size}, ttl {cache_ttl_s}s")
+
+
+def prepare_coalescer(env_var):
+    """Create the coalescer of identical inputs when `coalesce_inputs` is true."""
+    global COALESCER
+    if str(env_var.get("coalesce_inputs", False)).lower() != "true":
+        return
+    COALESCER = InputCoalescer()
+    STAGE_METRICS.add_gauge("coalescing", COALESCER.stats)
+    logger.info("Coalescing of identical inputs enabled")
+
+
+def create_draft(env_var):
+    """Create the draft classifier of the cascade, a separate model or the first layers of the torch engine."""
+    draft_model = env_var.get("cascade_draft_model")
+    if draft_model:
+        from torch_engine import TorchDeployment
+
+        draft = TorchDeployment(
+            os.path.join(env_var["model_path"], draft_model),
+            max_length=int(env_var.get("max_seq_length", 128)),
+            tokenizer_cache_size=int(env_var.get("tokenizer_cache_size", 4096)),
+        )
+        draft.prepare_prediction_service()
+        return draft
+    if env_var.get("inference_engine", "deployment") != "torch":
+        raise ValueError("cascade_draft_layers needs the torch inference engine, set cascade_draft_model instead")
+    return TruncatedDraft(DEPLOY_OBJ, int(env_var["cascade_draft_layers"]))
+
+
+def prepare_cascade(env_var):
+    """
+    Create the confidence cascade when `cascade_threshold` > 0 and a draft classifier is configured.
+
+    Draft classifiers answer in the output format of the torch and onnx engines, so the full model has to
+    run on one of them for escalated and confident inputs to be answered alike.
+    """
+    global CASCADE
+    threshold = float(env_var.get("cascade_threshold", 0))
+    if threshold <= 0:
+        return
+    if not env_var.get("cascade_draft_model") and int(env_var.get("cascade_draft_layers", 0)) <= 0:
+        logger.warning("cascade_threshold is set without cascade_draft_model or cascade_draft_layers, ignoring it")
+        return
+    inference_engine = env_var.get("inference_engine", "deployment")
+    if inference_engine not in ("torch", "onnx"):
+        raise ValueError(f"cascade_threshold needs the torch or onnx inference engine, got {inference_engine}")
+    draft = create_draft(env_var)
+    check_labels(draft, DEPLOY_OBJ)
+    CASCADE = ConfidenceCascade(draft, engine_forward, threshold, metrics=STAGE_METRICS)
+    logger.info(f"Confidence cascade enabled - threshold {threshold}, draft {type(draft).__name__}")
+
+
+def engine_forward(inputs):
+    """Run the model on `inputs`, splitting sentence lists into length buckets when enabled."""
+    if BUCKETER is not None and is_text_batch(inputs):
+        return BUCKETER.predict(inputs)
+    return DEPLOY_OBJ.predict(inputs)
+
+
+def model_forward(inputs):
+    """Run the model on `inputs`, answering confident sentences with the draft classifier when the cascade is enabled."""
+    if CASCADE is not None and is_text_batch(inputs):
+        return CASCADE.predict(inputs)
+    return engine_forward(inputs)
+
+
+def forward(inputs):
+    """Run the model on `inputs`, predicting repeated sentences of a list once when coalescing is enabled."""
+    if COALESCER is not None and is_text_batch(inputs):
+        return COALESCER.dedupe(inputs, model_forward)
+    return model_forward(inputs)
+
+
+def coalesced_predict(inputs):
+    """Predict `inputs`, sharing the prediction of concurrent identical sentence lists when coalescing is enabled."""
+    if COALESCER is not None and is_text_batch(inputs):
+        return COALESCER.predict(inputs, model_predict)
+    return model_predict(inputs)
+
+
+def model_predict(inputs):
+    """Predict `inputs`, sending sentence lists through the micro-batcher when it is enabled."""
+    if BATCHER is not None and is_text_batch(inputs):
+        return BATCHER.submit(inputs)
+    return forward(inputs)
+
+
+def predict(inputs):
+    """Predict `inputs`, answering repeated sentence lists from the prediction cache when it is enabled."""
+    if PREDICTION_CACHE is None or not is_text_batch(inputs):
+        return coalesced_predict(inputs)
+    key = PREDICTION_CACHE.make_key(inputs)
+    predictions = PREDICTION_CACHE.get(key)
+    if predictions is None:
+        predictions = coalesced_predict(inputs)
+        PREDICTION_CACHE.put(key, predictions)
+    return predictions
+
+
+def create_deployment(args, env_var):
+    """Create the object serving predictions for the configured `inference_engine`."""
+    engine = env_var.get("inference_engine", "deployment")
+    if engine == "deployment":
+        return Deployment(args)
+    if engine == "torch":
+        from torch_engine import TorchDeployment
+
+        return TorchDeployment(
+            env_var["model_path"],
+            max_length=int(env_var.get("max_seq_length", 128)),
+            tokenizer_cache_size=int(env_var.get("tokenizer_cache_size", 4096)),
+            metrics=STAGE_METRICS,
+        )
+    if engine == "onnx":
+        from onnx_engine import OnnxRuntimeDeployment
+
+        return OnnxRuntimeDeployment(
+            env_var["model_path"],
+            intra_op_threads=int(env_var.get("onnx_intra_op_threads", 0)),
+            inter_op_threads=int(env_var.get("onnx_inter_op_threads", 1)),
+            max_length=int(env_var.get("max_seq_length", 128)),
+            cache_dir=env_var.get("onnx_cache_dir"),
+            tokenizer_cache_size=int(env_var.get("tokenizer_cache_size", 4096)),
+            metrics=STAGE_METRICS,
+        )
+    raise ValueError(f"Unknown inference engine {engine}")
+
+
+def prepare_int8_model():
+    """Quantize the prepared model to int8 for CPU inference."""
+    from quantization import quantize_deployment
+
+    quantize_deployment(DEPLOY_OBJ)
+
+
+def warmup(env_var, profiler):
+    """Run synthetic predictions at the configured `warmup_batch_sizes` before serving requests."""
+    batch_sizes = env_var.get("warmup_batch_sizes") or []
+    if not batch_sizes:
+        return
+    iterations = int(env_var.get("warmup_iterations", 1))
+    try:
+        profiler.details["warmup_latencies_s"] = run_warmup(DEPLOY_OBJ.predict, batch_sizes, iterations)
+    except Exception:
+        # a failed warm-up only costs latency on the first requests
+        logger.warning("Warm-up failed: \n", exc_info=True)
+
+
+def size_threads(num_threads):
+    """Size the intra-op thread pools of the process and of the inference engine to `num_threads`."""
+    set_num_threads(num_threads)
+    if hasattr(DEPLOY_OBJ, "set_num_threads"):
+        DEPLOY_OBJ.set_num_threads(num_threads)
+    logger.info(f"Using {num_threads} intra-op threads")
+
+
+def prepare_worker(cores):
+    """
+    Prepare a worker process forked after init() to serve on `cores`.
+
+    Threads do not survive fork, so the worker sizes its own thread pools, then warms up and starts
+    its micro-batcher.
+    """
+    size_threads(len(cores))
+    profiler = StartupProfiler()
+    with profiler.step("warmup"):
+        warmup(ENV_VAR, profiler)
+    prepare_batcher(ENV_VAR)
+    logger.info(f"Worker startup report - {json.dumps(profiler.report())}")
+
+
 @swallow_all_exceptions(logger)
 def init():
     """
@@ -102,9 +338,10 @@ def init():
 
     You can write the logic here to perform init operations like caching the model in memory
     """
-    global DEPLOY_OBJ
+    global DEPLOY_OBJ, ENV_VAR
 
     env_var = json.loads(os.environ[SaveFileConstants.DeploymentSaveKey])
+    ENV_VAR = env_var
     env_var["model_path"] = os.environ.get("AZUREML_MODEL_DIR", None)
 
     try:
@@ -115,16 +352,46 @@ def init():
             model_path = os.path.join(model_path, parent_dir_name)
         env_var["model_path"] = model_path
         logger.info(f"Model path - {model_path}")
-        # model directory contents
-        for dirpath, _, filenames in os.walk(model_path):
-            for filename in filenames:
-                logger.info(os.path.join(dirpath, filename))
+        profiler = StartupProfiler()
+        if str(env_var.get("log_model_files", True)).lower() == "true":
+            # model directory contents
+            with profiler.step("list_model_files"):
+                for dirpath, _, filenames in os.walk(model_path):
+                    for filename in filenames:
+                        logger.info(os.path.join(dirpath, filename))
         args = argparse.Namespace(**env_var)
         logger.info(args)
-        prepare_request_files_dir()
-        DEPLOY_OBJ = Deployment(args)
+        prepare_codec(env_var)
+        STAGE_METRICS.log_interval_s = float(env_var.get("metrics_log_interval_s", 60))
+        prepare_request_files_dir(env_var)
+        with profiler.step("create_deployment"):
+            DEPLOY_OBJ = create_deployment(args, env_var)
         # initialize tokenizer and model for prediction
-        DEPLOY_OBJ.prepare_prediction_service()
+        with profiler.step("prepare_prediction_service"):
+            DEPLOY_OBJ.prepare_prediction_service()
+        if env_var.get("use_int8", False):
+            if env_var.get("inference_engine", "deployment") != "onnx":
+                with profiler.step("quantize_int8"):
+                    prepare_int8_model()
+            else:
+                logger.warning("use_int8 does not apply to the onnx inference engine, ignoring it")
+        prefork = str(env_var.get("prefork", False)).lower() == "true"
+        num_workers = int(env_var.get("num_workers", 1))
+        if not prefork and num_workers > 1:
+            # the inference server runs num_workers processes sharing the cores of the instance
+            size_threads(max(1, len(available_cores()) // num_workers))
+        prepare_bucketer(env_var)
+        with profiler.step("prepare_cascade"):
+            prepare_cascade(env_var)
+        prepare_prediction_cache(env_var)
+        prepare_coalescer(env_var)
+        if prefork:
+            logger.info("Warm-up and micro-batching are left to the preforked workers")
+        else:
+            with profiler.step("warmup"):
+                warmup(env_var, profiler)
+            prepare_batcher(env_var)
+        logger.info(f"Startup report - {json.dumps(profiler.report())}")
     except Exception as e:
         raise ResourceException._with_error(
             AzureMLError.create(DeploymentFailed, error=e)
@@ -138,15 +405,24 @@ def run(raw_data):
 
     `raw_data` is the raw request body data.
     """
+    request_start = time.perf_counter()
+    files_dir = None
     try:
-        inputs = preprocess_request(raw_data)
+        if request.content_type != "application/json":
+            files_dir = create_request_files_dir(request.content_length)
+        with STAGE_METRICS.time("preprocess"):
+            inputs = preprocess_request(raw_data, files_dir)
         logger.debug(inputs)
-        predictions = DEPLOY_OBJ.predict(inputs)
+        with STAGE_METRICS.time("predict"):
+            predictions = predict(inputs)
     except Exception as e:
         # we should never terminate score script by raising exception in run()
         # as it need to continously serve online requests
         # traceback.print_exc()
         predictions = {"msg": "failed", "error": str(e)}
         logger.error("Exception: \n", exc_info=True)
-    post_process_files_dir()
-    return encode_json(predictions)
+    post_process_files_dir(files_dir)
+    with STAGE_METRICS.time("encode"):
+        response = encode_json(predictions)
+    STAGE_METRICS.record("total", time.perf_counter() - request_start)
+    return response
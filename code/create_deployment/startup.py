@@ -0,0 +1,58 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the startup profiling and warm-up used by score.init."""
+
+import time
+from contextlib import contextmanager
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+logger = get_logger_app()
+
+WARMUP_SENTENCE = "The quick brown fox jumps over the lazy dog."
+
+
+class StartupProfiler:
+    """Time the steps of the container startup and collect them in a structured report."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.steps = {}
+        self.details = {}
+
+    @contextmanager
+    def step(self, name):
+        """Time the enclosed block as step `name`."""
+        step_start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.steps[name] = round(time.monotonic() - step_start, 4)
+            logger.info(f"Startup step {name} took {self.steps[name]}s")
+
+    def report(self):
+        """Return the startup report."""
+        return {
+            "total_s": round(time.monotonic() - self.start, 4),
+            "steps_s": self.steps,
+            **self.details,
+        }
+
+
+def run_warmup(predict_fn, batch_sizes, iterations=1):
+    """
+    Run synthetic predictions for every batch size so kernels and allocations are ready for the first request.
+
+    Returns the latencies in seconds of every iteration per batch size.
+    """
+    latencies = {}
+    for batch_size in batch_sizes:
+        inputs = [WARMUP_SENTENCE] * batch_size
+        latencies[str(batch_size)] = []
+        for _ in range(iterations):
+            start = time.monotonic()
+            predict_fn(inputs)
+            latencies[str(batch_size)].append(round(time.monotonic() - start, 4))
+    return latencies
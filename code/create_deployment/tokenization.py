@@ -0,0 +1,112 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the cached batch tokenizer used by the local inference engines."""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+logger = get_logger_app()
+
+FEATURE_NAMES = ("input_ids", "token_type_ids")
+
+
+class CachedTokenizer:
+    """
+    Tokenize sentence lists in one batched call, keeping the token ids of up to `cache_size` sentences.
+
+    Only the sentences missing from the LRU cache go through the tokenizer, then the token ids are
+    padded into model inputs with numpy. Tokenization time is recorded as the `tokenize` stage of
+    `metrics` and the cache counters are reported with its summary.
+    """
+
+    def __init__(self, tokenizer, max_length=128, cache_size=0, metrics=None):
+        if not getattr(tokenizer, "is_fast", False):
+            logger.warning(f"{type(tokenizer).__name__} is not a fast tokenizer, tokenization runs in python")
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.metrics = metrics
+        self.pad_token_id = tokenizer.pad_token_id or 0
+        self.pad_left = getattr(tokenizer, "padding_side", "right") == "left"
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if metrics is not None and cache_size > 0:
+            metrics.add_gauge("tokenizer_cache", self.stats)
+
+    def tokenize(self, sentences):
+        """Return the unpadded features of every sentence."""
+        encoded = self.tokenizer(
+            sentences, truncation=True, max_length=self.max_length, padding=False, return_attention_mask=False
+        )
+        names = [name for name in FEATURE_NAMES if name in encoded]
+        return [
+            {name: np.asarray(encoded[name][i], dtype=np.int64) for name in names}
+            for i in range(len(sentences))
+        ]
+
+    def pad(self, features):
+        """Pad `features` to the longest sentence, returning int64 arrays with an attention mask."""
+        lengths = [len(feature["input_ids"]) for feature in features]
+        shape = (len(features), max(lengths))
+        batch = {name: np.zeros(shape, dtype=np.int64) for name in features[0]}
+        batch["input_ids"].fill(self.pad_token_id)
+        batch["attention_mask"] = np.zeros(shape, dtype=np.int64)
+        for row, (feature, length) in enumerate(zip(features, lengths)):
+            columns = slice(shape[1] - length, None) if self.pad_left else slice(0, length)
+            for name, values in feature.items():
+                batch[name][row, columns] = values
+            batch["attention_mask"][row, columns] = 1
+        return batch
+
+    def _encode(self, sentences):
+        features = [None] * len(sentences)
+        missing = OrderedDict()
+        with self._lock:
+            for i, sentence in enumerate(sentences):
+                feature = self._entries.get(sentence) if self.cache_size > 0 else None
+                if feature is None:
+                    self.misses += 1
+                    missing.setdefault(sentence, []).append(i)
+                    continue
+                self._entries.move_to_end(sentence)
+                self.hits += 1
+                features[i] = feature
+        if missing:
+            # sentences repeated within the batch are only tokenized once
+            for sentence, feature in zip(missing, self.tokenize(list(missing))):
+                for i in missing[sentence]:
+                    features[i] = feature
+            if self.cache_size > 0:
+                with self._lock:
+                    for sentence in missing:
+                        self._entries[sentence] = features[missing[sentence][0]]
+                        self._entries.move_to_end(sentence)
+                    while len(self._entries) > self.cache_size:
+                        self._entries.popitem(last=False)
+        return self.pad(features)
+
+    def encode(self, sentences):
+        """Return the padded model inputs of `sentences` as int64 numpy arrays."""
+        if self.metrics is None:
+            return self._encode(sentences)
+        with self.metrics.time("tokenize"):
+            return self._encode(sentences)
+
+    def stats(self):
+        """Return the hit/miss counters of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,59 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the PyTorch inference engine used by score."""
+
+import torch
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+from model_loading import find_file_dir, load_model
+from tokenization import CachedTokenizer
+
+logger = get_logger_app()
+
+
+class TorchDeployment:
+    """
+    Serve the fine-tuned model with PyTorch.
+
+    Weights are memory-mapped from `model.safetensors` when the checkpoint was converted, so the
+    container starts without deserializing the checkpoint. Inputs are tokenized by batch with the
+    token ids of `tokenizer_cache_size` sentences cached. `predict` returns the label of every input.
+    """
+
+    def __init__(self, model_path, max_length=128, tokenizer_cache_size=0, metrics=None):
+        self.model_dir = find_file_dir(model_path, "config.json")
+        self.tokenizer_dir = find_file_dir(model_path, "tokenizer_config.json")
+        self.max_length = max_length
+        self.tokenizer_cache_size = tokenizer_cache_size
+        self.metrics = metrics
+        self.tokenizer = None
+        self.encoder = None
+        self.model = None
+        self.id2label = None
+
+    def prepare_prediction_service(self):
+        """Load the tokenizer and the model."""
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_dir, use_fast=True)
+        self.encoder = CachedTokenizer(self.tokenizer, self.max_length, self.tokenizer_cache_size, self.metrics)
+        self.model = load_model(self.model_dir)
+        self.id2label = {int(key): value for key, value in self.model.config.id2label.items()}
+
+    def set_num_threads(self, num_threads):
+        """Size the intra-op thread pool used by the model."""
+        torch.set_num_threads(num_threads)
+
+    def logits(self, inputs):
+        """Tokenize `inputs` and return the logits of the model."""
+        encoded = {name: torch.from_numpy(values) for name, values in self.encoder.encode(inputs).items()}
+        with torch.no_grad():
+            return self.model(**encoded).logits.numpy()
+
+    def predict(self, inputs):
+        """Return the predicted label of every input."""
+        class_ids = self.logits(inputs).argmax(axis=-1)
+        return [self.id2label.get(int(class_id), int(class_id)) for class_id in class_ids]
@@ -0,0 +1,133 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the progressive blue/green traffic shift of online deployments."""
+
+import json
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+from load_generator import LoadGenerator, load_payloads
+from startup import WARMUP_SENTENCE
+
+logger = get_logger_app()
+
+DEPLOYMENT_HEADER = "azureml-model-deployment"
+
+
+def validate_steps(steps):
+    """Check traffic steps are increasing percentages."""
+    steps = [int(step) for step in steps]
+    if not steps or any(not 0 < step <= 100 for step in steps) or steps != sorted(set(steps)):
+        raise ValueError(f"Traffic steps must be increasing percentages in ]0, 100], got {steps}")
+    return steps
+
+
+def rebalance_traffic(traffic, shares):
+    """Give the deployments of `shares` their percentage and the rest to the others, keeping their proportions."""
+    incumbents = {name: value for name, value in traffic.items() if name not in shares and value > 0}
+    split = {name: 0 for name in traffic}
+    split.update(shares)
+    total = sum(incumbents.values())
+    if total:
+        remaining = 100 - sum(shares.values())
+        for name, value in incumbents.items():
+            split[name] = remaining * value // total
+        # rounding leftovers go to the largest incumbent so the shares sum to 100
+        split[max(incumbents, key=incumbents.get)] += remaining - sum(split[name] for name in incumbents)
+    return split
+
+
+def split_traffic(traffic, deployment_name, share):
+    """Give `share` percent to `deployment_name` and the rest to the other deployments, keeping their proportions."""
+    return rebalance_traffic(traffic, {deployment_name: share})
+
+
+def compare_probes(candidate, incumbent, max_p95_ratio=1.2, max_error_rate_increase=0.01):
+    """Return why the `candidate` probe report is worse than the `incumbent` one, empty when it passes."""
+    reasons = []
+    if candidate["requests"] == 0:
+        reasons.append("no probe request completed")
+    if candidate["error_rate"] > incumbent["error_rate"] + max_error_rate_increase:
+        reasons.append(f"error rate {candidate['error_rate']} > {incumbent['error_rate']} + {max_error_rate_increase}")
+    incumbent_p95 = incumbent["latency_ms"]["p95"]
+    candidate_p95 = candidate["latency_ms"]["p95"]
+    if incumbent_p95 and candidate_p95 > incumbent_p95 * max_p95_ratio:
+        reasons.append(f"p95 {candidate_p95}ms > {max_p95_ratio} x {incumbent_p95}ms")
+    return reasons
+
+
+def probe_payloads(request_file=None, batch_size=1):
+    """Return the probe request bodies of `request_file`, or a single sentence request when not set."""
+    if request_file:
+        return load_payloads(request_file, batch_size)
+    return [json.dumps({"inputs": [WARMUP_SENTENCE]}).encode("utf-8")]
+
+
+def make_endpoint_probe(scoring_uri, api_key, payloads, concurrency=4, duration_s=30, timeout_s=90):
+    """Return a probe replaying `payloads` against one deployment of the endpoint, routed by header."""
+    def probe(deployment_name):
+        headers = {"Authorization": f"Bearer {api_key}", DEPLOYMENT_HEADER: deployment_name}
+        generator = LoadGenerator(
+            scoring_uri, headers=headers, concurrency=concurrency, duration_s=duration_s, timeout_s=timeout_s
+        )
+        return generator.run(payloads)
+
+    return probe
+
+
+def set_traffic(ml_client, endpoint, traffic):
+    """Apply `traffic` to `endpoint` and wait for the update."""
+    endpoint.traffic = traffic
+    ml_client.online_endpoints.begin_create_or_update(endpoint).result()
+    logger.info(f"Traffic of {endpoint.name} set to {traffic}")
+
+
+def progressive_traffic_shift(ml_client, endpoint_name, deployment_name, steps, probe_fn,
+                              max_p95_ratio=1.2, max_error_rate_increase=0.01):
+    """
+    Shift the traffic of `endpoint_name` to `deployment_name` in `steps` percentages.
+
+    After every step `probe_fn(deployment)` load tests the new and the incumbent deployment, the one
+    with the most traffic before the shift. When the new deployment is slower at p95 by more than
+    `max_p95_ratio` or fails more often by more than `max_error_rate_increase`, the original traffic
+    is restored. Without an incumbent the new deployment gets all the traffic at once. Returns the
+    report of every step.
+    """
+    steps = validate_steps(steps)
+    endpoint = ml_client.online_endpoints.get(endpoint_name)
+    original = dict(endpoint.traffic or {})
+    original.setdefault(deployment_name, 0)
+    incumbents = {name: value for name, value in original.items() if name != deployment_name and value > 0}
+    report = {"deployment": deployment_name, "original_traffic": original, "steps": [], "rolled_back": False}
+    if not incumbents:
+        # without another deployment to take the rest, a partial share would not sum to 100
+        logger.info(f"No deployment of {endpoint_name} serves traffic, routing all of it to {deployment_name}")
+        set_traffic(ml_client, endpoint, split_traffic(original, deployment_name, 100))
+        report["steps"].append({"traffic": endpoint.traffic})
+        return report
+
+    incumbent = max(incumbents, key=incumbents.get)
+    report["incumbent"] = incumbent
+    for share in steps:
+        traffic = split_traffic(original, deployment_name, share)
+        set_traffic(ml_client, endpoint, traffic)
+        candidate_probe = probe_fn(deployment_name)
+        incumbent_probe = probe_fn(incumbent)
+        reasons = compare_probes(candidate_probe, incumbent_probe, max_p95_ratio, max_error_rate_increase)
+        step = {
+            "traffic": traffic,
+            "candidate": {key: candidate_probe[key] for key in ("requests", "error_rate", "latency_ms")},
+            "incumbent": {key: incumbent_probe[key] for key in ("requests", "error_rate", "latency_ms")},
+            "failed_checks": reasons,
+        }
+        report["steps"].append(step)
+        logger.info(f"Traffic step {share}% - {json.dumps(step)}")
+        if reasons:
+            logger.warning(f"{deployment_name} failed the checks at {share}% of traffic, rolling back: {reasons}")
+            set_traffic(ml_client, endpoint, original)
+            report["rolled_back"] = True
+            report["reason"] = reasons
+            return report
+    return report
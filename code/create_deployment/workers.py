@@ -0,0 +1,111 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+"""File containing the helpers running score in several preforked worker processes."""
+
+import os
+import gc
+import sys
+import signal
+
+from azureml.train.finetune.core.utils.logging_utils import get_logger_app
+
+logger = get_logger_app()
+
+
+def available_cores():
+    """Return the cores the current process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def core_subsets(num_workers, cores=None):
+    """Split `cores` into `num_workers` contiguous subsets, sharing cores when there are more workers than cores."""
+    cores = available_cores() if cores is None else sorted(cores)
+    if num_workers <= len(cores):
+        size, extra = divmod(len(cores), num_workers)
+        subsets, start = [], 0
+        for index in range(num_workers):
+            end = start + size + (1 if index < extra else 0)
+            subsets.append(cores[start:end])
+            start = end
+        return subsets
+    return [[cores[index % len(cores)]] for index in range(num_workers)]
+
+
+def set_num_threads(num_threads):
+    """Size the intra-op thread pools of the current process to `num_threads`."""
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    # only size torch when the engine loaded it, importing it here would cost every other engine
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(num_threads)
+
+
+def pin_to_cores(cores):
+    """Pin the current process to `cores` and size its thread pools to match."""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    set_num_threads(len(cores))
+
+
+def run_workers(num_workers, serve_fn):
+    """
+    Fork `num_workers` processes calling `serve_fn(index, cores)` and restart the ones that exit.
+
+    Everything loaded before the call, the model first, is shared copy-on-write with the workers.
+    The parent only supervises and forwards SIGINT and SIGTERM to the workers.
+    """
+    subsets = core_subsets(num_workers)
+    # move the objects loaded so far out of the collector, so collections in the workers do not
+    # write to their headers and copy the shared pages
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+    workers = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                pin_to_cores(subsets[index])
+                serve_fn(index, subsets[index])
+            except BaseException:
+                logger.error(f"Worker {index} failed: \n", exc_info=True)
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        workers[pid] = index
+        logger.info(f"Started worker {index} (pid {pid}) on cores {subsets[index]}")
+
+    def stop(signum, _):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for index in range(num_workers):
+        spawn(index)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = workers.pop(pid, None)
+        if index is None:
+            continue
+        if stopping:
+            continue
+        logger.warning(f"Worker {index} (pid {pid}) exited with status {status}, restarting it")
+        spawn(index)
@@ -0,0 +1,314 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+Convert the JSONL dataset splits to a columnar cache read through memory maps.
+
+Every split gets a directory holding one file per column:
+
+- text columns, e.g. `sentence`, as concatenated utf-8 bytes plus an int64 offsets file,
+- numeric columns, e.g. `label` and `idx`, as raw int64 or float64 arrays,
+- `idx_sorted.bin` and `idx_rows.bin`, the rows of every `idx` for random access by id,
+- `meta.json` with the schema, the row count and the sha256 of the source file.
+
+The source is streamed in chunks, so converting never holds the dataset in memory, and reading only
+maps the files: loading, shuffling and random access never copy the columns. A cache is rebuilt when
+the content hash of its source changes.
+
+    python dataset_cache.py --data_dir ../../datasets --cache_dir ../../datasets/cache
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import argparse
+
+import numpy as np
+
+CACHE_FORMAT_VERSION = 1
+CHUNK_ROWS = 65536
+HASH_BLOCK_SIZE = 1 << 20
+ID_COLUMN = "idx"
+NUMERIC_DTYPES = {int: "int64", float: "float64", bool: "int64"}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert JSONL dataset splits to a memory-mapped columnar cache")
+    parser.add_argument("--data_dir", type=str, help="Directory of the JSONL splits", required=True)
+    parser.add_argument("--cache_dir", type=str, help="Directory of the columnar caches", required=True)
+    parser.add_argument(
+        "--splits", type=str, nargs="+", help="Splits to convert", default=["train", "validation", "test"]
+    )
+    parser.add_argument("--force", action="store_true", help="Rebuild the caches even when they are up to date")
+    return parser.parse_args()
+
+
+def file_sha256(path):
+    """Hash the content of `path` block by block."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def infer_schema(record):
+    """Return the text and numeric columns of the first record."""
+    schema = {}
+    for name, value in record.items():
+        if isinstance(value, str):
+            schema[name] = "text"
+        elif type(value) in NUMERIC_DTYPES:
+            schema[name] = NUMERIC_DTYPES[type(value)]
+        else:
+            raise ValueError(f"Column {name} of type {type(value).__name__} is not supported")
+    return schema
+
+
+class _ColumnWriter:
+    """Append the values of one column to its files, chunk by chunk."""
+
+    def __init__(self, directory, name, kind):
+        self.kind = kind
+        self.values = []
+        if kind == "text":
+            self.data = open(os.path.join(directory, f"{name}.bin"), "wb")
+            self.offsets = open(os.path.join(directory, f"{name}.offsets.bin"), "wb")
+            self.offsets.write(np.zeros(1, dtype=np.int64).tobytes())
+            self.size = 0
+        else:
+            self.data = open(os.path.join(directory, f"{name}.bin"), "wb")
+            self.offsets = None
+
+    def flush(self):
+        if not self.values:
+            return
+        if self.kind == "text":
+            encoded = [value.encode("utf-8") for value in self.values]
+            ends = self.size + np.cumsum([len(value) for value in encoded], dtype=np.int64)
+            self.data.write(b"".join(encoded))
+            self.offsets.write(ends.tobytes())
+            self.size = int(ends[-1])
+        else:
+            self.data.write(np.asarray(self.values, dtype=self.kind).tobytes())
+        self.values = []
+
+    def close(self):
+        self.flush()
+        self.data.close()
+        if self.offsets is not None:
+            self.offsets.close()
+
+
+def write_index(directory, rows):
+    """Write the rows sorted by `idx`, so a row is found by binary search without loading the column."""
+    ids = np.memmap(os.path.join(directory, f"{ID_COLUMN}.bin"), dtype=np.int64, mode="r", shape=(rows,))
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    if rows > 1 and not np.all(sorted_ids[1:] != sorted_ids[:-1]):
+        raise ValueError(f"Column {ID_COLUMN} holds duplicated values")
+    sorted_ids.tofile(os.path.join(directory, "idx_sorted.bin"))
+    order.astype(np.int64).tofile(os.path.join(directory, "idx_rows.bin"))
+    del ids
+
+
+def convert_split(source_path, split_dir):
+    """Stream `source_path` into a columnar cache at `split_dir`, replacing it atomically."""
+    tmp_dir = f"{split_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    digest = hashlib.sha256()
+    schema = None
+    writers = {}
+    rows = 0
+    with open(source_path, "rb") as f:
+        for line in f:
+            digest.update(line)
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if schema is None:
+                schema = infer_schema(record)
+                writers = {name: _ColumnWriter(tmp_dir, name, kind) for name, kind in schema.items()}
+            if record.keys() != schema.keys():
+                raise ValueError(f"Row {rows} of {source_path} has columns {list(record)}, expected {list(schema)}")
+            for name, value in record.items():
+                writers[name].values.append(value)
+            rows += 1
+            if rows % CHUNK_ROWS == 0:
+                for writer in writers.values():
+                    writer.flush()
+    for writer in writers.values():
+        writer.close()
+    schema = schema or {}
+    if schema.get(ID_COLUMN) == "int64" and rows:
+        write_index(tmp_dir, rows)
+    stat = os.stat(source_path)
+    meta = {
+        "format_version": CACHE_FORMAT_VERSION,
+        "source": os.path.abspath(source_path),
+        "source_sha256": digest.hexdigest(),
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "rows": rows,
+        "schema": schema,
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(split_dir, ignore_errors=True)
+    os.replace(tmp_dir, split_dir)
+    return meta
+
+
+def read_meta(split_dir):
+    try:
+        with open(os.path.join(split_dir, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_up_to_date(source_path, split_dir):
+    """
+    Return True when the cache at `split_dir` was built from the current content of `source_path`.
+
+    The content is only hashed again when the size or modification time of the source changed.
+    """
+    meta = read_meta(split_dir)
+    if meta is None or meta.get("format_version") != CACHE_FORMAT_VERSION:
+        return False
+    stat = os.stat(source_path)
+    if stat.st_size != meta["source_size"]:
+        return False
+    if stat.st_mtime_ns == meta["source_mtime_ns"]:
+        return True
+    if file_sha256(source_path) != meta["source_sha256"]:
+        return False
+    # same content with a new timestamp, skip hashing it next time
+    meta["source_mtime_ns"] = stat.st_mtime_ns
+    with open(os.path.join(split_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return True
+
+
+def build_cache(source_path, split_dir, force=False):
+    """Convert `source_path` unless its cache is up to date and return the cache metadata."""
+    if not force and is_up_to_date(source_path, split_dir):
+        return read_meta(split_dir)
+    return convert_split(source_path, split_dir)
+
+
+class ColumnarDataset:
+    """
+    Read-only view of a split cache whose columns are memory maps.
+
+    Rows are addressed by position, or by their `idx` through `rows_for_idx`. Shuffling permutes
+    row positions only.
+    """
+
+    def __init__(self, split_dir):
+        self.split_dir = split_dir
+        self.meta = read_meta(split_dir)
+        if self.meta is None:
+            raise FileNotFoundError(f"No dataset cache at {split_dir}")
+        self.rows = self.meta["rows"]
+        self.schema = self.meta["schema"]
+        self.columns = {}
+        self.offsets = {}
+        for name, kind in self.schema.items():
+            if kind == "text":
+                self.offsets[name] = self._map(f"{name}.offsets.bin", np.int64, self.rows + 1)
+                self.columns[name] = self._map(f"{name}.bin", np.uint8, int(self.offsets[name][-1]))
+            else:
+                self.columns[name] = self._map(f"{name}.bin", np.dtype(kind), self.rows)
+        self.idx_sorted = None
+        self.idx_rows = None
+        if os.path.exists(os.path.join(split_dir, "idx_sorted.bin")):
+            self.idx_sorted = self._map("idx_sorted.bin", np.int64, self.rows)
+            self.idx_rows = self._map("idx_rows.bin", np.int64, self.rows)
+
+    def _map(self, file_name, dtype, length):
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(self.split_dir, file_name), dtype=dtype, mode="r", shape=(length,))
+
+    def __len__(self):
+        return self.rows
+
+    def column(self, name):
+        """Return the memory map of a numeric column."""
+        if self.schema[name] == "text":
+            raise TypeError(f"Column {name} holds text, read it with text()")
+        return self.columns[name]
+
+    def text(self, name, row):
+        """Decode the value of the text column `name` at `row`."""
+        offsets = self.offsets[name]
+        return bytes(self.columns[name][offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+    def __getitem__(self, row):
+        if not -self.rows <= row < self.rows:
+            raise IndexError(f"Row {row} out of range for {self.rows} rows")
+        row %= self.rows
+        return {
+            name: self.text(name, row) if kind == "text" else self.columns[name][row].item()
+            for name, kind in self.schema.items()
+        }
+
+    def rows_for_idx(self, ids):
+        """Return the row of every value of `ids`, raising KeyError for unknown ones."""
+        if self.idx_sorted is None:
+            raise KeyError(f"The cache has no {ID_COLUMN} index")
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.searchsorted(self.idx_sorted, ids)
+        positions = np.minimum(positions, max(self.rows - 1, 0))
+        found = self.idx_sorted[positions] == ids if self.rows else np.zeros(ids.shape, dtype=bool)
+        if not np.all(found):
+            raise KeyError(f"Unknown {ID_COLUMN} values {ids[~found][:10].tolist()}")
+        return self.idx_rows[positions]
+
+    def get_by_idx(self, idx):
+        return self[int(self.rows_for_idx([idx])[0])]
+
+    def shuffled_rows(self, seed=0):
+        """Return a random permutation of the row positions."""
+        return np.random.default_rng(seed).permutation(self.rows)
+
+    def iter_batches(self, batch_size, rows=None):
+        """Yield the records of `rows`, every row by default, in lists of `batch_size`."""
+        rows = range(self.rows) if rows is None else rows
+        batch = []
+        for row in rows:
+            batch.append(self[int(row)])
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def load_split(data_dir, cache_dir, split, force=False):
+    """Build the cache of `split` when needed and return it as a `ColumnarDataset`."""
+    split_dir = os.path.join(cache_dir, split)
+    build_cache(os.path.join(data_dir, f"{split}.jsonl"), split_dir, force)
+    return ColumnarDataset(split_dir)
+
+
+def main():
+    args = parse_args()
+    print(args)
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    for split in args.splits:
+        source_path = os.path.join(args.data_dir, f"{split}.jsonl")
+        split_dir = os.path.join(args.cache_dir, split)
+        if not args.force and is_up_to_date(source_path, split_dir):
+            print(f"{split}: cache up to date")
+            continue
+        meta = convert_split(source_path, split_dir)
+        print(f"{split}: cached {meta['rows']} rows with columns {meta['schema']} to {split_dir}")
+
+
+if __name__ == "__main__":
+    main()
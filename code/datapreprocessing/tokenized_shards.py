@@ -0,0 +1,266 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+Tokenize the dataset splits once into length-sorted binary shards reused across runs.
+
+The splits are read from the columnar cache of dataset_cache.py and tokenized by a process pool,
+one shard of `shard_rows` rows per task. Every shard is a directory of `.npy` arrays loaded with
+memory maps:
+
+- `input_ids`, the token ids of all rows concatenated as int32, and `offsets`, their int64 bounds,
+- `lengths`, the token count of every row, the rows of a shard being sorted by it,
+- `rows` and the numeric columns of the split, e.g. `label` and `idx`, in the same order.
+
+Shards are written under `<output_dir>/<split>/<key>`, the key hashing the tokenizer identity, the
+maximum length and the content hash of the split. A run finding the key already built reuses it, so
+the data is only tokenized again when the tokenizer or the data changed.
+
+    python tokenized_shards.py --data_dir ../../datasets --cache_dir ../../datasets/cache \
+        --tokenizer bert-base-uncased --output_dir ../../datasets/tokenized
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dataset_cache import ColumnarDataset, build_cache
+
+SHARD_FORMAT_VERSION = 1
+TOKENIZE_BATCH_SIZE = 1024
+
+_TOKENIZER = None
+_MAX_LENGTH = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tokenize JSONL dataset splits into length-sorted binary shards")
+    parser.add_argument("--data_dir", type=str, help="Directory of the JSONL splits", required=True)
+    parser.add_argument("--cache_dir", type=str, help="Directory of the columnar caches", required=True)
+    parser.add_argument("--output_dir", type=str, help="Directory of the tokenized shards", required=True)
+    parser.add_argument("--tokenizer", type=str, help="Tokenizer name or model directory", required=True)
+    parser.add_argument(
+        "--splits", type=str, nargs="+", help="Splits to tokenize", default=["train", "validation", "test"]
+    )
+    parser.add_argument("--text_column", type=str, help="Column holding the text", default="sentence")
+    parser.add_argument("--max_length", type=int, help="Maximum number of tokens per row", default=128)
+    parser.add_argument("--shard_rows", type=int, help="Number of rows per shard", default=100000)
+    parser.add_argument("--num_workers", type=int, help="Number of tokenizer processes", default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="Tokenize again even when the shards exist")
+    return parser.parse_args()
+
+
+def load_tokenizer(name):
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(name, use_fast=True)
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Hash what the token ids depend on: the tokenizer class, its vocabulary and normalization rules."""
+    digest = hashlib.sha256(type(tokenizer).__name__.encode("utf-8"))
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        digest.update(backend.to_str().encode("utf-8"))
+    else:
+        digest.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode("utf-8"))
+        digest.update(json.dumps(tokenizer.init_kwargs, sort_keys=True, default=str).encode("utf-8"))
+    digest.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def shard_key(tokenizer_hash, data_hash, text_column, max_length, shard_rows):
+    settings = [SHARD_FORMAT_VERSION, tokenizer_hash, data_hash, text_column, max_length, shard_rows]
+    return hashlib.sha256(json.dumps(settings).encode("utf-8")).hexdigest()[:16]
+
+
+def _init_worker(tokenizer_name, max_length):
+    global _TOKENIZER, _MAX_LENGTH
+    _TOKENIZER = load_tokenizer(tokenizer_name)
+    _MAX_LENGTH = max_length
+
+
+def tokenize_shard(split_dir, start, stop, text_column, shard_dir):
+    """Tokenize rows `start` to `stop` of the cached split and write them as a length-sorted shard."""
+    dataset = ColumnarDataset(split_dir)
+    ids = []
+    for begin in range(start, stop, TOKENIZE_BATCH_SIZE):
+        texts = [dataset.text(text_column, row) for row in range(begin, min(begin + TOKENIZE_BATCH_SIZE, stop))]
+        encoded = _TOKENIZER(
+            texts, truncation=True, max_length=_MAX_LENGTH, padding=False,
+            return_attention_mask=False, return_token_type_ids=False,
+        )
+        ids.extend(encoded["input_ids"])
+    lengths = np.fromiter((len(row_ids) for row_ids in ids), dtype=np.int32, count=len(ids))
+    order = np.argsort(lengths, kind="stable")
+    lengths = lengths[order]
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    input_ids = np.empty(int(offsets[-1]), dtype=np.int32)
+    for position, row in enumerate(order):
+        input_ids[offsets[position]:offsets[position + 1]] = ids[row]
+
+    os.makedirs(shard_dir)
+    np.save(os.path.join(shard_dir, "input_ids.npy"), input_ids)
+    np.save(os.path.join(shard_dir, "offsets.npy"), offsets)
+    np.save(os.path.join(shard_dir, "lengths.npy"), lengths)
+    np.save(os.path.join(shard_dir, "rows.npy"), order.astype(np.int64) + start)
+    for name, kind in dataset.schema.items():
+        if kind != "text":
+            np.save(os.path.join(shard_dir, f"{name}.npy"), np.asarray(dataset.column(name)[start:stop])[order])
+    return {
+        "name": os.path.basename(shard_dir),
+        "rows": stop - start,
+        "tokens": int(offsets[-1]),
+        "min_length": int(lengths[0]) if len(lengths) else 0,
+        "max_length": int(lengths[-1]) if len(lengths) else 0,
+        "truncated": int(np.count_nonzero(lengths >= _MAX_LENGTH)),
+    }
+
+
+def build_shards(data_dir, cache_dir, output_dir, split, tokenizer_name, text_column="sentence",
+                 max_length=128, shard_rows=100000, num_workers=None, force=False):
+    """Tokenize `split` into shards unless shards with the same key exist, and return their directory."""
+    meta = build_cache(os.path.join(data_dir, f"{split}.jsonl"), os.path.join(cache_dir, split))
+    tokenizer = load_tokenizer(tokenizer_name)
+    tokenizer_hash = tokenizer_fingerprint(tokenizer)
+    key = shard_key(tokenizer_hash, meta["source_sha256"], text_column, max_length, shard_rows)
+    shards_dir = os.path.join(output_dir, split, key)
+    if not force and os.path.exists(os.path.join(shards_dir, "manifest.json")):
+        print(f"{split}: reusing the shards of key {key}")
+        return shards_dir
+
+    tmp_dir = f"{shards_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    start_time = time.perf_counter()
+    split_dir = os.path.join(cache_dir, split)
+    bounds = [(start, min(start + shard_rows, meta["rows"])) for start in range(0, meta["rows"], shard_rows)]
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(num_workers or 1, len(bounds) or 1)),
+        initializer=_init_worker,
+        initargs=(tokenizer_name, max_length),
+    ) as pool:
+        futures = [
+            pool.submit(tokenize_shard, split_dir, start, stop, text_column, os.path.join(tmp_dir, f"shard_{i:05d}"))
+            for i, (start, stop) in enumerate(bounds)
+        ]
+        shards = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start_time
+
+    manifest = {
+        "format_version": SHARD_FORMAT_VERSION,
+        "key": key,
+        "split": split,
+        "tokenizer": tokenizer_name,
+        "tokenizer_sha256": tokenizer_hash,
+        "source_sha256": meta["source_sha256"],
+        "text_column": text_column,
+        "max_length": max_length,
+        "shard_rows": shard_rows,
+        "pad_token_id": tokenizer.pad_token_id or 0,
+        "padding_side": getattr(tokenizer, "padding_side", "right"),
+        "columns": [name for name, kind in meta["schema"].items() if kind != "text"],
+        "rows": meta["rows"],
+        "tokens": sum(shard["tokens"] for shard in shards),
+        "shards": shards,
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(shards_dir, ignore_errors=True)
+    os.replace(tmp_dir, shards_dir)
+    print(f"{split}: tokenized {meta['rows']} rows into {len(shards)} shards in {elapsed:.1f}s, key {key}")
+    return shards_dir
+
+
+class TokenizedShards:
+    """Read the shards written by `build_shards` through memory maps and batch them with little padding."""
+
+    def __init__(self, shards_dir):
+        self.shards_dir = shards_dir
+        with open(os.path.join(shards_dir, "manifest.json")) as f:
+            self.manifest = json.load(f)
+
+    def __len__(self):
+        return self.manifest["rows"]
+
+    def shard(self, i):
+        """Return the arrays of shard `i` as memory maps."""
+        shard_dir = os.path.join(self.shards_dir, self.manifest["shards"][i]["name"])
+        names = ["input_ids", "offsets", "lengths", "rows"] + self.manifest["columns"]
+        return {name: np.load(os.path.join(shard_dir, f"{name}.npy"), mmap_mode="r") for name in names}
+
+    def lengths(self):
+        """Return the token count of every row, indexed by row of the split."""
+        lengths = np.zeros(len(self), dtype=np.int32)
+        for i in range(len(self.manifest["shards"])):
+            shard = self.shard(i)
+            lengths[shard["rows"]] = shard["lengths"]
+        return lengths
+
+    def pad(self, shard, positions):
+        """Pad the rows at `positions` of `shard` into model inputs, plus the numeric columns and rows."""
+        lengths = shard["lengths"][positions]
+        width = int(lengths.max()) if len(lengths) else 0
+        batch = {
+            "input_ids": np.full((len(positions), width), self.manifest["pad_token_id"], dtype=np.int64),
+            "attention_mask": np.zeros((len(positions), width), dtype=np.int64),
+        }
+        pad_left = self.manifest["padding_side"] == "left"
+        for i, (position, length) in enumerate(zip(positions, lengths)):
+            columns = slice(width - length, None) if pad_left else slice(0, length)
+            batch["input_ids"][i, columns] = shard["input_ids"][shard["offsets"][position]:shard["offsets"][position + 1]]
+            batch["attention_mask"][i, columns] = 1
+        batch["token_type_ids"] = np.zeros_like(batch["input_ids"])
+        for name in ["rows"] + self.manifest["columns"]:
+            batch[name] = np.asarray(shard[name][positions])
+        return batch
+
+    def iter_batches(self, batch_size, seed=None):
+        """
+        Yield padded batches of rows of similar length.
+
+        Batches are consecutive rows of a shard, so they are only padded to the longest of close
+        lengths. With a `seed` the order of the shards and of the batches within a shard is shuffled.
+        """
+        rng = np.random.default_rng(seed) if seed is not None else None
+        order = np.arange(len(self.manifest["shards"]))
+        if rng is not None:
+            rng.shuffle(order)
+        for i in order:
+            shard = self.shard(int(i))
+            starts = np.arange(0, len(shard["lengths"]), batch_size)
+            if rng is not None:
+                rng.shuffle(starts)
+            for start in starts:
+                yield self.pad(shard, np.arange(start, min(start + batch_size, len(shard["lengths"]))))
+
+
+def main():
+    args = parse_args()
+    print(args)
+
+    for split in args.splits:
+        shards_dir = build_shards(
+            args.data_dir,
+            args.cache_dir,
+            args.output_dir,
+            split,
+            args.tokenizer,
+            text_column=args.text_column,
+            max_length=args.max_length,
+            shard_rows=args.shard_rows,
+            num_workers=args.num_workers,
+            force=args.force,
+        )
+        print(f"{split}: {shards_dir}")
+
+
+if __name__ == "__main__":
+    main()
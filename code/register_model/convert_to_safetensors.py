@@ -0,0 +1,98 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+Convert the checkpoint of a registered model to safetensors so the scoring engines can memory-map it.
+
+The original `pytorch_model.bin` is kept next to `model.safetensors`, so deployments using the
+azureml `Deployment` keep working with the converted model.
+"""
+
+import os
+import argparse
+
+import torch
+from safetensors.torch import save_file
+
+from azure.ai.ml import MLClient
+from azure.ai.ml.constants import AssetTypes
+from azure.ai.ml.entities import Model
+from azure.identity import DefaultAzureCredential
+
+CHECKPOINT_NAME = "pytorch_model.bin"
+SAFETENSORS_WEIGHTS_NAME = "model.safetensors"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert a model checkpoint to safetensors")
+    parser.add_argument("--model_dir", type=str, help="Local model directory to convert in place", default=None)
+    parser.add_argument("--model_name", type=str, help="Name of the registered model to convert", default=None)
+    parser.add_argument("--model_version", type=str, help="Version of the registered model to convert", default=None)
+    parser.add_argument("--download_path", type=str, help="Where to download the registered model", default="converted_model")
+    parser.add_argument(
+        "--register",
+        type=str,
+        default="false",
+        help="If set to true, registers the converted model as a new version of --model_name",
+    )
+    return parser.parse_args()
+
+
+def convert_checkpoint(checkpoint_path):
+    """Write the weights of `checkpoint_path` to `model.safetensors` in the same directory."""
+    state_dict = torch.load(checkpoint_path, map_location="cpu")
+    # safetensors refuses tensors sharing memory, e.g. tied embeddings
+    seen = set()
+    tensors = {}
+    for name, tensor in state_dict.items():
+        tensor = tensor.contiguous()
+        pointer = tensor.data_ptr()
+        tensors[name] = tensor.clone() if pointer in seen else tensor
+        seen.add(pointer)
+    output_path = os.path.join(os.path.dirname(checkpoint_path), SAFETENSORS_WEIGHTS_NAME)
+    save_file(tensors, output_path, metadata={"format": "pt"})
+    print(f"Converted {checkpoint_path} to {output_path}")
+    return output_path
+
+
+def convert_model_dir(model_dir):
+    """Convert every checkpoint found under `model_dir`."""
+    converted = []
+    for dirpath, _, filenames in os.walk(model_dir):
+        if CHECKPOINT_NAME in filenames and SAFETENSORS_WEIGHTS_NAME not in filenames:
+            converted.append(convert_checkpoint(os.path.join(dirpath, CHECKPOINT_NAME)))
+    if not converted:
+        print(f"No {CHECKPOINT_NAME} left to convert under {model_dir}")
+    return converted
+
+
+def main():
+    args = parse_args()
+    print(args)
+
+    if args.model_dir is not None:
+        convert_model_dir(args.model_dir)
+        return
+
+    if args.model_name is None:
+        raise ValueError("Either --model_dir or --model_name is required")
+    ml_client = MLClient.from_config(DefaultAzureCredential(), path='config.json')
+    model = ml_client.models.get(name=args.model_name, version=args.model_version, label=None if args.model_version else "latest")
+    ml_client.models.download(name=model.name, version=model.version, download_path=args.download_path)
+    model_dir = os.path.join(args.download_path, model.name)
+    convert_model_dir(model_dir)
+
+    if args.register.lower() == "true":
+        converted = Model(
+            name=model.name,
+            path=model_dir,
+            type=model.type or AssetTypes.MLFLOW_MODEL,
+            description=f"{model.description or ''} Converted to safetensors from version {model.version}.".strip(),
+            tags={**(model.tags or {}), "weights_format": "safetensors", "converted_from": str(model.version)},
+        )
+        registered = ml_client.models.create_or_update(converted)
+        print(f"Registered {registered.name}:{registered.version}")
+
+
+if __name__ == "__main__":
+    main()
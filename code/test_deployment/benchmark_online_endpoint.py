@@ -0,0 +1,100 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import os
+import sys
+import json
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create_deployment"))
+
+from load_generator import LoadGenerator, load_payloads  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark online endpoint")
+    parser.add_argument(
+        "--endpoint_url",
+        type=str,
+        help="Scoring URL, e.g. a managed endpoint or local_score_server.py",
+        default=None,
+    )
+    parser.add_argument("--api_key", type=str, help="Endpoint key sent as bearer token", default=None)
+    parser.add_argument(
+        "--endpoint_name",
+        type=str,
+        help="Name of the online endpoint, used to look up the URL and key when --endpoint_url is not set",
+        default=None,
+    )
+    parser.add_argument("--deployment_name", type=str, help="Route all requests to this deployment", default=None)
+    parser.add_argument(
+        "--request_file",
+        type=str,
+        help="JSONL file of endpoint requests or dataset sentences",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "datasets", "test.jsonl"),
+    )
+    parser.add_argument("--batch_size", type=int, help="Sentences per request when replaying a dataset", default=1)
+    parser.add_argument("--concurrency", type=int, help="Number of concurrent clients", default=4)
+    parser.add_argument("--target_rps", type=float, help="Target requests per second, unbounded if not set", default=None)
+    parser.add_argument("--duration_s", type=float, help="Duration of the benchmark in seconds", default=30)
+    parser.add_argument("--timeout_s", type=float, help="Client side request timeout in seconds", default=90)
+    parser.add_argument("--output_json", type=str, help="Path to save the benchmark results", default=None)
+    return parser.parse_args()
+
+
+def get_endpoint(endpoint_name):
+    """Look up the scoring URL and key of an online endpoint with the workspace config.json."""
+    from azure.identity import DefaultAzureCredential
+    from azure.ai.ml import MLClient
+
+    ml_client = MLClient.from_config(DefaultAzureCredential(), path='config.json')
+    endpoint = ml_client.online_endpoints.get(endpoint_name)
+    keys = ml_client.online_endpoints.get_keys(endpoint_name)
+    return endpoint.scoring_uri, keys.primary_key
+
+
+def main():
+    args = parse_args()
+    print(args)
+
+    if args.endpoint_url is None:
+        if args.endpoint_name is None:
+            raise ValueError("Either --endpoint_url or --endpoint_name is required")
+        args.endpoint_url, args.api_key = get_endpoint(args.endpoint_name)
+
+    headers = {}
+    if args.api_key:
+        headers["Authorization"] = f"Bearer {args.api_key}"
+    if args.deployment_name:
+        headers["azureml-model-deployment"] = args.deployment_name
+
+    payloads = load_payloads(args.request_file, args.batch_size)
+    print(f"Replaying {len(payloads)} requests against {args.endpoint_url}")
+    generator = LoadGenerator(
+        args.endpoint_url,
+        headers=headers,
+        concurrency=args.concurrency,
+        target_rps=args.target_rps,
+        duration_s=args.duration_s,
+        timeout_s=args.timeout_s,
+    )
+    summary = generator.run(payloads)
+    print(json.dumps(summary, indent=2))
+
+    if args.output_json:
+        results = {
+            "endpoint_url": args.endpoint_url,
+            "deployment_name": args.deployment_name,
+            "request_file": args.request_file,
+            "batch_size": args.batch_size,
+            "concurrency": args.concurrency,
+            "target_rps": args.target_rps,
+            "summary": summary,
+        }
+        with open(args.output_json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output_json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+Run rollout.py against the fake MLClient and check the rollout ran its deployments concurrently.
+
+Every operation takes `--operation_delay_s`, so a serial rollout of the specs would take the sum of
+their operations while the concurrent one should take about three operations: endpoint, deployment
+and routing.
+"""
+
+import os
+import sys
+import json
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create_deployment"))
+
+from azure.ai.ml.entities import ManagedOnlineEndpoint  # noqa: E402
+
+from rollout import load_specs, run_rollout  # noqa: E402
+from fake_ml_client import FakeMLClient  # noqa: E402
+
+DEFAULT_SPECS = [
+    {"kind": "online", "endpoint_name": "cpu-online", "deployment_name": "blue", "model": "azureml:model:1",
+     "instance_type": "Standard_F8s_v2", "instance_count": 1, "traffic": 50},
+    {"kind": "online", "endpoint_name": "cpu-online", "deployment_name": "green", "model": "azureml:model:2",
+     "instance_type": "Standard_F8s_v2", "instance_count": 1, "traffic": 50},
+    {"kind": "online", "endpoint_name": "gpu-online", "deployment_name": "gpu-test", "model": "azureml:model:2",
+     "instance_type": "Standard_NC6s_v3", "instance_count": 1, "traffic": 100},
+    {"kind": "batch", "endpoint_name": "cpu-batch", "deployment_name": "cpu-test", "model": "azureml:model:2",
+     "compute": "sample-score-cluster-cpu"},
+    {"kind": "batch", "endpoint_name": "gpu-batch", "deployment_name": "gpu-test", "model": "azureml:model:2",
+     "compute": "sample-score-cluster-gpu"},
+]
+
+
+def live_endpoint_rollout(shares, operation_delay_s):
+    """Roll out `shares` onto an endpoint serving all its traffic from `blue`, return the report and final traffic."""
+    ml_client = FakeMLClient(default_delay_s=operation_delay_s)
+    ml_client.online_endpoints.entities["live"] = ManagedOnlineEndpoint(name="live", traffic={"blue": 100})
+    specs = [
+        {"kind": "online", "endpoint_name": "live", "deployment_name": name, "model": "azureml:model:2",
+         "instance_type": "Standard_F8s_v2", "instance_count": 1, "traffic": share}
+        for name, share in shares.items()
+    ]
+    report = run_rollout(ml_client, specs, poll_interval_s=0.05, progress_interval_s=operation_delay_s)
+    return report, ml_client.online_endpoints.get("live").traffic
+
+
+def check_live_endpoint(operation_delay_s):
+    """Check the deployments already serving an endpoint are scaled down to the traffic left by the new ones."""
+    expected = [
+        ({"green": 100}, {"blue": 0, "green": 100}),
+        ({"green": 20}, {"blue": 80, "green": 20}),
+        ({"green": 20, "red": 30}, {"blue": 50, "green": 20, "red": 30}),
+    ]
+    for shares, traffic in expected:
+        report, actual = live_endpoint_rollout(shares, operation_delay_s)
+        assert report["succeeded"] and actual == traffic, f"{shares} on blue 100 gave {actual}, expected {traffic}"
+        print(f"{shares} on an endpoint at blue 100 -> {actual}")
+    report, actual = live_endpoint_rollout({"green": 60, "red": 60}, operation_delay_s)
+    assert not report["succeeded"] and actual == {"blue": 100}, f"shares over 100 were applied: {actual}"
+    print(f"{{'green': 60, 'red': 60}} rejected: {report['steps']['online routing live']['error']}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Dry run of the deployment rollout against a fake MLClient")
+    parser.add_argument("--spec_file", type=str, help="JSON or YAML list of deployment specs, built-in if not set")
+    parser.add_argument("--operation_delay_s", type=float, help="Duration of every fake operation", default=1.0)
+    parser.add_argument(
+        "--fail",
+        type=str,
+        nargs="*",
+        default=[],
+        help="endpoint or endpoint/deployment names whose operation fails",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print(args)
+
+    specs = load_specs(args.spec_file) if args.spec_file else DEFAULT_SPECS
+    ml_client = FakeMLClient(
+        default_delay_s=args.operation_delay_s,
+        failures={name: RuntimeError(f"{name} failed") for name in args.fail},
+    )
+    report = run_rollout(ml_client, specs, poll_interval_s=0.05, progress_interval_s=args.operation_delay_s)
+    print(json.dumps(report, indent=2))
+
+    # operations on the same endpoint kind and name are counted once
+    operations = 2 * len({(spec["kind"], spec["endpoint_name"]) for spec in specs}) + len(specs)
+    print(
+        f"{operations} operations of {args.operation_delay_s}s done in {report['duration_s']}s, "
+        f"at most {ml_client.max_in_flight} in flight"
+    )
+    if args.fail:
+        failed = [name for name, step in report["steps"].items() if step["status"] != "succeeded"]
+        assert not report["succeeded"] and failed, "the failures were not reported"
+        print(f"Not rolled out: {failed}")
+        return
+    assert report["succeeded"], "the rollout failed"
+    assert report["duration_s"] < 4 * args.operation_delay_s, "the deployments were not rolled out concurrently"
+    for spec in specs:
+        if spec["kind"] == "online" and "traffic" in spec:
+            traffic = ml_client.online_endpoints.get(spec["endpoint_name"]).traffic
+            assert traffic[spec["deployment_name"]] == spec["traffic"], f"wrong traffic {traffic}"
+    if not args.spec_file:
+        check_live_endpoint(args.operation_delay_s / 10)
+    print("Rollout dry run passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+In-memory stand-in for `MLClient` to exercise the deployment scripts without a workspace.
+
+Long running operations return pollers finishing after a configurable delay, and the client records
+every call and the peak number of operations in flight.
+"""
+
+import time
+import threading
+
+
+class ResourceNotFoundError(Exception):
+    pass
+
+
+class FakePoller:
+    """Poller of an operation finishing `duration_s` after it started, failing with `error` when set."""
+
+    def __init__(self, client, result, duration_s, error=None):
+        self.client = client
+        self._result = result
+        self.error = error
+        self.deadline = time.monotonic() + duration_s
+        self.finished = False
+
+    def done(self):
+        if not self.finished and time.monotonic() >= self.deadline:
+            self.finished = True
+            self.client.operation_finished()
+        return self.finished
+
+    def status(self):
+        if not self.done():
+            return "InProgress"
+        return "Failed" if self.error else "Succeeded"
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.done() and (deadline is None or time.monotonic() < deadline):
+            time.sleep(0.01)
+
+    def result(self, timeout=None):
+        self.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self._result
+
+
+class FakeOperations:
+    """Operations of one entity kind, e.g. `online_deployments`."""
+
+    def __init__(self, client, kind):
+        self.client = client
+        self.kind = kind
+        self.entities = {}
+
+    @staticmethod
+    def key(entity):
+        endpoint_name = getattr(entity, "endpoint_name", None)
+        return f"{endpoint_name}/{entity.name}" if endpoint_name else entity.name
+
+    def get(self, name, endpoint_name=None, **kwargs):
+        self.client.record(self.kind, "get", name)
+        key = f"{endpoint_name}/{name}" if endpoint_name else name
+        if key not in self.entities:
+            raise ResourceNotFoundError(f"{self.kind} {key} not found")
+        return self.entities[key]
+
+    def list(self, *args, **kwargs):
+        self.client.record(self.kind, "list", None)
+        return list(self.entities.values())
+
+    def get_logs(self, name, endpoint_name, lines, container_type=None, **kwargs):
+        """Return the last `lines` lines of the logs of `endpoint_name/name`, see `FakeMLClient.logs`."""
+        self.client.record(self.kind, "get_logs", f"{endpoint_name}/{name}")
+        logs = self.client.logs.get(f"{endpoint_name}/{name}", [])
+        if callable(logs):
+            logs = logs()
+        return "\n".join(logs[-lines:])
+
+    def begin_create_or_update(self, entity, **kwargs):
+        key = self.key(entity)
+        self.client.record(self.kind, "begin_create_or_update", key)
+        error = self.client.failures.get(key)
+        if error is None:
+            self.entities[key] = entity
+        return self.client.start_operation(entity, self.client.delays.get(key, self.client.default_delay_s), error)
+
+
+class FakeItemPaged:
+    """Paged listing fetching its pages lazily, like `ItemPaged`."""
+
+    def __init__(self, client, items, page_size):
+        self.client = client
+        self.items = items
+        self.page_size = page_size
+
+    def by_page(self):
+        for start in range(0, len(self.items), self.page_size):
+            self.client.record("models", "list_page", start // self.page_size)
+            yield iter(self.items[start:start + self.page_size])
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+
+class FakeModelOperations:
+    """Registered model versions, listed by pages of `page_size` in the order they were added."""
+
+    def __init__(self, client, page_size=50, supports_labels=True):
+        self.client = client
+        self.page_size = page_size
+        self.supports_labels = supports_labels
+        self.versions = {}
+
+    def add(self, model):
+        self.versions.setdefault(model.name, {})[str(model.version)] = model
+
+    def get(self, name, version=None, label=None):
+        self.client.record("models", "get", f"{name}:{version or label}")
+        versions = self.versions.get(name, {})
+        if label is not None:
+            if not self.supports_labels or label != "latest":
+                raise ResourceNotFoundError(f"Label {label} of model {name} not found")
+            version = max(versions, key=int, default=None)
+        if version is None or str(version) not in versions:
+            raise ResourceNotFoundError(f"Model {name}:{version} not found")
+        return versions[str(version)]
+
+    def list(self, name=None, **kwargs):
+        self.client.record("models", "list", name)
+        return FakeItemPaged(self.client, list(self.versions.get(name, {}).values()), self.page_size)
+
+
+class FakeMLClient:
+    """
+    Fake `MLClient` with online and batch endpoint and deployment operations.
+
+    `delays` maps `endpoint` or `endpoint/deployment` names to the duration of their operations and
+    `failures` maps them to the exception their operation fails with. `logs` maps `endpoint/deployment`
+    names to their log lines, or to a function returning the lines logged so far.
+    """
+
+    def __init__(self, default_delay_s=0.5, delays=None, failures=None, logs=None):
+        self.default_delay_s = default_delay_s
+        self.delays = delays or {}
+        self.failures = failures or {}
+        self.logs = logs or {}
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.online_endpoints = FakeOperations(self, "online_endpoints")
+        self.online_deployments = FakeOperations(self, "online_deployments")
+        self.batch_endpoints = FakeOperations(self, "batch_endpoints")
+        self.batch_deployments = FakeOperations(self, "batch_deployments")
+        self.models = FakeModelOperations(self)
+
+    def count_calls(self, kind, method):
+        return sum(1 for _, call_kind, call_method, _ in self.calls if (call_kind, call_method) == (kind, method))
+
+    def record(self, kind, method, name):
+        with self._lock:
+            self.calls.append((time.monotonic(), kind, method, name))
+
+    def start_operation(self, result, duration_s, error=None):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return FakePoller(self, result, duration_s, error)
+
+    def operation_finished(self):
+        with self._lock:
+            self.in_flight -= 1
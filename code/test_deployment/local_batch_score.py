@@ -0,0 +1,237 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+Local batch scoring driver built on score.init/run, the local counterpart of create_batch_deployment.py.
+
+The input JSONL file is streamed in chunks of `mini_batch_size` lines which are scored by a pool of
+`max_concurrency` workers; memory stays bounded by the number of chunks in flight. Prediction rows are
+appended to the output CSV in input order, and a checkpoint written after every chunk lets an
+interrupted run resume where it stopped.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from flask import Flask
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create_deployment"))
+
+import score  # noqa: E402
+from batching import split_predictions  # noqa: E402
+from load_generator import percentile  # noqa: E402
+from local_score_server import StubDeployment, prepare_environment  # noqa: E402
+
+OUTPUT_COLUMNS = ["row", "idx", "sentence", "prediction"]
+
+_APP = Flask(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Score a JSONL file locally with score.py")
+    parser.add_argument("--input_file", type=str, help="JSONL file with a sentence column", required=True)
+    parser.add_argument("--output_file", type=str, help="Output file name", default="predictions.csv")
+    parser.add_argument(
+        "--checkpoint_file",
+        type=str,
+        help="Checkpoint used to resume an interrupted run, defaults to <output_file>.checkpoint.json",
+        default=None,
+    )
+    parser.add_argument("--mini_batch_size", type=int, help="The number of examples to score per job", default=32)
+    parser.add_argument("--max_concurrency", type=int, help="Maximum number of concurrent jobs", default=4)
+    parser.add_argument(
+        "--executor",
+        type=str,
+        choices=["thread", "process"],
+        help="Score chunks on threads sharing one model or on processes loading one model each",
+        default="thread",
+    )
+    parser.add_argument("--model_dir", type=str, help="Local model directory, used as AZUREML_MODEL_DIR", default="model")
+    parser.add_argument(
+        "--env_json",
+        type=str,
+        help="Path of a JSON file with the deployment environment variables built by deploy.py",
+        default=None,
+    )
+    parser.add_argument("--stub_model", action="store_true", help="Score with a stub Deployment instead of a real model")
+    parser.add_argument("--stub_latency_ms", type=float, help="Latency of every stub prediction", default=20)
+    parser.add_argument("--stub_item_latency_ms", type=float, help="Extra stub latency per input", default=2)
+    parser.add_argument("--report_json", type=str, help="Path to save the run report", default=None)
+    return parser.parse_args()
+
+
+def init_worker(args):
+    """Initialize score.py in the current process."""
+    # every worker of the pool loads its own model
+    prepare_environment(args, num_workers=1)
+    if args.stub_model:
+        score.Deployment = StubDeployment
+    score.init()
+    if score.DEPLOY_OBJ is None:
+        raise RuntimeError("score.init failed, see the logs above")
+
+
+def score_chunk(chunk):
+    """Score one chunk of records through score.run and return its output rows and latency."""
+    start = time.monotonic()
+    sentences = [record["sentence"] for _, record in chunk]
+    body = json.dumps({"inputs": sentences})
+    with _APP.test_request_context("/score", method="POST", data=body, content_type="application/json"):
+        predictions = json.loads(score.run(body))
+    if isinstance(predictions, dict) and predictions.get("msg") == "failed":
+        rows = [[row, record.get("idx"), record["sentence"], json.dumps(predictions)] for row, record in chunk]
+    else:
+        rows = []
+        for (row, record), prediction in zip(chunk, split_predictions(predictions, [1] * len(chunk))):
+            if isinstance(prediction, dict):
+                prediction = {key: value[0] for key, value in prediction.items()}
+            else:
+                prediction = prediction[0]
+            if not isinstance(prediction, str):
+                prediction = json.dumps(prediction)
+            rows.append([row, record.get("idx"), record["sentence"], prediction])
+    return rows, time.monotonic() - start
+
+
+def read_chunks(input_file, mini_batch_size, skip_rows):
+    """Yield chunks of (row number, record) read lazily from the JSONL file, skipping already scored rows."""
+    chunk = []
+    with open(input_file, encoding="utf-8") as f:
+        row = -1
+        for line in f:
+            if not line.strip():
+                continue
+            row += 1
+            if row < skip_rows:
+                continue
+            chunk.append((row, json.loads(line)))
+            if len(chunk) == mini_batch_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def input_identity(input_file):
+    """Identify `input_file` by its resolved path, size and modification time, whatever path it is given by."""
+    stat = os.stat(input_file)
+    return {"path": os.path.realpath(input_file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_checkpoint(args):
+    """Return the checkpoint of a previous run and truncate the output to the rows it covers."""
+    checkpoint = {"chunks_done": 0, "rows_done": 0, "output_offset": 0}
+    if os.path.exists(args.checkpoint_file):
+        with open(args.checkpoint_file) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("mini_batch_size") != args.mini_batch_size:
+            raise ValueError(
+                f"Checkpoint was written with mini_batch_size {checkpoint.get('mini_batch_size')}, "
+                f"resume with the same value or delete {args.checkpoint_file}"
+            )
+        # a file rewritten under the same name would be resumed at rows and offsets of the old one
+        if checkpoint.get("input_file") != input_identity(args.input_file):
+            raise ValueError(
+                f"Checkpoint was written for input_file {checkpoint.get('input_file')}, "
+                f"resume with the same unchanged file or delete {args.checkpoint_file}"
+            )
+        print(f"Resuming after {checkpoint['rows_done']} rows")
+    if os.path.exists(args.output_file):
+        # drop rows written after the last checkpoint
+        with open(args.output_file, "r+b") as f:
+            f.truncate(checkpoint["output_offset"])
+    return checkpoint
+
+
+def save_checkpoint(args, checkpoint):
+    checkpoint_tmp = f"{args.checkpoint_file}.tmp"
+    with open(checkpoint_tmp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(checkpoint_tmp, args.checkpoint_file)
+
+
+def main():
+    args = parse_args()
+    print(args)
+    if args.checkpoint_file is None:
+        args.checkpoint_file = f"{args.output_file}.checkpoint.json"
+
+    checkpoint = load_checkpoint(args)
+    checkpoint.update({"input_file": input_identity(args.input_file), "mini_batch_size": args.mini_batch_size})
+
+    if args.executor == "thread":
+        init_worker(args)
+        executor = ThreadPoolExecutor(max_workers=args.max_concurrency)
+    else:
+        executor = ProcessPoolExecutor(max_workers=args.max_concurrency, initializer=init_worker, initargs=(args,))
+
+    chunk_latencies = []
+    rows_scored = 0
+    start = time.monotonic()
+    with executor, open(args.output_file, "a", newline="", encoding="utf-8") as output:
+        writer = csv.writer(output)
+        if checkpoint["output_offset"] == 0:
+            writer.writerow(OUTPUT_COLUMNS)
+        chunks = read_chunks(args.input_file, args.mini_batch_size, checkpoint["rows_done"])
+        in_flight = {}
+        completed = {}
+        next_submit = next_flush = checkpoint["chunks_done"]
+        exhausted = False
+        while True:
+            # keep at most two chunks per worker in memory
+            while not exhausted and len(in_flight) + len(completed) < 2 * args.max_concurrency:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                in_flight[executor.submit(score_chunk, chunk)] = next_submit
+                next_submit += 1
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                completed[in_flight.pop(future)] = future.result()
+            # append rows in input order so the checkpoint is a plain prefix of the input
+            while next_flush in completed:
+                rows, latency = completed.pop(next_flush)
+                writer.writerows(rows)
+                output.flush()
+                chunk_latencies.append(latency)
+                rows_scored += len(rows)
+                next_flush += 1
+                checkpoint.update({
+                    "chunks_done": next_flush,
+                    "rows_done": checkpoint["rows_done"] + len(rows),
+                    "output_offset": os.fstat(output.fileno()).st_size,
+                })
+                save_checkpoint(args, checkpoint)
+    duration_s = time.monotonic() - start
+
+    chunk_latencies.sort()
+    report = {
+        "rows_scored": rows_scored,
+        "rows_total": checkpoint["rows_done"],
+        "duration_s": round(duration_s, 3),
+        "rows_per_s": round(rows_scored / duration_s, 3) if duration_s else 0.0,
+        "mini_batch_size": args.mini_batch_size,
+        "max_concurrency": args.max_concurrency,
+        "executor": args.executor,
+        "chunk_latency_ms": {
+            "p50": round(percentile(chunk_latencies, 50) * 1000, 3),
+            "p95": round(percentile(chunk_latencies, 95) * 1000, 3),
+            "max": round(chunk_latencies[-1] * 1000, 3) if chunk_latencies else 0.0,
+        },
+    }
+    print(json.dumps(report, indent=2))
+    if args.report_json:
+        with open(args.report_json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+Local evaluation of model directories through score.init/run against a labeled JSONL file.
+
+The file is streamed in chunks of `mini_batch_size` records scored by a pool of `max_concurrency`
+processes, each loading the model once through score.init. Accuracy and F1 against the `label`
+column are updated as chunks complete, together with the throughput and the latency of every chunk.
+Given several `--model_dir`, every model is evaluated on the same file and the reports are compared
+side by side:
+
+    python local_evaluate.py --input_file ../../datasets/validation.jsonl --model_dir model_a model_b
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from local_batch_score import init_worker, score_chunk, read_chunks
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create_deployment"))
+
+from load_generator import percentile  # noqa: E402
+
+UNLABELED = -1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate model directories locally with score.py")
+    parser.add_argument("--input_file", type=str, help="JSONL file with sentence and label columns", required=True)
+    parser.add_argument("--model_dir", type=str, nargs="+", help="Local model directories to compare", default=["model"])
+    parser.add_argument("--label_column", type=str, help="Column holding the label id", default="label")
+    parser.add_argument(
+        "--labels",
+        type=str,
+        nargs="+",
+        help="Predicted label names ordered by label id, read from the model config.json when not set",
+        default=None,
+    )
+    parser.add_argument("--mini_batch_size", type=int, help="The number of examples to score per job", default=32)
+    parser.add_argument("--max_concurrency", type=int, help="Maximum number of concurrent jobs", default=2)
+    parser.add_argument("--progress_every", type=int, help="Print the metrics every N chunks", default=10)
+    parser.add_argument(
+        "--env_json",
+        type=str,
+        help="Path of a JSON file with the deployment environment variables built by deploy.py",
+        default=None,
+    )
+    parser.add_argument("--stub_model", action="store_true", help="Score with a stub Deployment instead of a real model")
+    parser.add_argument("--stub_latency_ms", type=float, help="Latency of every stub prediction", default=20)
+    parser.add_argument("--stub_item_latency_ms", type=float, help="Extra stub latency per input", default=2)
+    parser.add_argument("--report_json", type=str, help="Path to save the evaluation report", default=None)
+    return parser.parse_args()
+
+
+def load_label2id(model_dir, labels=None):
+    """Return the label ids of the predicted names, from `labels` or the first config.json of `model_dir`."""
+    if labels:
+        return {name: i for i, name in enumerate(labels)}
+    for root, _, files in os.walk(model_dir):
+        if "config.json" in files:
+            with open(os.path.join(root, "config.json")) as f:
+                config = json.load(f)
+            if "label2id" in config:
+                return {name: int(i) for name, i in config["label2id"].items()}
+            if "id2label" in config:
+                return {name: int(i) for i, name in config["id2label"].items()}
+    return {}
+
+
+def to_label_id(prediction, label2id):
+    """Map a prediction of score.run to a label id, None when it is not a known label."""
+    if prediction in label2id:
+        return label2id[prediction]
+    if isinstance(prediction, str):
+        match = re.fullmatch(r"(?:LABEL_)?(\d+)", prediction.strip())
+        return int(match.group(1)) if match else None
+    return None
+
+
+class StreamingClassificationMetrics:
+    """Accuracy and F1 of single label predictions, updated one chunk at a time."""
+
+    def __init__(self):
+        self.confusion = {}
+        self.errors = 0
+        self.unlabeled = 0
+
+    def update(self, labels, predictions):
+        for label, prediction in zip(labels, predictions):
+            if label == UNLABELED:
+                self.unlabeled += 1
+            elif prediction is None:
+                self.errors += 1
+            else:
+                self.confusion[(label, prediction)] = self.confusion.get((label, prediction), 0) + 1
+
+    def f1(self, label):
+        true_positives = self.confusion.get((label, label), 0)
+        predicted = sum(count for (_, prediction), count in self.confusion.items() if prediction == label)
+        actual = sum(count for (truth, _), count in self.confusion.items() if truth == label)
+        if not true_positives:
+            return 0.0
+        precision, recall = true_positives / predicted, true_positives / actual
+        return 2 * precision * recall / (precision + recall)
+
+    def summary(self):
+        # failed predictions count as wrong
+        scored = sum(self.confusion.values())
+        total = scored + self.errors
+        correct = sum(count for (label, prediction), count in self.confusion.items() if label == prediction)
+        classes = sorted({label for label, _ in self.confusion} | {prediction for _, prediction in self.confusion})
+        summary = {
+            "examples": total,
+            "errors": self.errors,
+            "unlabeled": self.unlabeled,
+            "accuracy": round(correct / total, 4) if total else 0.0,
+            "macro_f1": round(sum(self.f1(label) for label in classes) / len(classes), 4) if classes else 0.0,
+        }
+        if set(classes) <= {0, 1}:
+            summary["f1"] = round(self.f1(1), 4)
+        return summary
+
+
+def wait_barrier(barrier):
+    barrier.wait()
+
+
+def evaluate_model(args, model_dir):
+    """Score `args.input_file` with the model of `model_dir` and return its report and predictions by row."""
+    label2id = load_label2id(model_dir, args.labels)
+    worker_args = argparse.Namespace(**{**vars(args), "model_dir": model_dir})
+    metrics = StreamingClassificationMetrics()
+    predictions = {}
+    chunk_latencies = []
+    rows_scored = 0
+    chunks = read_chunks(args.input_file, args.mini_batch_size, 0)
+    labels = {}
+
+    print(f"Evaluating {model_dir}")
+    executor = ProcessPoolExecutor(
+        max_workers=args.max_concurrency, initializer=init_worker, initargs=(worker_args,)
+    )
+    with executor, multiprocessing.Manager() as manager:
+        # block one task per worker until every worker has loaded its model, so timing only covers scoring
+        barrier = manager.Barrier(args.max_concurrency)
+        wait([executor.submit(wait_barrier, barrier) for _ in range(args.max_concurrency)])
+        start = time.monotonic()
+        in_flight = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < 2 * args.max_concurrency:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                for row, record in chunk:
+                    labels[row] = int(record.get(args.label_column, UNLABELED))
+                in_flight.add(executor.submit(score_chunk, chunk))
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.remove(future)
+                rows, latency = future.result()
+                chunk_labels, chunk_predictions = [], []
+                for row, _, _, prediction in rows:
+                    prediction = to_label_id(prediction, label2id)
+                    predictions[row] = prediction
+                    chunk_labels.append(labels.pop(row))
+                    chunk_predictions.append(prediction)
+                metrics.update(chunk_labels, chunk_predictions)
+                chunk_latencies.append(latency)
+                rows_scored += len(rows)
+                if len(chunk_latencies) % args.progress_every == 0:
+                    print(f"{model_dir}: {rows_scored} rows - {json.dumps(metrics.summary())}")
+        duration_s = time.monotonic() - start
+
+    chunk_latencies.sort()
+    report = {
+        "model_dir": model_dir,
+        "rows_scored": rows_scored,
+        "duration_s": round(duration_s, 3),
+        "rows_per_s": round(rows_scored / duration_s, 3) if duration_s else 0.0,
+        "mini_batch_size": args.mini_batch_size,
+        "max_concurrency": args.max_concurrency,
+        "chunk_latency_ms": {
+            "p50": round(percentile(chunk_latencies, 50) * 1000, 3),
+            "p95": round(percentile(chunk_latencies, 95) * 1000, 3),
+            "max": round(chunk_latencies[-1] * 1000, 3) if chunk_latencies else 0.0,
+        },
+        "metrics": metrics.summary(),
+    }
+    return report, predictions
+
+
+def compare_reports(reports, predictions):
+    """Return the differences of every model against the first one, with the share of equal predictions."""
+    baseline, baseline_predictions = reports[0], predictions[0]
+    comparisons = []
+    for report, model_predictions in zip(reports[1:], predictions[1:]):
+        rows = baseline_predictions.keys() & model_predictions.keys()
+        agreement = sum(baseline_predictions[row] == model_predictions[row] for row in rows)
+        comparisons.append({
+            "baseline": baseline["model_dir"],
+            "model_dir": report["model_dir"],
+            "accuracy_delta": round(report["metrics"]["accuracy"] - baseline["metrics"]["accuracy"], 4),
+            "macro_f1_delta": round(report["metrics"]["macro_f1"] - baseline["metrics"]["macro_f1"], 4),
+            "rows_per_s_ratio": round(report["rows_per_s"] / baseline["rows_per_s"], 3) if baseline["rows_per_s"] else None,
+            "p95_latency_ratio": (
+                round(report["chunk_latency_ms"]["p95"] / baseline["chunk_latency_ms"]["p95"], 3)
+                if baseline["chunk_latency_ms"]["p95"] else None
+            ),
+            "agreement": round(agreement / len(rows), 4) if rows else 0.0,
+        })
+    return comparisons
+
+
+def print_table(reports):
+    columns = ["accuracy", "macro_f1", "rows_per_s", "p50_ms", "p95_ms"]
+    print(f"{'model_dir':<40}" + "".join(f"{column:>12}" for column in columns))
+    for report in reports:
+        values = [
+            report["metrics"]["accuracy"],
+            report["metrics"]["macro_f1"],
+            report["rows_per_s"],
+            report["chunk_latency_ms"]["p50"],
+            report["chunk_latency_ms"]["p95"],
+        ]
+        print(f"{report['model_dir'][-40:]:<40}" + "".join(f"{value:>12}" for value in values))
+
+
+def main():
+    args = parse_args()
+    print(args)
+
+    reports, predictions = [], []
+    for model_dir in args.model_dir:
+        report, model_predictions = evaluate_model(args, model_dir)
+        print(json.dumps(report, indent=2))
+        reports.append(report)
+        predictions.append(model_predictions)
+
+    results = {"input_file": args.input_file, "reports": reports}
+    if len(reports) > 1:
+        results["comparisons"] = compare_reports(reports, predictions)
+        print_table(reports)
+        print(json.dumps(results["comparisons"], indent=2))
+    if args.report_json:
+        with open(args.report_json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
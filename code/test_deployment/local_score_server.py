@@ -0,0 +1,245 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""
+Local async HTTP server serving score.py for load testing without a managed endpoint.
+
+The server mirrors the online request settings of deploy.py: at most
+`max_concurrent_requests_per_instance` requests run `score.run` at once on a bounded
+executor, requests waiting longer than `max_queue_wait_ms` for a slot get a 429 and
+requests running longer than `request_timeout_ms` get a 408.
+
+With `--num_workers` > 1 the model is loaded once, then the server forks that many workers
+sharing the model copy-on-write and the listening socket, every worker pinned to its share of the cores.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create_deployment"))
+
+import score  # noqa: E402
+from workers import run_workers  # noqa: E402
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    408: "Request Timeout",
+    429: "Too Many Requests",
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve score.py locally")
+    parser.add_argument("--host", type=str, help="Host to listen on", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="Port to listen on", default=5001)
+    parser.add_argument("--model_dir", type=str, help="Local model directory, used as AZUREML_MODEL_DIR", default="model")
+    parser.add_argument(
+        "--env_json",
+        type=str,
+        help="Path of a JSON file with the deployment environment variables built by deploy.py",
+        default=None,
+    )
+    parser.add_argument("--stub_model", action="store_true", help="Serve a stub Deployment instead of a real model")
+    parser.add_argument("--stub_latency_ms", type=float, help="Latency of every stub prediction", default=20)
+    parser.add_argument("--stub_item_latency_ms", type=float, help="Extra stub latency per input", default=2)
+    parser.add_argument(
+        "--max_concurrent_requests_per_instance",
+        type=int,
+        help="Maximum concurrent requests to be handled",
+        default=1,
+    )
+    parser.add_argument("--max_queue_wait_ms", type=int, help="Maximum queue wait time of a request in ms", default=500)
+    parser.add_argument("--request_timeout_ms", type=int, help="Request timeout in ms", default=5000)
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        help="Number of preforked worker processes, each serving max_concurrent_requests_per_instance requests",
+        default=1,
+    )
+    return parser.parse_args()
+
+
+class StubDeployment:
+    """Stand-in for `Deployment` sleeping like a model would compute, so no real model is needed."""
+
+    def __init__(self, args):
+        self.latency_s = getattr(args, "stub_latency_ms", 20) / 1000.0
+        self.item_latency_s = getattr(args, "stub_item_latency_ms", 2) / 1000.0
+
+    def prepare_prediction_service(self):
+        pass
+
+    def predict(self, inputs):
+        time.sleep(self.latency_s + self.item_latency_s * len(inputs))
+        return ["acceptable" if len(str(item)) % 2 else "unacceptable" for item in inputs]
+
+
+class LocalScoringServer:
+    """Minimal HTTP/1.1 server routing `POST /score` to `score.run` with endpoint like backpressure."""
+
+    def __init__(self, max_concurrent_requests, max_queue_wait_ms, request_timeout_ms):
+        self.app = Flask(__name__)
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_queue_wait_s = max_queue_wait_ms / 1000.0
+        self.request_timeout_s = request_timeout_ms / 1000.0
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_requests, thread_name_prefix="score")
+        self.slots = None
+        self.counters = {"accepted": 0, "queue_timeouts": 0, "request_timeouts": 0}
+
+    def _run(self, body, content_type):
+        """Call `score.run` inside a flask request context, as the inference server does."""
+        with self.app.test_request_context("/score", method="POST", data=body, content_type=content_type):
+            return score.run(body)
+
+    async def score(self, body, headers):
+        """Wait for a free slot, then score the request on the executor."""
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout=self.max_queue_wait_s)
+        except asyncio.TimeoutError:
+            self.counters["queue_timeouts"] += 1
+            return 429, {"message": "Request waited longer than max_queue_wait_ms"}
+        self.counters["accepted"] += 1
+        loop = asyncio.get_running_loop()
+        content_type = headers.get("content-type", "application/json")
+        future = loop.run_in_executor(self.executor, self._run, body, content_type)
+        # the slot is only freed once the work is done, even when the client already timed out
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return 200, await asyncio.wait_for(asyncio.shield(future), timeout=self.request_timeout_s)
+        except asyncio.TimeoutError:
+            self.counters["request_timeouts"] += 1
+            return 408, {"message": "Request took longer than request_timeout_ms"}
+
+    async def dispatch(self, method, path, headers, body):
+        if method == "POST" and path.split("?")[0] == "/score":
+            return await self.score(body, headers)
+        if method == "GET" and path == "/":
+            return 200, "Healthy"
+        if method == "GET" and path == "/metrics":
+            return 200, {"pid": os.getpid(), "server": self.counters, "stages": score.STAGE_METRICS.summary()}
+        return 404, {"message": f"No route for {method} {path}"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, _ = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, 400, {"message": "Malformed request line"}, keep_alive=False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload = await self.dispatch(method, path, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        # score.run already returns encoded json
+        body = (payload if isinstance(payload, str) else json.dumps(payload)).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def serve(self, host=None, port=None, sock=None):
+        """Serve on `host`:`port`, or on the already listening `sock` shared by preforked workers."""
+        self.slots = asyncio.Semaphore(self.max_concurrent_requests)
+        if sock is not None:
+            server = await asyncio.start_server(self.handle_connection, sock=sock)
+            host, port = sock.getsockname()[:2]
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        print(f"Serving score.py on http://{host}:{port}/score (pid {os.getpid()})")
+        async with server:
+            await server.serve_forever()
+
+
+def prepare_environment(args, num_workers=1):
+    """
+    Set the environment variables score.init reads on a managed endpoint.
+
+    With `num_workers` > 1, score.init prepares the model for workers forked after it.
+    """
+    env_var = {}
+    if args.env_json is not None:
+        with open(args.env_json) as f:
+            env_var = json.load(f)
+    model_dir = os.path.abspath(args.model_dir)
+    env_var.setdefault("parent_dir_name", os.path.basename(model_dir))
+    if num_workers > 1:
+        env_var["prefork"] = True
+        env_var["num_workers"] = num_workers
+    if args.stub_model:
+        env_var["stub_latency_ms"] = args.stub_latency_ms
+        env_var["stub_item_latency_ms"] = args.stub_item_latency_ms
+    os.environ[score.SaveFileConstants.DeploymentSaveKey] = json.dumps(env_var)
+    os.environ["AZUREML_MODEL_DIR"] = model_dir
+
+
+def main():
+    args = parse_args()
+    print(args)
+
+    prepare_environment(args, args.num_workers)
+    if args.stub_model:
+        score.Deployment = StubDeployment
+    score.init()
+    if score.DEPLOY_OBJ is None:
+        raise RuntimeError("score.init failed, see the logs above")
+
+    def create_server():
+        return LocalScoringServer(
+            args.max_concurrent_requests_per_instance,
+            args.max_queue_wait_ms,
+            args.request_timeout_ms,
+        )
+
+    if args.num_workers <= 1:
+        asyncio.run(create_server().serve(args.host, args.port))
+        return
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(1024)
+    sock.setblocking(False)
+
+    def serve_worker(index, cores):
+        score.prepare_worker(cores)
+        asyncio.run(create_server().serve(sock=sock))
+
+    print(f"Forking {args.num_workers} workers on http://{args.host}:{args.port}/score")
+    run_workers(args.num_workers, serve_worker)
+
+
+if __name__ == "__main__":
+    main()
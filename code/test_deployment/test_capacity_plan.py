@@ -0,0 +1,76 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Check the capacity planning of capacity_plan.py offline on synthetic benchmark results."""
+
+import os
+import sys
+import json
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create_deployment"))
+
+from capacity_plan import load_benchmark_runs, plan_capacity, plan_from_benchmarks, select_run  # noqa: E402
+
+
+def write_benchmark(directory, concurrency, throughput_rps, p95_ms, error_rate=0.0):
+    """Write a result file in the format of benchmark_online_endpoint.py."""
+    path = os.path.join(directory, f"benchmark_c{concurrency}.json")
+    summary = {"throughput_rps": throughput_rps, "error_rate": error_rate, "latency_ms": {"p95": p95_ms}}
+    with open(path, "w") as f:
+        json.dump({"concurrency": concurrency, "summary": summary}, f)
+    return path
+
+
+def check_select_run():
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [
+            write_benchmark(directory, 1, 20.0, 60.0),
+            write_benchmark(directory, 4, 55.0, 140.0),
+            write_benchmark(directory, 8, 70.0, 310.0),
+            write_benchmark(directory, 6, 65.0, 180.0, error_rate=0.05),
+        ]
+        runs = [run for path in paths for run in load_benchmark_runs(path)]
+    run = select_run(runs, target_p95_ms=200, max_error_rate=0.01)
+    assert run["concurrency"] == 4, run
+    try:
+        select_run(runs, target_p95_ms=10)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a target no run meets should fail")
+    print(f"select_run: concurrency {run['concurrency']} at {run['throughput_rps']} rps")
+    return runs
+
+
+def check_plan_capacity():
+    # 50 rps per instance planned at 70% -> 35 rps per instance
+    plan = plan_capacity(50, peak_rps=120, baseline_rps=20, target_utilization_percentage=70)
+    assert (plan["min_instances"], plan["max_instances"], plan["instance_count"]) == (1, 4, 1), plan
+    plan = plan_capacity(50, peak_rps=1000, baseline_rps=100, max_instances_limit=10)
+    assert (plan["min_instances"], plan["max_instances"]) == (3, 10) and "warning" in plan, plan
+    plan = plan_capacity(50, peak_rps=10, baseline_rps=0, min_instances=2)
+    assert (plan["min_instances"], plan["max_instances"]) == (2, 2), plan
+    print("plan_capacity: instance counts as expected")
+
+
+def check_plan_from_benchmarks(runs):
+    plan = plan_from_benchmarks(
+        runs, peak_rps=200, target_p95_ms=200, baseline_rps=40, benchmark_instance_count=2,
+        max_concurrent_requests_per_instance=4,
+    )
+    # the best run is 55 rps on 2 instances -> 27.5 rps per instance, 19.25 planned
+    assert plan["rps_per_instance"] == 27.5 and plan["max_instances"] == 11 and plan["min_instances"] == 3, plan
+    assert plan["max_concurrent_requests_per_instance"] == 4
+    print(f"plan_from_benchmarks: {json.dumps({key: plan[key] for key in ('min_instances', 'max_instances')})}")
+
+
+def main():
+    runs = check_select_run()
+    check_plan_capacity()
+    check_plan_from_benchmarks(runs)
+    print("Capacity plan checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Check the json codecs of json_codec.py encode the same predictions alike, non-finite scores included."""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create_deployment"))
+
+from json_codec import CODECS, orjson  # noqa: E402
+
+
+def encode_all(content):
+    """Return the output of every installed codec for `content`, or the type of the error it raised."""
+    outputs = {}
+    for name, codec_class in CODECS.items():
+        if name == "orjson" and orjson is None:
+            continue
+        try:
+            outputs[name] = codec_class().encode(content)
+        except ValueError as e:
+            outputs[name] = type(e).__name__
+    return outputs
+
+
+def check_same_output(content):
+    outputs = encode_all(content)
+    assert len(set(outputs.values())) == 1, f"codecs disagree on {content!r}: {outputs}"
+    return next(iter(outputs.values()))
+
+
+def main():
+    if orjson is None:
+        print("orjson is not installed, only the stdlib codec is checked")
+    finite = [{"label": "acceptable", "score": np.float32(0.75)}, {"label": "unacceptable", "score": 0.25, "x": None}]
+    print(f"finite scores: {check_same_output(finite)}")
+    for score in (float("nan"), float("inf"), np.float32("-inf")):
+        output = check_same_output([{"label": "acceptable", "score": score}])
+        assert output == "ValueError", f"non-finite score {score} was encoded as {output}"
+        output = check_same_output({"scores": np.array([[0.5, score]], dtype=np.float32)})
+        assert output == "ValueError", f"non-finite score {score} in an array was encoded as {output}"
+    print("non-finite scores: ValueError with every codec")
+    print("JSON codec checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+"""Check the latest model version resolution of deploy.py against a fake MLClient with thousands of versions."""
+
+import os
+import sys
+import random
+import argparse
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "create_deployment"))
+
+import model_resolver  # noqa: E402
+from fake_ml_client import FakeMLClient  # noqa: E402
+
+MODEL_NAME = "sample_model_single_label_classification"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Test the latest model version resolution")
+    parser.add_argument("--num_versions", type=int, help="Number of registered versions", default=5000)
+    parser.add_argument("--page_size", type=int, help="Versions per listed page", default=50)
+    return parser.parse_args()
+
+
+def create_client(num_versions, page_size, supports_labels, tagged_version=None):
+    """Register `num_versions` versions in random order, tagging `tagged_version` as latest."""
+    ml_client = FakeMLClient()
+    ml_client.models.page_size = page_size
+    ml_client.models.supports_labels = supports_labels
+    versions = list(range(1, num_versions + 1))
+    random.Random(0).shuffle(versions)
+    for version in versions:
+        tags = {"latest": "true"} if version == tagged_version else {}
+        ml_client.models.add(SimpleNamespace(name=MODEL_NAME, version=str(version), tags=tags))
+    return ml_client
+
+
+def check_label(args):
+    ml_client = create_client(args.num_versions, args.page_size, supports_labels=True)
+    model = model_resolver.resolve_latest_model(ml_client, MODEL_NAME)
+    assert model.version == str(args.num_versions), model.version
+    assert ml_client.count_calls("models", "list_page") == 0, "the label should avoid listing"
+    assert model_resolver.resolve_latest_model(ml_client, MODEL_NAME) is model
+    assert ml_client.count_calls("models", "get") == 1, "the resolved model should be cached"
+    print(f"label: resolved version {model.version} with {len(ml_client.calls)} calls")
+
+
+def check_scan(args):
+    ml_client = create_client(args.num_versions, args.page_size, supports_labels=False)
+    model = model_resolver.resolve_latest_model(ml_client, MODEL_NAME)
+    pages = ml_client.count_calls("models", "list_page")
+    assert model.version == str(args.num_versions), model.version
+    assert pages == -(-args.num_versions // args.page_size), pages
+    # only the failed label lookup, the listed object is returned as is
+    assert ml_client.count_calls("models", "get") == 1
+    print(f"scan: resolved version {model.version} reading {pages} pages")
+
+
+def check_tag(args):
+    tagged_version = args.num_versions // 3
+    ml_client = create_client(args.num_versions, args.page_size, supports_labels=False, tagged_version=tagged_version)
+    model = model_resolver.resolve_latest_model(ml_client, MODEL_NAME)
+    pages = ml_client.count_calls("models", "list_page")
+    total_pages = -(-args.num_versions // args.page_size)
+    assert model.version == str(tagged_version), model.version
+    assert pages < total_pages or total_pages == 1, "listing should stop at the tagged version"
+    print(f"tag: resolved version {model.version} reading {pages} of {total_pages} pages")
+
+
+def main():
+    args = parse_args()
+    print(args)
+
+    check_label(args)
+    check_scan(args)
+    check_tag(args)
+    print("Model resolver checks passed")
+
+
+if __name__ == "__main__":
+    main()